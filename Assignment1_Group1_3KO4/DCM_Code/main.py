@@ -6,7 +6,7 @@ import tkinter.font as tkFont
 import bcrypt
 
 # Constants
-MAX_USERS = 10
+MAX_USERS = None  # No limit on accounts; set a number to cap registrations
 USERS_FILE = 'users.json'
 
 class PacemakerApp:
@@ -58,7 +58,7 @@ class PacemakerApp:
             messagebox.showerror("Error", "User already exists!") #checking if the username has already been registed
             return
         
-        if len(self.users) >= MAX_USERS:
+        if MAX_USERS is not None and len(self.users) >= MAX_USERS:
             messagebox.showerror("Error", "Maximum user limit reached!") #checking if their is space for a user
             return
         
@@ -0,0 +1,276 @@
+import math
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+import numpy as np
+
+from egm_filter import EGMFilter
+
+REFRACTORY = 0.25  # Seconds after a detection in which the channel ignores everything
+PEAK_WINDOW = 0.1  # Seconds after a threshold crossing searched for the beat's peak
+THRESHOLD_FRACTION = 0.4  # Detection threshold, as a fraction of the running peak estimate
+PEAK_ADAPTATION = 0.125  # Weight of each new beat's peak in the running estimate
+LEARNING_TIME = 2.0  # Seconds of signal used to set the first threshold
+SEARCH_TIMEOUT = 2.5  # Seconds without a beat before the threshold is halved
+NOISE_FACTOR = 6.0  # Lowest threshold, in multiples of the mean noise magnitude
+NOISE_TIME = 2.0  # Seconds over which the noise estimate adapts
+FAR_FIELD_BLANKING = (-0.05, 0.15)  # Seconds around the other channel's beats that are ignored
+PACE_SPIKE_FRACTION = 0.3  # Spike size, relative to the beat, that marks a pacing artifact
+PACE_LOOKBACK = 2  # Samples before a crossing checked for the pacing artifact
+RATE_TOLERANCE = 3  # ppm a paced rate may stray outside the programmed limits
+RECENT_BEATS = 16  # Beats remembered for blanking the other channel
+
+# One detected depolarization
+#   index: sample number since the detector started
+#   time: seconds since the detector started
+#   paced: True if it followed a pacing artifact
+#   amplitude: peak of the filtered signal in the beat
+#   interval: seconds since the previous beat (None for the first)
+Beat = namedtuple("Beat", ("index", "time", "paced", "amplitude", "interval"))
+
+
+class RateStats:
+    """
+    Rolling beat statistics for one chamber, updated in O(1) per beat.
+
+    The R-R interval mean and variance use Welford's algorithm, so they
+    stay accurate over long sessions without keeping the intervals.
+    Intervals between two consecutive paced beats are checked against the
+    programmed rate limits as they arrive; an interval that ends in a
+    paced beat after a sensed one is left out, since sensing legitimately
+    changes when the next pulse is due.
+    """
+
+    def __init__(self, lower_rate=None, upper_rate=None):
+        self.lower_rate = lower_rate
+        self.upper_rate = upper_rate
+        self.reset()
+
+    def reset(self):
+        self.beats = 0
+        self.paced = 0
+        self.sensed = 0
+        self.intervals = 0
+        self.mean_interval = 0.0
+        self._m2 = 0.0  # Sum of squared differences from the mean (Welford)
+        self.last_interval = None
+        self.last_paced = False  # Whether the previous beat was paced
+        self.slowest_paced = None  # Lowest paced rate seen (ppm)
+        self.fastest_paced = None
+        self.paced_below_lower = 0  # Paced intervals slower than the Lower Rate Limit
+        self.paced_above_upper = 0  # Paced intervals faster than the upper limit
+
+    def add(self, interval, paced):
+        """
+        Records one beat.
+        :param interval: Seconds since the previous beat, or None.
+        :param paced: True for a paced beat, False for a sensed one.
+        """
+        self.beats += 1
+        if paced:
+            self.paced += 1
+        else:
+            self.sensed += 1
+        follows_pace, self.last_paced = self.last_paced, paced
+        if interval is None or interval <= 0:
+            return
+
+        self.intervals += 1
+        delta = interval - self.mean_interval
+        self.mean_interval += delta / self.intervals
+        self._m2 += delta * (interval - self.mean_interval)
+        self.last_interval = interval
+
+        if paced and follows_pace:
+            rate = 60 / interval
+            self.slowest_paced = rate if self.slowest_paced is None else min(self.slowest_paced, rate)
+            self.fastest_paced = rate if self.fastest_paced is None else max(self.fastest_paced, rate)
+            if self.lower_rate is not None and rate < self.lower_rate - RATE_TOLERANCE:
+                self.paced_below_lower += 1
+            if self.upper_rate is not None and rate > self.upper_rate + RATE_TOLERANCE:
+                self.paced_above_upper += 1
+
+    @property
+    def rate(self):
+        """Instantaneous rate (ppm) from the latest interval."""
+        return 60 / self.last_interval if self.last_interval else None
+
+    @property
+    def mean_rate(self):
+        return 60 / self.mean_interval if self.intervals else None
+
+    @property
+    def interval_variance(self):
+        """Sample variance of the R-R intervals (s^2)."""
+        return self._m2 / (self.intervals - 1) if self.intervals > 1 else None
+
+    @property
+    def interval_std(self):
+        variance = self.interval_variance
+        return None if variance is None else math.sqrt(variance)
+
+    @property
+    def paced_fraction(self):
+        return self.paced / self.beats if self.beats else None
+
+    @property
+    def within_limits(self):
+        """False once a paced beat has been outside the programmed limits."""
+        return not (self.paced_below_lower or self.paced_above_upper)
+
+
+class BeatDetector:
+    """
+    Streaming depolarization detector for one EGM channel.
+
+    Chunks are filtered, then every threshold crossing is found with NumPy.
+    Only the crossings are visited in Python, to apply the refractory
+    period, measure the beat and adapt the threshold, so the work per
+    beat is constant. The last PEAK_WINDOW of each chunk is held back until
+    the next one arrives, which is also the detector's latency.
+
+    A beat counts as paced when it starts with a pacing artifact: a jump
+    that reverses within a sample or two and is a sizeable part of the
+    whole beat. Physiological waveforms never turn around that sharply.
+    Artifacts are counted even in the refractory period, since the device
+    can pace right after a beat it didn't sense.
+    """
+
+    def __init__(self, sample_rate, lower_rate=None, upper_rate=None, refractory=REFRACTORY):
+        self.sample_rate = sample_rate
+        self.filter = EGMFilter(sample_rate)
+        self.refractory = max(int(refractory * sample_rate), 1)
+        self.window = max(int(PEAK_WINDOW * sample_rate), 1)
+        self.learning_length = int(LEARNING_TIME * sample_rate)
+        self.timeout = int(SEARCH_TIMEOUT * sample_rate)
+        self.blanking = tuple(int(edge * sample_rate) for edge in FAR_FIELD_BLANKING)
+        self.stats = RateStats(lower_rate, upper_rate)
+        self.recent = deque(maxlen=RECENT_BEATS)  # Sample numbers of the latest beats
+        self.reset()
+
+    def reset(self):
+        # Forget the signal and the statistics, e.g. after switching sources
+        self.filter.reset()
+        self.stats.reset()
+        self.recent.clear()
+        self.raw = None  # Samples carried over from the previous chunk
+        self.filtered = None
+        self.start = -PACE_LOOKBACK  # Sample number of raw[0]
+        self.above = False  # Whether the last examined sample was over the threshold
+        self.learning = []  # Magnitudes seen so far, until the first threshold is set
+        self.learned = 0
+        self.peak = 0.0  # Running estimate of the beat amplitude
+        self.noise = 0.0  # Running estimate of the mean magnitude between beats
+        self.threshold = math.inf  # Nothing is detected while learning
+        self.last_beat = None  # Sample number of the latest beat
+        self.last_decay = 0  # Sample number the threshold was last lowered at
+
+    def process(self, samples, blank=()):
+        """
+        Detects the beats in the next chunk of samples.
+        :param samples: Raw EGM samples (any units and offset).
+        :param blank: Sorted sample numbers of beats on the other channel;
+            crossings just around them are taken as far-field and ignored.
+        :return: A list of Beat tuples, oldest first.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) == 0:
+            return []
+        filtered = self.filter.process(samples)
+        if self.raw is None:
+            # Give the first samples the look-back the artifact check needs
+            self.raw = np.full(PACE_LOOKBACK, samples[0])
+            self.filtered = np.zeros(PACE_LOOKBACK)
+        raw = np.concatenate((self.raw, samples))
+        filtered = np.concatenate((self.filtered, filtered))
+        magnitude = np.abs(filtered)
+
+        # Samples from PACE_LOOKBACK up to the held-back tail are examined now
+        end = len(raw) - self.window
+        beats = []
+        if end > PACE_LOOKBACK:
+            examined = magnitude[PACE_LOOKBACK:end]
+            if self.learning is not None:
+                self._learn(examined, self.start + end)
+            else:
+                self._track_noise(examined)
+            above = examined > self.threshold
+            previous = np.concatenate(([self.above], above[:-1]))
+            for offset in np.flatnonzero(above & ~previous) + PACE_LOOKBACK:
+                beat = self._examine(raw, magnitude, offset, blank)
+                if beat is not None:
+                    beats.append(beat)
+            self.above = bool(above[-1])
+            self._decay(self.start + end)
+            keep = len(raw) - end + PACE_LOOKBACK
+        else:
+            keep = len(raw)
+
+        self.start += len(raw) - keep
+        self.raw = raw[len(raw) - keep:]
+        self.filtered = filtered[len(filtered) - keep:]
+        return beats
+
+    def _learn(self, examined, index):
+        # The first threshold comes from the largest peak in the learning period,
+        # and the first noise level from its median (which beats barely move)
+        self.learning.append(examined)
+        self.learned += len(examined)
+        if self.learned < self.learning_length:
+            return
+        learned = np.concatenate(self.learning)
+        self.learning = None
+        self.peak = float(learned.max())
+        self.noise = float(np.median(learned))
+        self._set_threshold()
+        self.last_decay = index
+
+    def _track_noise(self, examined):
+        # Follow the level of the samples below the threshold
+        quiet = examined[examined < self.threshold]
+        if len(quiet):
+            weight = min(len(quiet) / (NOISE_TIME * self.sample_rate), 1.0)
+            self.noise += weight * (float(quiet.mean()) - self.noise)
+            self._set_threshold()
+
+    def _set_threshold(self):
+        self.threshold = max(THRESHOLD_FRACTION * self.peak, NOISE_FACTOR * self.noise)
+
+    def _examine(self, raw, magnitude, offset, blank):
+        # Decide whether a threshold crossing is a beat, and record it
+        index = self.start + offset
+        since_last = index - self.last_beat if self.last_beat is not None else None
+        if since_last is not None and since_last < self.window:
+            return None  # Still inside the previous beat
+        if blank:
+            nearest = bisect_left(blank, index - self.blanking[1])
+            if nearest < len(blank) and blank[nearest] <= index - self.blanking[0]:
+                return None  # The other chamber's beat seen from a distance
+
+        amplitude = float(magnitude[offset:offset + self.window].max())
+        if amplitude < self.threshold:
+            return None  # Crossed a threshold that has since been raised
+
+        segment = raw[offset - PACE_LOOKBACK:offset + self.window]
+        steps = np.diff(segment)
+        reversals = (steps[:-1] * steps[1:]) < 0
+        spike = float(np.minimum(np.abs(steps[:-1]), np.abs(steps[1:]))[reversals].max(initial=0.0))
+        paced = spike > max(PACE_SPIKE_FRACTION * float(np.ptp(segment)), NOISE_FACTOR * self.noise)
+        if since_last is not None and since_last < self.refractory and not paced:
+            return None
+
+        interval = since_last / self.sample_rate if since_last is not None else None
+        self.last_beat = index
+        self.last_decay = index
+        self.recent.append(index)
+        self.peak += PEAK_ADAPTATION * (amplitude - self.peak)
+        self._set_threshold()
+        self.stats.add(interval, paced)
+        return Beat(index, index / self.sample_rate, paced, amplitude, interval)
+
+    def _decay(self, index):
+        # A long pause may mean the threshold is too high (e.g. smaller beats), so lower it
+        if self.threshold < math.inf and index - self.last_decay > self.timeout:
+            self.peak *= 0.5
+            self._set_threshold()
+            self.last_decay = index
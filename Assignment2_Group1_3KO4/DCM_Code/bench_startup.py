@@ -0,0 +1,89 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = 5
+PROBE_TIMEOUT = 60  # Seconds a probe may take before it counts as hung
+HEAVY_MODULES = ("matplotlib", "numpy", "serial", "bcrypt")
+
+# Each probe runs in a fresh interpreter so nothing is already imported.
+# The login window is considered shown once Tk has processed its first idle
+# callback after LoginScreen was built. LoginScreen runs the main loop itself,
+# so the callback is registered first and quits that loop.
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import login_screen
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(m for m in {modules!r} if m in sys.modules))
+"""
+
+WINDOW_PROBE = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+from login_screen import LoginScreen
+root = tk.Tk()
+def shown():
+    print(time.perf_counter() - start, flush=True)
+    root.quit()
+root.after_idle(shown)
+LoginScreen(root)
+root.destroy()
+"""
+
+
+def run_probe(source, timeout=PROBE_TIMEOUT):
+    """
+    Runs a probe in a fresh interpreter.
+    :return: An (output, error) tuple: the probe's stdout and None, or None
+        and why it failed (e.g. no display, or it hung past the timeout).
+    """
+    try:
+        result = subprocess.run([sys.executable, "-c", source], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None, f"timed out after {timeout} s"
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return None, lines[-1] if lines else f"exit status {result.returncode}"
+    return result.stdout.strip(), None
+
+
+def measure(runs=RUNS):
+    """
+    Times a cold start of the login screen.
+    :return: A dictionary of median timings in milliseconds, the heavy
+        modules that were loaded before the login window appeared and, if
+        the window couldn't be timed, why.
+    """
+    import_times = []
+    loaded = ""
+    for _ in range(runs):
+        output, error = run_probe(IMPORT_PROBE.format(modules=HEAVY_MODULES))
+        if output is None:
+            raise RuntimeError(f"Importing login_screen failed: {error}")
+        elapsed, _, loaded = output.partition(" ")
+        import_times.append(float(elapsed) * 1000)
+
+    window_times = []
+    window_error = None
+    for _ in range(runs):
+        output, window_error = run_probe(WINDOW_PROBE)
+        if output is None:
+            break
+        window_times.append(float(output) * 1000)
+
+    return {
+        "runs": runs,
+        "import_login_screen_ms": round(statistics.median(import_times), 2),
+        "time_to_login_window_ms": round(statistics.median(window_times), 2) if window_times else None,
+        "heavy_modules_loaded": loaded.split(",") if loaded else [],
+        "login_window_error": window_error,
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(measure(int(sys.argv[1]) if len(sys.argv) > 1 else RUNS), indent=2))
@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")  # Must come before heartview imports pyplot
+
+SECTIONS = ("codec", "update_plot", "signal", "filter", "storage", "login", "startup")
+
+# (full, quick) sizes of each benchmark
+CODEC_PACKETS = (50000, 5000)
+PLOT_FRAMES = (300, 60)
+SIGNAL_DURATIONS = ((1, 10, 60, 600), (1, 10, 60))
+STORE_SIZES = ((100, 1000, 10000, 100000), (100, 1000, 10000))
+LOGIN_ROUNDS = ((4, 8, 10, 12), (4, 8))
+REPEATS = (5, 3)
+
+
+def summarize(seconds):
+    """Returns mean, median, 95th percentile and best of a list of timings, in ms."""
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "p50_ms": round(ms[len(ms) // 2], 4),
+        "p95_ms": round(ms[min(int(len(ms) * 0.95), len(ms) - 1)], 4),
+        "min_ms": round(ms[0], 4),
+        "runs": len(ms),
+    }
+
+
+class FakeSerial:
+    # Just enough of serial.Serial for receive_packet() to read from a buffer
+    def __init__(self, data):
+        self.data = memoryview(bytes(data))
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data) - self.pos
+
+    def read(self, size=1):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return bytes(chunk)
+
+
+class FakeFeed:
+    # A TelemetryFeed that is always connected; frames are handed over directly
+    connected = True
+
+
+def telemetry_stream(count):
+    """Returns count valid telemetry frames back to back."""
+    from serialcomm import FN_CODE_ECHO, SYNC, TELEMETRY_STRUCT, crc8
+    out = bytearray()
+    for index in range(count):
+        payload = TELEMETRY_STRUCT.pack(3, 60, 120, 3.5, 3.5, 1.0, 1.0, 320, 250, 0, 6, 3, 30, 1, 5,
+                                        2048 + index % 400, 2048 - index % 400)
+        frame = bytes((FN_CODE_ECHO,)) + payload
+        out += bytes((SYNC,)) + frame + bytes((crc8(frame),))
+    return out
+
+
+def bench_codec(quick):
+    from modes import MODES
+    from serialcomm import FN_CODE_SET_PARAMS, SYNC, FrameDecoder, create_packet, receive_packet
+
+    count = CODEC_PACKETS[quick]
+    encode = {}
+    for mode in MODES:
+        params = {"mode": mode}
+        start = time.perf_counter()
+        for _ in range(count):
+            create_packet(SYNC, FN_CODE_SET_PARAMS, params)
+        encode[mode] = round(count / (time.perf_counter() - start))
+
+    stream = telemetry_stream(count)
+    ser = FakeSerial(stream)
+    decoder = FrameDecoder()
+    start = time.perf_counter()
+    decoded = 0
+    while receive_packet(ser, decoder) is not None:
+        decoded += 1
+    receive_rate = decoded / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    bulk = sum(1 for _ in FrameDecoder().feed(stream))
+    bulk_rate = bulk / (time.perf_counter() - start)
+    return {
+        "create_packet_per_s": encode,
+        "receive_packet_frames_per_s": round(receive_rate),
+        "decoder_bulk_frames_per_s": round(bulk_rate),
+    }
+
+
+def make_heartview(mode="VVI", params=None):
+    """Builds a HeartView on an Agg canvas, without a Tk window."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from heartview import HeartView
+
+    view = HeartView.__new__(HeartView)
+    view.init_state({"mode": mode, "parameters": dict(params or {})})
+    view.create_plot()
+    view.canvas = FigureCanvasAgg(view.fig)
+    return view
+
+
+def bench_update_plot(quick):
+    from heartview import FRAME_INTERVAL_MS, SAMPLE_RATE
+    from serialcomm import TelemetryFrame
+
+    frames = PLOT_FRAMES[quick]
+    results = {}
+    for source in ("simulation", "live"):
+        view = make_heartview()
+        if source == "live":
+            view.telemetry = FakeFeed()
+            view.switch_source = lambda live, view=view: setattr(view, "live", live)
+        view.canvas.draw()
+        background = view.canvas.copy_from_bbox(view.fig.bbox)
+        per_frame = int(SAMPLE_RATE * FRAME_INTERVAL_MS / 1000)
+        update_times, frame_times = [], []
+        for index in range(frames):
+            if source == "live":
+                view.live_frames = [TelemetryFrame(3, 60, 120, 3.5, 3.5, 1, 1, 320, 250, 0, 6, 3, 30, 1, 5,
+                                                   2048 + (index * per_frame + i) % 400, 2048)
+                                    for i in range(per_frame)]
+            # Pretend a full frame interval went by since the last update
+            view.last_frame_time = time.perf_counter() - FRAME_INTERVAL_MS / 1000
+            start = time.perf_counter()
+            artists = view.update_plot(index)
+            updated = time.perf_counter()
+            # What blitting does each frame: restore the background, draw the lines
+            view.canvas.restore_region(background)
+            for artist in artists:
+                artist.axes.draw_artist(artist)
+            done = time.perf_counter()
+            update_times.append(updated - start)
+            frame_times.append(done - start)
+        results[source] = {"update_plot": summarize(update_times), "frame": summarize(frame_times)}
+
+    # A full redraw, as after a resize or a change of y-limits
+    view = make_heartview()
+    draws = []
+    for _ in range(REPEATS[quick] * 4):
+        start = time.perf_counter()
+        view.canvas.draw()
+        draws.append(time.perf_counter() - start)
+    results["full_redraw"] = summarize(draws)
+    return results
+
+
+def bench_signal(quick):
+    view = make_heartview()
+    results = {}
+    for duration in SIGNAL_DURATIONS[quick]:
+        times = []
+        for _ in range(REPEATS[quick]):
+            start = time.perf_counter()
+            view.generate_ventricular_signal(duration)
+            times.append(time.perf_counter() - start)
+        results[f"{duration}s"] = summarize(times)
+    return results
+
+
+def bench_filter(quick):
+    import numpy as np
+    from egm_filter import EGMFilter
+    from heartview import FRAME_INTERVAL_MS, SAMPLE_RATE
+
+    results = {}
+    for sample_rate in (SAMPLE_RATE, 1000):
+        signal = np.random.default_rng(0).normal(2048, 50, sample_rate * 60)
+        start = time.perf_counter()
+        egm_filter = EGMFilter(sample_rate)
+        design = time.perf_counter() - start
+
+        # One plot frame's worth of samples at a time, as HeartView feeds it
+        chunk = max(int(sample_rate * FRAME_INTERVAL_MS / 1000), 1)
+        times = []
+        for offset in range(0, len(signal), chunk):
+            start = time.perf_counter()
+            egm_filter.process(signal[offset:offset + chunk])
+            times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        EGMFilter(sample_rate).process(signal)
+        bulk = time.perf_counter() - start
+        results[f"{sample_rate}Hz"] = {
+            "taps": len(egm_filter.fir.taps),
+            "design_ms": round(design * 1000, 2),
+            "frame_chunk": summarize(times),
+            "samples_per_s": round(len(signal) / bulk),
+        }
+    return results
+
+
+def bench_storage(quick):
+    from user_store import UserStore
+    from utils import Utils
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)  # Utils.save_users() works on ./users.db
+        try:
+            store = UserStore()
+            params = {"Lower Rate Limit (ppm)": 60, "Upper Rate Limit (ppm)": 120}
+            made = 0
+            for size in STORE_SIZES[quick]:
+                users = {f"user{index:06d}": {"password": "x" * 60, "mode": "AOO", "parameters": params}
+                         for index in range(made, size)}
+                store.import_users(users)
+                made = size
+
+                names = [f"user{random.randrange(size):06d}" for _ in range(REPEATS[quick] * 20)]
+                saves = []
+                for index, name in enumerate(names):
+                    start = time.perf_counter()
+                    store.save_settings(name, "AOO", {**params, "Lower Rate Limit (ppm)": 60 + index % 10 * 5})
+                    saves.append(time.perf_counter() - start)
+
+                entry = {"save_settings": summarize(saves)}
+                if size <= 10000:
+                    # The old whole-dictionary API, which upserts every user
+                    everything = store.export_users()
+                    start = time.perf_counter()
+                    Utils.save_users(everything)
+                    entry["save_users_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                results[str(size)] = entry
+            store.close()
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def bench_login(quick):
+    from user_manager import UserManager
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)  # UserManager opens ./users.db
+        try:
+            manager = UserManager(None)
+            for rounds in LOGIN_ROUNDS[quick]:
+                manager.hasher.rounds = rounds
+                name = f"user{rounds}"
+                manager.register(name, "password")
+                logins, cached = [], []
+                for _ in range(REPEATS[quick]):
+                    manager.hasher.forget(name)
+                    start = time.perf_counter()
+                    manager.login(name, "password")
+                    logins.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    manager.login(name, "password")
+                    cached.append(time.perf_counter() - start)
+                results[f"rounds_{rounds}"] = {"login": summarize(logins), "remembered_login": summarize(cached)}
+            manager.users.close()
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def bench_startup(quick):
+    from bench_startup import measure
+    return measure(REPEATS[quick])
+
+
+def revision():
+    # Commit being measured, if this is a git checkout
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(sections=SECTIONS, quick=False):
+    """
+    Runs the selected benchmarks.
+    :return: A JSON-serializable dictionary of results and run details.
+    """
+    report = {
+        "revision": revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": {},
+    }
+    for section in sections:
+        print(f"Running {section}...", file=sys.stderr)
+        report["results"][section] = globals()[f"bench_{section}"](quick)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DCM's hot paths and print the results as JSON.")
+    parser.add_argument("sections", nargs="*", help=f"Benchmarks to run: {', '.join(SECTIONS)} (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes, for a fast check")
+    parser.add_argument("--output", help="Also write the JSON to this file")
+    args = parser.parse_args()
+    for section in args.sections:
+        if section not in SECTIONS:
+            parser.error(f"unknown benchmark '{section}'")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report = run(args.sections or SECTIONS, args.quick)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+import diagnostics
+from serial_reader import SerialReader
+from serialcomm import BAUD_RATE, FrameDecoder, TelemetryFrame, create_echo_request
+
+PROBE_TIMEOUT = 0.5  # Seconds a port has to answer the handshake
+MAX_PROBE_WORKERS = 8
+
+
+def list_serial_ports():
+    """Returns the device names of every serial port on this machine."""
+    return sorted(port.device for port in list_ports.comports())
+
+
+def probe_port(port, baud_rate=BAUD_RATE, timeout=PROBE_TIMEOUT):
+    """
+    Checks whether a pacemaker answers on a port.
+    :param port: Port name, e.g. "COM3" or "/dev/ttyACM0".
+    :return: True if a telemetry frame came back in response to an echo request.
+    """
+    try:
+        with serial.Serial(port, baud_rate, timeout=min(timeout, 0.05)) as ser:
+            ser.reset_input_buffer()
+            ser.write(create_echo_request())
+            sent = time.perf_counter()
+            decoder = FrameDecoder()
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                for frame in decoder.feed(ser.read(ser.in_waiting or 1)):
+                    if type(frame) is TelemetryFrame:
+                        # Echo request out to the first telemetry frame back
+                        diagnostics.record("serial.handshake", time.perf_counter() - sent)
+                        return True
+    except (serial.SerialException, OSError):
+        pass
+    return False
+
+
+class ConnectionPool:
+    """
+    Keeps one warm SerialReader per pacemaker port.
+
+    Readers are opened once and reused across saves, and they reopen their
+    port on their own if it drops. discover() enumerates ports and probes
+    every candidate at the same time.
+    """
+
+    def __init__(self, baud_rate=BAUD_RATE):
+        self.baud_rate = baud_rate
+        self.readers = {}  # port -> SerialReader
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PROBE_WORKERS, thread_name_prefix="PortProbe")
+
+    def get(self, port):
+        """
+        Returns the running reader for a port, starting one if needed.
+        :param port: Port name.
+        :return: A SerialReader (it may still be opening the port).
+        """
+        with self._lock:
+            reader = self.readers.get(port)
+            if reader is None or not reader.is_alive():
+                reader = SerialReader(port, self.baud_rate, reconnect=True)
+                reader.start()
+                self.readers[port] = reader
+            return reader
+
+    def discover(self, ports=None, timeout=PROBE_TIMEOUT):
+        """
+        Finds the ports that have a pacemaker on them.
+        :param ports: Ports to try (default: every enumerated port).
+        :return: A sorted list of port names that answered the handshake.
+        """
+        if ports is None:
+            ports = list_serial_ports()
+        with self._lock:
+            warm = {port for port, reader in self.readers.items() if reader.connected.is_set()}
+
+        # Ports already held open can't be probed again, and are known good
+        candidates = [port for port in ports if port not in warm]
+        results = self._executor.map(lambda port: probe_port(port, self.baud_rate, timeout), candidates)
+        found = {port for port, ok in zip(candidates, results) if ok}
+        return sorted(found | (warm & set(ports)))
+
+    def discover_async(self, ports=None, timeout=PROBE_TIMEOUT):
+        """Runs discover() in the background and returns its Future."""
+        return self._executor.submit(self.discover, ports, timeout)
+
+    def release(self, port):
+        # Close one port and forget its reader
+        with self._lock:
+            reader = self.readers.pop(port, None)
+        if reader is not None:
+            reader.stop()
+
+    def close_all(self):
+        with self._lock:
+            readers = list(self.readers.values())
+            self.readers.clear()
+        for reader in readers:
+            reader.stop()
+        self._executor.shutdown(wait=False)
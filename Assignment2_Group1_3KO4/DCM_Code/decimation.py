@@ -0,0 +1,76 @@
+import numpy as np
+
+LEVEL_FACTOR = 4  # Each level merges this many buckets of the one below
+MIN_LEVEL_LENGTH = 256  # Stop building levels once they get this short
+BUILD_CHUNK = 1 << 20  # Samples reduced at a time while building level 1
+
+
+class MinMaxPyramid:
+    """
+    Level-of-detail view of a long signal.
+
+    Level 0 is the signal itself (a memmap column is fine, it is never
+    copied whole). Level k keeps the min and max of every LEVEL_FACTOR**k
+    samples, so drawing any span at screen resolution touches about as many
+    points as there are pixels, however long the recording is.
+    """
+
+    def __init__(self, signal, factor=LEVEL_FACTOR):
+        self.signal = signal
+        self.factor = factor
+        self.levels = []  # (bucket size, mins, maxs) for level 1 and up
+
+        if len(signal) < factor:
+            return
+
+        # Level 1 comes straight from the signal, a chunk at a time
+        usable = len(signal) - len(signal) % factor
+        mins = np.empty(usable // factor)
+        maxs = np.empty(usable // factor)
+        chunk = BUILD_CHUNK - BUILD_CHUNK % factor
+        for start in range(0, usable, chunk):
+            block = np.asarray(signal[start:min(start + chunk, usable)], dtype=float).reshape(-1, factor)
+            mins[start // factor:start // factor + len(block)] = block.min(axis=1)
+            maxs[start // factor:start // factor + len(block)] = block.max(axis=1)
+        self.levels.append((factor, mins, maxs))
+
+        # Higher levels reduce the level below
+        while len(mins) >= factor * MIN_LEVEL_LENGTH:
+            usable = len(mins) - len(mins) % factor
+            mins = mins[:usable].reshape(-1, factor).min(axis=1)
+            maxs = maxs[:usable].reshape(-1, factor).max(axis=1)
+            self.levels.append((self.levels[-1][0] * factor, mins, maxs))
+
+    def __len__(self):
+        return len(self.signal)
+
+    def query(self, start, stop, max_points):
+        """
+        Returns the samples to draw for signal[start:stop].
+        :param max_points: Roughly how many points the plot can show (its width
+            in pixels); min/max pairs are used once the span is wider.
+        :return: An (indices, values) pair of arrays, indices being sample
+            positions in the full signal.
+        """
+        start = max(int(start), 0)
+        stop = min(int(stop), len(self.signal))
+        if stop <= start:
+            return np.zeros(0), np.zeros(0)
+        if stop - start <= max_points:
+            return np.arange(start, stop), np.asarray(self.signal[start:stop], dtype=float)
+
+        # Coarsest detail that still gives at least max_points / 2 buckets
+        bucket, mins, maxs = self.levels[0]
+        for level in self.levels[1:]:
+            if (stop - start) // level[0] * 2 < max_points:
+                break
+            bucket, mins, maxs = level
+
+        first = start // bucket
+        last = min(-(-stop // bucket), len(mins))
+        count = last - first
+        indices = np.repeat(np.arange(first, last) * bucket + bucket // 2, 2)
+        values = np.empty(2 * count)
+        values[0::2] = mins[first:last]
+        values[1::2] = maxs[first:last]
+        return indices, values
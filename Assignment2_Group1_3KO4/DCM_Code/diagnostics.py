@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# Upper edges of the histogram buckets in seconds: 1, 2, 5 steps from 1 us to
+# 10 s. Anything slower lands in one last overflow bucket.
+BUCKET_BOUNDS = tuple(round(step * 10.0 ** exponent, 6) for exponent in range(-6, 1) for step in (1, 2, 5)) + (10.0,)
+BUCKET_BOUNDS_MS = tuple(round(bound * 1000, 3) for bound in BUCKET_BOUNDS)
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram for one probe point.
+
+    record() is a bisect and a few additions, so probes can stay on in the
+    serial and drawing loops. Percentiles are read from the buckets and are
+    therefore the upper edge of the bucket they fall in.
+    """
+
+    __slots__ = ("name", "counts", "count", "total", "minimum", "maximum", "_lock")
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.minimum = float("inf")
+            self.maximum = 0.0
+
+    def record(self, seconds):
+        """Adds one measurement, in seconds."""
+        bucket = bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds < self.minimum:
+                self.minimum = seconds
+            if seconds > self.maximum:
+                self.maximum = seconds
+
+    def percentile(self, percent):
+        """
+        Estimates a percentile of the recorded latencies.
+        :return: Seconds, or None if nothing was recorded.
+        """
+        with self._lock:
+            return _percentile(list(self.counts), self.count, self.maximum, percent)
+
+    def snapshot(self):
+        """Returns the histogram as a JSON-serializable dictionary (times in ms)."""
+        with self._lock:
+            count, total, minimum, maximum = self.count, self.total, self.minimum, self.maximum
+            counts = list(self.counts)
+        summary = {
+            "name": self.name,
+            "count": count,
+            "mean_ms": total / count * 1000 if count else None,
+            "min_ms": minimum * 1000 if count else None,
+            "max_ms": maximum * 1000 if count else None,
+        }
+        for percent in PERCENTILES:
+            value = _percentile(counts, count, maximum, percent)
+            summary[f"p{percent}_ms"] = None if value is None else value * 1000
+        # Only the non-empty buckets, as [upper edge in ms (None for overflow), count]
+        summary["buckets"] = [[BUCKET_BOUNDS_MS[bucket] if bucket < len(BUCKET_BOUNDS) else None, bucket_count]
+                              for bucket, bucket_count in enumerate(counts) if bucket_count]
+        return summary
+
+
+def _percentile(counts, count, maximum, percent):
+    if not count:
+        return None
+    wanted = count * percent / 100
+    seen = 0
+    for bucket, bucket_count in enumerate(counts):
+        seen += bucket_count
+        if seen >= wanted and bucket_count:
+            # The true value can't be above the largest one recorded
+            return min(BUCKET_BOUNDS[bucket], maximum) if bucket < len(BUCKET_BOUNDS) else maximum
+    return maximum
+
+
+class Timer:
+    """Context manager that records how long its block took."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+# Every probe point in the process, by name ("frame.decode", "plot.update", ...)
+_histograms = {}
+_registry_lock = threading.Lock()
+started_at = time.time()
+
+
+def histogram(name):
+    """Returns the histogram for a probe point, creating it on first use."""
+    hist = _histograms.get(name)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(name, LatencyHistogram(name))
+    return hist
+
+
+def record(name, seconds):
+    histogram(name).record(seconds)
+
+
+def timer(name):
+    """
+    Times a block into the named histogram:
+        with diagnostics.timer("store.save_settings"):
+            ...
+    """
+    return Timer(histogram(name))
+
+
+def timed(name):
+    """Decorator that times every call of a function into the named histogram."""
+    def decorate(fn):
+        hist = histogram(name)
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.record(time.perf_counter() - start)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    """Returns every probe's summary, sorted by name."""
+    with _registry_lock:
+        histograms = sorted(_histograms.values(), key=lambda hist: hist.name)
+    return [hist.snapshot() for hist in histograms]
+
+
+def reset():
+    # Clear the measurements but keep the probe points
+    global started_at
+    with _registry_lock:
+        histograms = list(_histograms.values())
+    for hist in histograms:
+        hist.reset()
+    started_at = time.time()
+
+
+def dump(path):
+    """
+    Writes every probe's summary and buckets to a JSON file.
+    :param path: File to write.
+    """
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+        "written": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "bucket_bounds_ms": list(BUCKET_BOUNDS_MS),
+        "probes": snapshot(),
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,116 @@
+import time
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+import diagnostics
+
+REFRESH_MS = 500  # How often the table is refreshed
+BAR_WIDTH = 40  # Characters in the longest histogram bar
+COLUMNS = (("count", "Count"), ("mean_ms", "Mean"), ("p50_ms", "p50"), ("p95_ms", "p95"),
+           ("p99_ms", "p99"), ("max_ms", "Max"))
+
+
+def format_ms(value):
+    # Milliseconds with enough digits for both microsecond and second timings
+    if value is None:
+        return "-"
+    if value < 1:
+        return f"{value * 1000:.0f} us"
+    if value < 1000:
+        return f"{value:.2f} ms"
+    return f"{value / 1000:.2f} s"
+
+
+class DiagnosticsWindow:
+    """
+    Live view of the latency probes: one row per probe point, with the
+    histogram of the selected one underneath.
+    """
+
+    def __init__(self, master):
+        self.window = tk.Toplevel(master)
+        self.window.title("Diagnostics")
+        self.window.geometry("760x520")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.table = ttk.Treeview(self.window, columns=[key for key, _ in COLUMNS], height=12)
+        self.table.heading("#0", text="Probe")
+        self.table.column("#0", width=160)
+        for key, title in COLUMNS:
+            self.table.heading(key, text=title)
+            self.table.column(key, width=90, anchor="e")
+        self.table.pack(fill=tk.X, padx=10, pady=10)
+        self.table.bind("<<TreeviewSelect>>", lambda event: self.show_buckets())
+
+        self.buckets = tk.Text(self.window, height=12, font=("Courier", 10), state="disabled")
+        self.buckets.pack(fill=tk.BOTH, expand=True, padx=10)
+
+        buttons = tk.Frame(self.window)
+        buttons.pack(pady=10)
+        tk.Button(buttons, text="Reset", command=self.reset, width=12).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Save to File...", command=self.save, width=12).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Close", command=self.close, width=12).pack(side=tk.LEFT, padx=5)
+
+        self.probes = {}  # name -> latest snapshot
+        self.refresh_job = None
+        self.refresh()
+
+    def refresh(self):
+        # Update the rows in place so the selection survives
+        for probe in diagnostics.snapshot():
+            name = probe["name"]
+            values = [probe["count"]] + [format_ms(probe[key]) for key, _ in COLUMNS[1:]]
+            if name in self.probes:
+                self.table.item(name, values=values)
+            else:
+                self.table.insert("", tk.END, iid=name, text=name, values=values)
+            self.probes[name] = probe
+        self.show_buckets()
+        self.refresh_job = self.window.after(REFRESH_MS, self.refresh)
+
+    def show_buckets(self):
+        """Draw the selected probe's histogram as text bars."""
+        lines = []
+        selection = self.table.selection()
+        probe = self.probes.get(selection[0]) if selection else None
+        if probe is None:
+            lines.append("Select a probe to see its latency histogram.")
+        elif probe["buckets"]:
+            largest = max(count for _, count in probe["buckets"])
+            for edge, count in probe["buckets"]:
+                label = f"<= {format_ms(edge)}" if edge is not None else f"> {format_ms(diagnostics.BUCKET_BOUNDS_MS[-1])}"
+                bar = "#" * max(1, round(count / largest * BAR_WIDTH))
+                lines.append(f"{label:>12} {count:>8} {bar}")
+        else:
+            lines.append("No measurements yet.")
+
+        self.buckets.config(state="normal")
+        self.buckets.delete("1.0", tk.END)
+        self.buckets.insert("1.0", "\n".join(lines))
+        self.buckets.config(state="disabled")
+
+    def reset(self):
+        diagnostics.reset()
+        self.refresh_now()
+
+    def refresh_now(self):
+        if self.refresh_job is not None:
+            self.window.after_cancel(self.refresh_job)
+        self.refresh()
+
+    def save(self):
+        path = filedialog.asksaveasfilename(
+            parent=self.window, title="Save Diagnostics", defaultextension=".json",
+            initialfile=time.strftime("diagnostics_%Y%m%d_%H%M%S.json"), filetypes=[("JSON files", "*.json")])
+        if not path:
+            return
+        try:
+            diagnostics.dump(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save diagnostics: {e}", parent=self.window)
+
+    def close(self):
+        if self.refresh_job is not None:
+            self.window.after_cancel(self.refresh_job)
+            self.refresh_job = None
+        self.window.destroy()
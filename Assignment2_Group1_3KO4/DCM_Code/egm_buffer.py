@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class SweepBuffer:
+    """
+    Preallocated circular buffer for one EGM trace.
+
+    New samples overwrite the oldest ones at a moving write index, like the
+    sweep on a bedside monitor, so nothing is shifted or reallocated per
+    frame. A short gap of NaNs ahead of the write index marks the cursor.
+    """
+
+    def __init__(self, size, gap=0):
+        self.size = size
+        self.gap = min(gap, size - 1)
+        self.data = np.full(size, np.nan)
+        self.index = 0  # Position the next sample is written to
+
+    def write(self, samples):
+        # Copy samples in at the write index, wrapping around the end
+        samples = np.asarray(samples, dtype=float)
+        count = len(samples)
+        if count == 0:
+            return
+        if count > self.size:
+            # Only the newest samples can be shown, keep their sweep position
+            self.index = (self.index + count - self.size) % self.size
+            samples = samples[-self.size:]
+            count = self.size
+
+        end = self.index + count
+        if end <= self.size:
+            self.data[self.index:end] = samples
+        else:
+            split = self.size - self.index
+            self.data[self.index:] = samples[:split]
+            self.data[:end - self.size] = samples[split:]
+        self.index = end % self.size
+        self._blank_gap()
+
+    def clear(self):
+        self.data.fill(np.nan)
+        self.index = 0
+
+    def _blank_gap(self):
+        if not self.gap:
+            return
+        end = self.index + self.gap
+        if end <= self.size:
+            self.data[self.index:end] = np.nan
+        else:
+            self.data[self.index:] = np.nan
+            self.data[:end - self.size] = np.nan
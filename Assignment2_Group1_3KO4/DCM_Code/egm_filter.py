@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+
+HIGHPASS_CUTOFF = 1.0  # Hz; removes DC offsets and respiratory baseline wander
+LOWPASS_CUTOFF = 100.0  # Hz; lowered to 0.4 * sample rate when that is below it
+MAINS_FREQUENCY = 60.0  # Hz removed by the notch (50 in Europe, 0 for none)
+NOTCH_Q = 10.0  # Mains frequency / notch bandwidth
+MAX_RESPONSE_SECONDS = 4.0  # Longest impulse response kept for the chain
+RESPONSE_TAIL = 1e-6  # Fraction of the response's energy allowed to be cut off
+
+
+def highpass_section(cutoff, sample_rate):
+    """
+    Second-order Butterworth high-pass, from the bilinear transform.
+    :return: (b, a) coefficients with a[0] == 1.
+    """
+    k = math.tan(math.pi * cutoff / sample_rate)
+    norm = 1 / (1 + math.sqrt(2) * k + k * k)
+    b = (norm, -2 * norm, norm)
+    a = (1.0, 2 * (k * k - 1) * norm, (1 - math.sqrt(2) * k + k * k) * norm)
+    return b, a
+
+
+def lowpass_section(cutoff, sample_rate):
+    """Second-order Butterworth low-pass, as (b, a)."""
+    k = math.tan(math.pi * cutoff / sample_rate)
+    norm = 1 / (1 + math.sqrt(2) * k + k * k)
+    b = (k * k * norm, 2 * k * k * norm, k * k * norm)
+    a = (1.0, 2 * (k * k - 1) * norm, (1 - math.sqrt(2) * k + k * k) * norm)
+    return b, a
+
+
+def notch_section(frequency, q, sample_rate):
+    """Second-order notch with unit gain away from the notch, as (b, a)."""
+    w0 = 2 * math.pi * frequency / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    a0 = 1 + alpha
+    b = (1 / a0, -2 * math.cos(w0) / a0, 1 / a0)
+    a = (1.0, -2 * math.cos(w0) / a0, (1 - alpha) / a0)
+    return b, a
+
+
+def impulse_response(sections, length):
+    """
+    Runs a unit impulse through a cascade of (b, a) sections.
+    This is design-time work, done once per filter.
+    :return: The first `length` samples of the cascade's impulse response.
+    """
+    signal = np.zeros(length)
+    signal[0] = 1.0
+    for b, a in sections:
+        x = signal.tolist()
+        y = [0.0] * length
+        x1 = x2 = y1 = y2 = 0.0
+        for n in range(length):
+            y[n] = b[0] * x[n] + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            x2, x1 = x1, x[n]
+            y2, y1 = y1, y[n]
+        signal = np.array(y)
+    return signal
+
+
+def truncate_response(response, tail=RESPONSE_TAIL):
+    # Drop the end of a decaying response that holds less than `tail` of its energy
+    energy = np.cumsum(response[::-1] ** 2)[::-1]
+    keep = np.flatnonzero(energy > tail * energy[0])
+    return response[:keep[-1] + 1] if len(keep) else response[:1]
+
+
+class FIRStage:
+    """
+    Streaming FIR filter.
+
+    The last len(taps) - 1 input samples are carried between chunks, so
+    filtering a signal chunk by chunk gives exactly the same output as
+    filtering it in one go, at the cost of one np.convolve per chunk.
+    """
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps, dtype=float)
+        self.reset()
+
+    def reset(self, value=0.0):
+        # Start over as if the input had been `value` forever
+        self.history = np.full(len(self.taps) - 1, float(value))
+
+    def process(self, samples):
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) == 0:
+            return samples
+        padded = np.concatenate((self.history, samples))
+        self.history = padded[len(padded) - len(self.history):]
+        return np.convolve(padded, self.taps, mode="valid")
+
+
+class EGMFilter:
+    """
+    Baseline removal, band-pass and mains notch for one EGM channel.
+
+    The chain is designed as second-order IIR sections (high-pass, low-pass,
+    notch). Their combined impulse response decays quickly, so it is cut off
+    once what is left is negligible and applied as one streaming FIR. That
+    keeps the per-chunk work to a single vectorized convolution with no
+    per-sample Python loop, while the output has the short delay of the IIR
+    design rather than that of a linear-phase filter.
+
+    Samples go in chunk by chunk (e.g. each plot frame's worth) and come out
+    the same length.
+    """
+
+    def __init__(self, sample_rate, highpass=HIGHPASS_CUTOFF, lowpass=LOWPASS_CUTOFF,
+                 mains=MAINS_FREQUENCY, notch_q=NOTCH_Q):
+        self.sample_rate = sample_rate
+        self.sections = []
+        if highpass:
+            self.sections.append(highpass_section(highpass, sample_rate))
+        if lowpass:
+            self.sections.append(lowpass_section(min(lowpass, 0.4 * sample_rate), sample_rate))
+        if mains and mains < 0.45 * sample_rate:
+            self.sections.append(notch_section(mains, notch_q, sample_rate))
+
+        response = impulse_response(self.sections, max(int(MAX_RESPONSE_SECONDS * sample_rate), 1))
+        taps = truncate_response(response)
+        if highpass:
+            taps -= taps.sum() / len(taps)  # What the cut-off tail held; keeps DC fully blocked
+        self.fir = FIRStage(taps)
+        self.primed = False
+
+    def reset(self):
+        # Forget the previous signal, e.g. after switching sources
+        self.primed = False
+
+    def process(self, samples):
+        """
+        Filters the next chunk of samples.
+        :return: Filtered samples, as many as were passed in.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) == 0:
+            return samples
+        if not self.primed:
+            # Pretend the first sample had always been there, so a DC offset doesn't ring
+            self.fir.reset(samples[0])
+            self.primed = True
+        return self.fir.process(samples)
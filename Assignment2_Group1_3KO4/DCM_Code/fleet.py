@@ -0,0 +1,115 @@
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from connection_pool import ConnectionPool, list_serial_ports
+from serialcomm import read_user_parameters
+from user_store import DB_FILE
+
+CONNECT_TIMEOUT = 2.0  # Seconds each device has to open its port
+WRITE_TIMEOUT = 2.0  # Seconds each device has to acknowledge a write
+STREAM_LENGTH = 10000  # Frames kept per device
+
+
+class FleetEngine:
+    """
+    Programs and monitors several pacemakers at once.
+
+    Every port gets its own SerialReader from a ConnectionPool, so reads run
+    in parallel, and per-device work (connect, write, wait for the ACK) runs
+    on a thread pool with one task per port. Echoed telemetry is collected
+    into a bounded stream per device.
+    """
+
+    def __init__(self, ports, pool=None, stream_length=STREAM_LENGTH):
+        self.ports = list(ports)
+        self.pool = ConnectionPool() if pool is None else pool
+        self.streams = {port: deque(maxlen=stream_length) for port in self.ports}
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.ports), 1), thread_name_prefix="Fleet")
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """
+        Opens every port.
+        :return: A {port: connected} dictionary.
+        """
+        readers = {port: self.pool.get(port) for port in self.ports}
+        deadline = time.monotonic() + timeout
+        return {
+            port: reader.connected.wait(max(deadline - time.monotonic(), 0))
+            for port, reader in readers.items()
+        }
+
+    def broadcast(self, mode, params, timeout=WRITE_TIMEOUT):
+        """
+        Sends one parameter set to every device and waits for all the ACKs.
+        :return: A {port: WriteRequest or Exception} dictionary.
+        """
+        futures = {port: self._executor.submit(self._program, port, mode, params, timeout) for port in self.ports}
+        results = {}
+        for port, future in futures.items():
+            try:
+                results[port] = future.result()
+            except Exception as e:
+                results[port] = e
+        return results
+
+    def broadcast_user(self, username, users_file=DB_FILE, timeout=WRITE_TIMEOUT):
+        """
+        Sends a user's saved mode and parameters to every device.
+        :raises ValueError: If the user has no saved parameters.
+        """
+        params = read_user_parameters(users_file, username)
+        if params is None:
+            raise ValueError(f"No parameters saved for user '{username}'.")
+        return self.broadcast(params["mode"], params, timeout)
+
+    def collect(self):
+        """
+        Moves telemetry received since the last call into the device streams.
+        :return: A {port: new frames} dictionary.
+        """
+        new_frames = {}
+        for port in self.ports:
+            frames = self.pool.get(port).frames.drain()
+            self.streams[port].extend(frames)
+            new_frames[port] = frames
+        return new_frames
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.pool.close_all()
+
+    def _program(self, port, mode, params, timeout):
+        reader = self.pool.get(port)
+        deadline = time.monotonic() + timeout
+        if not reader.connected.wait(timeout):
+            raise ConnectionError(f"Port {port} did not open.")
+        request = reader.link.send(mode, params)
+        request.wait(max(deadline - time.monotonic(), 0))
+        return request
+
+
+# Main Execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Program a user's saved parameters onto several pacemakers.")
+    parser.add_argument("username", help="User whose saved parameters are sent")
+    parser.add_argument("ports", nargs="*", help="Ports to program (default: every port found)")
+    args = parser.parse_args()
+
+    engine = FleetEngine(args.ports or list_serial_ports())
+    try:
+        for port, connected in engine.connect().items():
+            print(f"{port}: {'connected' if connected else 'not connected'}")
+        for port, result in engine.broadcast_user(args.username).items():
+            if isinstance(result, Exception):
+                print(f"{port}: failed ({result})")
+            elif result.applied:
+                print(f"{port}: applied in {result.round_trip * 1000:.1f} ms")
+            else:
+                print(f"{port}: not applied ({result.error or 'no acknowledgement'})")
+        time.sleep(1)
+        for port, frames in engine.collect().items():
+            print(f"{port}: {len(frames)} telemetry frames")
+    finally:
+        engine.close()
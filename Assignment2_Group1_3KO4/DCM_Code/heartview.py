@@ -1,28 +1,37 @@
+import time
 import tkinter as tk
+from tkinter import filedialog, messagebox
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.animation import FuncAnimation
 import numpy as np
 
+import diagnostics
+from beat_detector import BeatDetector
+from egm_buffer import SweepBuffer
+from egm_filter import EGMFilter
+from modes import PARAM_FOR_MODES
+from recorder import SESSION_DIR, SESSION_SUFFIX
+from replay import MAX_SPEED, MIN_SPEED, SessionPlayer
+from synthesizer import EGMSynthesizer
+
+SAMPLE_RATE = 250  # Samples per second shown on the trace
+WINDOW_SECONDS = 10  # Width of the sweep window
+FRAME_INTERVAL_MS = 33  # About 30 frames per second
+SWEEP_GAP = 10  # Blank samples ahead of the sweep cursor
 
 class HeartView:
-    def __init__(self, master, username, user_manager):
+    def __init__(self, master, username, user_manager, telemetry=None):
         self.window = tk.Toplevel(master)
         self.window.title("HeartView EGM Display")
         self.window.geometry("1000x600")  # Adjusted width for the panel
+        self.window.protocol("WM_DELETE_WINDOW", self.close_heartview)
 
         self.username = username
         self.user_manager = user_manager
-
-        # Fetch user data
-        self.user_data = self.user_manager.users.get(self.username, {})
-        self.saved_values = self.user_data.get("parameters", {})
-        self.mode = self.user_data.get("mode", "Unknown")
-
-        # Extract parameters with defaults if missing
-        self.lower_rate_limit = self.saved_values.get("Lower Rate Limit (ppm)", 60)
-        self.upper_rate_limit = self.saved_values.get("Upper Rate Limit (ppm)", 120)
-        self.amplitude = self.saved_values.get("Atrial Amplitude (V)", 1.0)
+        self.init_state(self.user_manager.users.get(self.username, {}), telemetry)
+        if self.telemetry is not None:
+            self.telemetry.subscribe(self.on_frames)
 
         # Main frame to hold graph and side panel
         main_frame = tk.Frame(self.window)
@@ -32,20 +41,20 @@ class HeartView:
         graph_frame = tk.Frame(main_frame)
         graph_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        self.fig, self.ax = plt.subplots()
-        self.time = np.linspace(0, 10, 1000)  # Simulated 10-second duration
-        self.ventricular_signal = self.generate_ventricular_signal()
-        self.line, = self.ax.plot(self.time, self.ventricular_signal)
-
-        self.ax.set_title("Ventricular Signal (EGM)")
-        self.ax.set_xlabel("Time (s)")
-        self.ax.set_ylabel("Amplitude")
-
+        self.create_plot()
         self.canvas = FigureCanvasTkAgg(self.fig, master=graph_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Time full redraws (resizes, new y-limits) and the per-frame copy to the screen
+        self.canvas.draw = diagnostics.timed("plot.draw")(self.canvas.draw)
+        self.canvas.blit = diagnostics.timed("plot.blit")(self.canvas.blit)
+
+        # Playback controls for recorded sessions
+        self.create_playback_controls(graph_frame)
 
-        # Use FuncAnimation to animate the graph
-        self.ani = FuncAnimation(self.fig, self.update_plot, interval=100)
+        # Use FuncAnimation with blitting so only the lines are redrawn each frame
+        self.last_frame_time = time.perf_counter()  # Don't count building the window as a frame
+        self.ani = FuncAnimation(self.fig, self.update_plot, interval=FRAME_INTERVAL_MS,
+                                 blit=True, cache_frame_data=False)
 
         # Right frame for saved values
         side_panel = tk.Frame(main_frame, width=200, bg="lightgray")
@@ -53,44 +62,386 @@ class HeartView:
 
         tk.Label(side_panel, text="Saved Values", font=("Helvetica", 14, "bold"), bg="lightgray").pack(pady=10)
 
+        # Display where the EGM comes from
+        self.source_label = tk.Label(side_panel, text="Source: Simulation", font=("Helvetica", 12, "bold"), bg="lightgray")
+        self.source_label.pack(anchor="w", padx=10, pady=5)
+
         # Display the mode
         tk.Label(side_panel, text=f"Mode: {self.mode}", font=("Helvetica", 12, "bold"), bg="lightgray").pack(anchor="w", padx=10, pady=5)
 
+        # Rate analytics, checked against the programmed limits
+        lower, upper, upper_name = self.rate_limits()
+        tk.Label(side_panel, text=f"Limits: {lower:g} ppm (LRL) to {upper:g} ppm ({upper_name})",
+                 font=("Helvetica", 11, "bold"), bg="lightgray").pack(anchor="w", padx=10, pady=(5, 0))
+        for chamber in ("V", "A"):
+            label = tk.Label(side_panel, text="", font=("Helvetica", 11), bg="lightgray", justify=tk.LEFT)
+            label.pack(anchor="w", padx=10, pady=2)
+            self.analytics_labels[chamber] = label
+        self.show_analytics()
+
         # Display the saved parameters
         for param, value in self.saved_values.items():
             tk.Label(side_panel, text=f"{param}: {value}", font=("Helvetica", 12), bg="lightgray").pack(anchor="w", padx=10, pady=5)
 
+        # Show the raw samples instead of the filtered ones
+        self.filter_var = tk.BooleanVar(value=self.filtering)
+        tk.Checkbutton(side_panel, text="Filter EGM", variable=self.filter_var, bg="lightgray",
+                       command=lambda: self.set_filtering(self.filter_var.get())).pack(anchor="w", padx=10, pady=5)
+
         # Close button
         close_button = tk.Button(side_panel, text="Close", command=self.close_heartview)
         close_button.pack(pady=10)
 
-    def generate_ventricular_signal(self):
-        """Generate a ventricular signal based on the saved parameters."""
-        # Frequency is influenced by the lower and upper rate limits
-        base_frequency = (self.lower_rate_limit + self.upper_rate_limit) / 120.0  # Normalized
+    def create_plot(self):
+        """Create the figure, the sweep buffers and their lines (no Tk needed)."""
+        # Atrial and ventricular channels share the time axis
+        self.fig, (self.atr_ax, self.vent_ax) = plt.subplots(2, 1, sharex=True)
+        window_samples = SAMPLE_RATE * WINDOW_SECONDS
+        self.time = np.linspace(0, WINDOW_SECONDS, window_samples, endpoint=False)
+
+        # Each trace is drawn from its own preallocated sweep buffer
+        self.atr_trace = SweepBuffer(window_samples, gap=SWEEP_GAP)
+        self.vent_trace = SweepBuffer(window_samples, gap=SWEEP_GAP)
+        self.atr_line, = self.atr_ax.plot(self.time, self.atr_trace.data, color="tab:orange", animated=True)
+        self.vent_line, = self.vent_ax.plot(self.time, self.vent_trace.data, animated=True)
+        self.vent_ax.set_xlim(0, WINDOW_SECONDS)
+        self.set_simulated_limits()
+
+        self.atr_ax.set_title("Atrial Signal (EGM)")
+        self.atr_ax.set_ylabel("Amplitude")
+        self.vent_ax.set_title("Ventricular Signal (EGM)")
+        self.vent_ax.set_xlabel("Time (s)")
+        self.vent_ax.set_ylabel("Amplitude")
+        self.fig.tight_layout()
+
+    def create_synthesizer(self):
+        """Create a synthesizer for the saved mode and parameters."""
+        mode = self.mode if self.mode in PARAM_FOR_MODES else "AOO"
+        return EGMSynthesizer(mode, self.saved_values, SAMPLE_RATE)
+
+    def create_filters(self):
+        """Create the atrial and ventricular filter chains."""
+        return EGMFilter(SAMPLE_RATE), EGMFilter(SAMPLE_RATE)
+
+    def init_state(self, user_data, telemetry=None):
+        """
+        Sets up everything that doesn't need a window: saved values, the
+        signal sources, filters and detectors, and the playback state.
+        :param user_data: The user's saved record ("mode" and "parameters").
+        :param telemetry: TelemetryFeed to take live frames from, if any.
+        """
+        # Live frames come from the interface's telemetry feed when connected
+        self.telemetry = telemetry
+        self.live_frames = []  # Frames received since the last plot update
+        self.live = False
+        self.live_limits = {}  # Y-limits fitted to the live data per axis
+
+        # Fetch user data
+        self.user_data = user_data
+        self.saved_values = self.user_data.get("parameters", {})
+        self.mode = self.user_data.get("mode", "Unknown")
+
+        # Extract parameters with defaults if missing
+        self.lower_rate_limit = self.saved_values.get("Lower Rate Limit (ppm)", 60)
+        self.upper_rate_limit = self.saved_values.get("Upper Rate Limit (ppm)", 120)
+
+        # Simulated EGMs stream from a synthesizer for the saved mode
+        self.synth = self.create_synthesizer()
+
+        # Both sources are filtered chunk by chunk on their way to the plot
+        self.filtering = True
+        self.atr_filter, self.vent_filter = self.create_filters()
+
+        # Beats are detected in the raw samples to check the pacing rate live
+        self.atr_detector, self.vent_detector = self.create_detectors()
+        self.analytics_labels = {}  # Side panel labels per chamber, filled in by the window
 
-        # Amplitude is influenced by the atrial amplitude
-        base_signal = np.sin(2 * np.pi * base_frequency * self.time) * self.amplitude  # Base sinusoidal signal
+        # Playback of recorded sessions
+        self.player = None
+        self.updating_controls = False  # Set while the code moves the sliders
+        self.shown_position = 0.0  # Position last written to the position slider
 
-        # Noise level is a fraction of the amplitude
-        noise_level = 0.1 * self.amplitude
-        noise = np.random.normal(0, noise_level, len(self.time))
+        self.last_frame_time = time.perf_counter()
+        self.pending_samples = 0.0
 
-        ventricular_signal = base_signal + noise
+    def rate_limits(self):
+        """Return (lower, upper, upper name) of the rates pacing should stay within."""
+        # Rate-adaptive modes may pace up to the Maximum Sensor Rate instead
+        if "Maximum Sensor Rate (ppm)" in PARAM_FOR_MODES.get(self.mode, ()):
+            return self.lower_rate_limit, self.saved_values.get("Maximum Sensor Rate (ppm)", 120), "MSR"
+        return self.lower_rate_limit, self.upper_rate_limit, "URL"
 
-        # Add R-peaks (ventricular spikes) influenced by amplitude
-        peak_height = 2 * self.amplitude
-        for i in range(100, len(self.time), int(1000 / base_frequency)):  # Add peaks based on frequency
-            ventricular_signal[i:i + 10] += np.linspace(0, peak_height, 10)  # Sharp upward spike
-            ventricular_signal[i + 10:i + 20] -= np.linspace(peak_height, 0, 10)  # Sharp downward spike
+    def create_detectors(self):
+        """Create the atrial and ventricular beat detectors."""
+        lower, upper, _ = self.rate_limits()
+        return BeatDetector(SAMPLE_RATE, lower, upper), BeatDetector(SAMPLE_RATE, lower, upper)
 
-        return ventricular_signal
+    def generate_atrial_signal(self, duration=WINDOW_SECONDS):
+        """Generate an atrial signal based on the saved parameters."""
+        return self.create_synthesizer().generate(duration)[0]
 
+    def generate_ventricular_signal(self, duration=WINDOW_SECONDS):
+        """Generate a ventricular signal based on the saved parameters."""
+        return self.create_synthesizer().generate(duration)[1]
+
+    @diagnostics.timed("plot.update")
     def update_plot(self, frame):
-        """Shift the signal to create a scrolling effect."""
-        self.ventricular_signal = np.roll(self.ventricular_signal, -6)  # Scroll the signal
-        self.line.set_ydata(self.ventricular_signal)
-        self.canvas.draw()
+        """Write the samples due since the last frame into the sweep buffers."""
+        now = time.perf_counter()
+        elapsed = now - self.last_frame_time
+        self.last_frame_time = now
+        diagnostics.record("plot.frame", elapsed)  # Well above FRAME_INTERVAL_MS means the UI is behind
+
+        if self.player is not None:
+            self.player.advance(elapsed)
+            self.draw_playback()
+            return (self.atr_line, self.vent_line)
+
+        live = self.telemetry is not None and self.telemetry.connected
+        if live != self.live:
+            self.switch_source(live)
+
+        if live:
+            frames = self.live_frames
+            self.live_frames = []
+            if frames:
+                count = len(frames)
+                atrial = np.fromiter((f.atr_electrogram for f in frames), dtype=float, count=count)
+                ventricular = np.fromiter((f.vent_electrogram for f in frames), dtype=float, count=count)
+                self.detect_beats(atrial, ventricular)
+                atrial, ventricular = self.filter_samples(atrial, ventricular)
+                self.write_samples(atrial, ventricular)
+                self.fit_live_limits(self.atr_ax, atrial)
+                self.fit_live_limits(self.vent_ax, ventricular)
+        else:
+            self.pending_samples += elapsed * SAMPLE_RATE
+            count = int(self.pending_samples)
+            if count:
+                self.pending_samples -= count
+                atrial, ventricular = self.next_simulated_samples(count)
+                self.detect_beats(atrial, ventricular)
+                self.write_samples(*self.filter_samples(atrial, ventricular))
+        return (self.atr_line, self.vent_line)
+
+    def detect_beats(self, atrial, ventricular):
+        """Feed one chunk per channel to the beat detectors, updating the panel on new beats."""
+        # Ventricular beats first, so the atrial detector can blank their far-field copies
+        beats = self.vent_detector.process(ventricular)
+        beats += self.atr_detector.process(atrial, blank=list(self.vent_detector.recent))
+        if beats:
+            self.show_analytics()
+
+    def show_analytics(self):
+        """Write each chamber's rate statistics into the side panel."""
+        for chamber, label in self.analytics_labels.items():
+            stats = (self.vent_detector if chamber == "V" else self.atr_detector).stats
+            name = "Ventricle" if chamber == "V" else "Atrium"
+            if stats.rate is None:
+                lines = [f"{name}: waiting for beats"]
+                colour = "black"
+            else:
+                lines = [
+                    f"{name}: {stats.rate:.0f} ppm",
+                    f"  mean {stats.mean_rate:.1f} ppm, R-R SD {(stats.interval_std or 0) * 1000:.0f} ms",
+                    f"  paced {stats.paced}, sensed {stats.sensed}",
+                ]
+                if stats.slowest_paced is not None:
+                    lines.append(f"  paced rate {stats.slowest_paced:.0f}-{stats.fastest_paced:.0f} ppm")
+                problems = []
+                if stats.paced_below_lower:
+                    problems.append(f"{stats.paced_below_lower} below LRL")
+                if stats.paced_above_upper:
+                    problems.append(f"{stats.paced_above_upper} above {self.rate_limits()[2]}")
+                if problems:
+                    lines.append("  outside limits: " + ", ".join(problems))
+                colour = "black" if stats.within_limits else "red"
+            label.config(text="\n".join(lines), fg=colour)
+
+    def filter_samples(self, atrial, ventricular):
+        """Run one chunk per channel through its filter chain, if filtering is on."""
+        if not self.filtering:
+            return atrial, ventricular
+        return self.atr_filter.process(atrial), self.vent_filter.process(ventricular)
+
+    def set_filtering(self, filtering):
+        """Switch between filtered and raw samples, restarting the sweep."""
+        self.filtering = filtering
+        self.atr_filter.reset()
+        self.vent_filter.reset()
+        self.atr_trace.clear()
+        self.vent_trace.clear()
+        self.live_limits = {}  # Raw live data sits around the ADC midpoint, filtered around 0
+
+    def write_samples(self, atrial, ventricular):
+        """Append one chunk per channel and point the lines at the buffers."""
+        self.atr_trace.write(atrial)
+        self.vent_trace.write(ventricular)
+        self.atr_line.set_ydata(self.atr_trace.data)
+        self.vent_line.set_ydata(self.vent_trace.data)
+
+    def next_simulated_samples(self, count):
+        """Return the next samples of the simulated signals."""
+        return self.synth.read(count)
+
+    def on_frames(self, frames):
+        """Telemetry feed callback, keeps frames until the next plot update."""
+        self.live_frames.extend(frames)
+
+    def switch_source(self, live):
+        """Swap between device telemetry and the simulated fallback."""
+        self.live = live
+        self.live_frames = []
+        self.atr_trace.clear()
+        self.vent_trace.clear()
+        self.atr_filter.reset()
+        self.vent_filter.reset()
+        self.atr_detector.reset()
+        self.vent_detector.reset()
+        self.show_analytics()
+        if live:
+            self.live_limits = {}
+            self.source_label.config(text="Source: Live")
+            self.atr_ax.set_ylabel("ADC counts")
+            self.vent_ax.set_ylabel("ADC counts")
+        else:
+            self.source_label.config(text="Source: Simulation")
+            self.atr_ax.set_ylabel("Amplitude")
+            self.vent_ax.set_ylabel("Amplitude")
+            self.set_simulated_limits()
+        self.canvas.draw_idle()
+
+    def set_simulated_limits(self):
+        margin = max(abs(self.synth.pace_amplitude), 4.0) + 0.5
+        self.atr_ax.set_ylim(-margin, margin)
+        self.vent_ax.set_ylim(-margin, margin)
+
+    def fit_live_limits(self, ax, samples):
+        """Grow the y-axis when live samples fall outside it (a full redraw is rare)."""
+        low, high = samples.min(), samples.max()
+        if ax in self.live_limits:
+            current_low, current_high = self.live_limits[ax]
+            if low >= current_low and high <= current_high:
+                return
+            low, high = min(low, current_low), max(high, current_high)
+        margin = 0.1 * (high - low) + 1
+        self.live_limits[ax] = (low - margin, high + margin)
+        ax.set_ylim(*self.live_limits[ax])
+        self.canvas.draw_idle()
+
+    def create_playback_controls(self, frame):
+        controls = tk.Frame(frame)
+        controls.pack(side=tk.BOTTOM, fill=tk.X)
+
+        tk.Button(controls, text="Open Session", command=self.open_session).grid(row=0, column=0, padx=5)
+        self.play_button = tk.Button(controls, text="Pause", command=self.toggle_playback, state=tk.DISABLED)
+        self.play_button.grid(row=0, column=1, padx=5)
+        self.stop_button = tk.Button(controls, text="Stop Playback", command=self.stop_playback, state=tk.DISABLED)
+        self.stop_button.grid(row=0, column=2, padx=5)
+
+        tk.Label(controls, text="Position (s)").grid(row=1, column=0)
+        self.position_slider = tk.Scale(controls, from_=0, to=0, resolution=0.1, orient="horizontal",
+                                        command=self.seek_playback, state=tk.DISABLED)
+        self.position_slider.grid(row=1, column=1, columnspan=3, sticky="ew")
+
+        tk.Label(controls, text="Speed (x)").grid(row=2, column=0)
+        self.speed_slider = tk.Scale(controls, from_=MIN_SPEED, to=MAX_SPEED, orient="horizontal",
+                                     command=self.set_playback_speed)
+        self.speed_slider.grid(row=2, column=1, sticky="ew")
+
+        tk.Label(controls, text="Window (s)").grid(row=2, column=2)
+        self.zoom_slider = tk.Scale(controls, from_=1, to=WINDOW_SECONDS, orient="horizontal",
+                                    command=self.set_playback_window)
+        self.zoom_slider.set(WINDOW_SECONDS)
+        self.zoom_slider.grid(row=2, column=3, sticky="ew")
+        controls.columnconfigure(1, weight=1)
+        controls.columnconfigure(3, weight=1)
+
+    def open_session(self):
+        """Load a recorded session and start playing it back."""
+        path = filedialog.askopenfilename(
+            parent=self.window, initialdir=SESSION_DIR, title="Open Session",
+            filetypes=[("EGM sessions", f"*{SESSION_SUFFIX}"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            player = SessionPlayer(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("HeartView", f"Could not open session: {e}", parent=self.window)
+            return
+
+        self.player = player
+        player.set_speed(self.speed_slider.get())
+        self.source_label.config(text="Source: Playback")
+        for button in (self.play_button, self.stop_button):
+            button.config(state=tk.NORMAL)
+        self.play_button.config(text="Pause")
+
+        duration = max(player.duration, 1)
+        self.updating_controls = True
+        self.position_slider.config(state=tk.NORMAL, to=duration)
+        self.position_slider.set(0)
+        self.zoom_slider.config(to=max(duration, WINDOW_SECONDS))
+        self.updating_controls = False
+
+        low, high = player.limits()
+        margin = 0.1 * (high - low) + 1
+        for ax in (self.atr_ax, self.vent_ax):
+            ax.set_ylim(low - margin, high + margin)
+            ax.set_ylabel("ADC counts")
+        self.vent_ax.set_xlim(0, self.zoom_slider.get())
+        self.canvas.draw_idle()
+
+    def toggle_playback(self):
+        if self.player is None:
+            return
+        if not self.player.playing and self.player.position >= len(self.player):
+            self.player.seek(0)
+        self.player.playing = not self.player.playing
+        self.play_button.config(text="Pause" if self.player.playing else "Play")
+
+    def seek_playback(self, value):
+        # Moving the slider from draw_playback also calls this, so skip those echoes
+        if self.player is None or self.updating_controls or float(value) == self.shown_position:
+            return
+        self.player.seek(float(value))
+
+    def set_playback_speed(self, value):
+        if self.player is not None:
+            self.player.set_speed(int(value))
+
+    def set_playback_window(self, value):
+        # Changing the zoom changes the axis, so it needs one full redraw
+        if self.player is not None and not self.updating_controls:
+            self.vent_ax.set_xlim(0, float(value))
+            self.canvas.draw_idle()
+
+    def stop_playback(self):
+        """Leave playback and go back to live or simulated data."""
+        self.player = None
+        for button in (self.play_button, self.stop_button):
+            button.config(state=tk.DISABLED)
+        self.position_slider.config(state=tk.DISABLED)
+        self.atr_line.set_data(self.time, self.atr_trace.data)
+        self.vent_line.set_data(self.time, self.vent_trace.data)
+        self.vent_ax.set_xlim(0, WINDOW_SECONDS)
+        self.switch_source(self.telemetry is not None and self.telemetry.connected)
+
+    def draw_playback(self):
+        """Draw the current playback window at the plot's pixel resolution."""
+        player = self.player
+        width = float(self.zoom_slider.get())
+        max_points = max(int(self.vent_ax.bbox.width), 100)
+        atr_x, atr_y, vent_x, vent_y = player.window(width, max_points)
+        self.atr_line.set_data(atr_x, atr_y)
+        self.vent_line.set_data(vent_x, vent_y)
+
+        self.shown_position = round(player.time, 1)
+        self.position_slider.set(self.shown_position)
+        if not player.playing:
+            self.play_button.config(text="Play")
 
     def close_heartview(self):
+        if self.telemetry is not None:
+            self.telemetry.unsubscribe(self.on_frames)
+        self.ani.event_source.stop()
         self.window.destroy()
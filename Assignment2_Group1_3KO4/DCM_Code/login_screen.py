@@ -3,7 +3,8 @@ from tkinter import messagebox
 import tkinter.font as tkFont
 
 from user_manager import UserManager
-from pacemaker_interface import PacemakerInterface
+
+POLL_INTERVAL_MS = 20  # How often to check on password hashing running in the background
 
 class LoginScreen:
     def __init__(self, root=None):
@@ -37,23 +38,29 @@ class LoginScreen:
         self.entry_password.pack(pady=5)
 
         # Buttons
-        tk.Button(self.root, text="Register", command=self.register_user, font=label_font, width=15, height=2).pack(pady=5)
-        tk.Button(self.root, text="Login", command=self.login_user, font=label_font, width=15, height=2).pack(pady=5)
+        self.register_button = tk.Button(self.root, text="Register", command=self.register_user, font=label_font, width=15, height=2)
+        self.register_button.pack(pady=5)
+        self.login_button = tk.Button(self.root, text="Login", command=self.login_user, font=label_font, width=15, height=2)
+        self.login_button.pack(pady=5)
 
     def register_user(self):
-        # Register user
+        # Register user (hashing runs off the UI thread)
         name = self.entry_name.get()
         password = self.entry_password.get()
-        success, message = self.user_manager.register(name, password)
+        self.wait_for(self.user_manager.register_async(name, password), self.finish_register)
+
+    def finish_register(self, name, success, message):
         messagebox.showinfo("Register", message)
         if success:
             self.clear_entries()
 
     def login_user(self):
-        # Login user
+        # Login user (password check runs off the UI thread)
         name = self.entry_name.get()
         password = self.entry_password.get()
-        success, message = self.user_manager.login(name, password)
+        self.wait_for(self.user_manager.login_async(name, password), self.finish_login, name)
+
+    def finish_login(self, name, success, message):
         if success:
             messagebox.showinfo("Login", message)
             self.clear_entries()
@@ -61,6 +68,27 @@ class LoginScreen:
         else:
             messagebox.showerror("Login", message)
 
+    def wait_for(self, future, callback, name=None):
+        # Disable the buttons and poll the future from the Tk loop until it finishes
+        self.set_buttons_state(tk.DISABLED)
+
+        def check():
+            if not future.done():
+                self.root.after(POLL_INTERVAL_MS, check)
+                return
+            self.set_buttons_state(tk.NORMAL)
+            try:
+                success, message = future.result()
+            except Exception as e:
+                success, message = False, f"Error: {e}"
+            callback(name, success, message)
+
+        self.root.after(POLL_INTERVAL_MS, check)
+
+    def set_buttons_state(self, state):
+        self.register_button.config(state=state)
+        self.login_button.config(state=state)
+
     def clear_entries(self):
         # Clear entry fields
         self.entry_name.delete(0, tk.END)
@@ -70,6 +98,9 @@ class LoginScreen:
         # Create and open pacemaker interface
         self.root.withdraw()  # Hide the login window
 
+        # Imported here so the login window doesn't wait on the interface's dependencies
+        from pacemaker_interface import PacemakerInterface
+
         # Create the pacemaker interface (this will create its own window)
         PacemakerInterface(self.root, name, self.user_manager)
 
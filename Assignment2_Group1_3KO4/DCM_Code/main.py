@@ -1,5 +1,11 @@
+import os
+
+import diagnostics
 from login_screen import LoginScreen
 
 if __name__ == "__main__":
     login_screen = LoginScreen()
 
+    # Set DCM_DIAGNOSTICS to a file name to keep this session's latency histograms
+    if os.environ.get("DCM_DIAGNOSTICS"):
+        diagnostics.dump(os.environ["DCM_DIAGNOSTICS"])
@@ -1,89 +1,230 @@
-PARAM_FOR_MODES = {
-    "VOO": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Ventricular Amplitude (V)", 
-        "Ventricular Pulse Width (ms)"
-    ],
-    "AOO": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Atrial Amplitude (V)", 
-        "Atrial Pulse Width (ms)"
-    ],
-    "VVI": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Ventricular Amplitude (V)", 
-        "Ventricular Pulse Width (ms)", 
-        "Ventricular Sensitivity (mV)", 
-        "VRP (ms)", 
-        "Rate Smoothing (%)",
-        "Hysteresis"
-        
-    ],
-    "AAI": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Atrial Amplitude (V)", 
-        "Atrial Pulse Width (ms)", 
-        "Atrial Sensitivity (mV)", 
-        "ARP (ms)", 
-        "PVARP (ms)", 
-        "Rate Smoothing (%)",
-        "Hysteresis"
-    ],
-    "VOOR": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Ventricular Amplitude (V)", 
-        "Ventricular Pulse Width (ms)", 
-        "Maximum Sensor Rate (ppm)", 
-        "Reaction Time (s)", 
-        "Response Factor", 
-        "Recovery Time (min)",
-        "Activity Threshold"
-    ],
-    "AOOR": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Atrial Amplitude (V)", 
-        "Atrial Pulse Width (ms)", 
-        "Maximum Sensor Rate (ppm)", 
-        "Reaction Time (s)", 
-        "Response Factor", 
-        "Recovery Time (min)",
-        "Activity Threshold"
-    ],
-    "VVIR": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Ventricular Amplitude (V)", 
-        "Ventricular Pulse Width (ms)", 
-        "Ventricular Sensitivity (mV)", 
-        "VRP (ms)", 
-        "Maximum Sensor Rate (ppm)", 
-        "Reaction Time (s)", 
-        "Response Factor", 
-        "Recovery Time (min)", 
-        "Rate Smoothing (%)",
-        "Activity Threshold",
-        "Hysteresis"
-    ],
-    "AAIR": [
-        "Lower Rate Limit (ppm)", 
-        "Upper Rate Limit (ppm)", 
-        "Atrial Amplitude (V)", 
-        "Atrial Pulse Width (ms)", 
-        "Atrial Sensitivity (mV)", 
-        "ARP (ms)", 
-        "PVARP (ms)", 
-        "Maximum Sensor Rate (ppm)", 
-        "Reaction Time (s)", 
-        "Response Factor", 
-        "Recovery Time (min)", 
-        "Rate Smoothing (%)",
-        "Activity Threshold",
-        "Hysteresis"
-    ]
-}
\ No newline at end of file
+from collections import namedtuple
+
+# Pacing modes, in the order of their mode codes on the wire (1, 2, ...)
+MODES = ("VOO", "AOO", "VVI", "AAI", "VOOR", "AOOR", "VVIR", "AAIR")
+
+# Everything the DCM knows about one programmable parameter:
+#   minimum, maximum, step: slider range and resolution
+#   unit: shown after the value ("" if the name already says it)
+#   wire_type: struct format character used in SET_PARAMS packets
+#   default: nominal value sent when a saved set doesn't have the parameter
+#   modes: pacing modes the parameter applies to
+#   labels: names shown instead of the number (None for plain sliders)
+Parameter = namedtuple("Parameter", ("name", "minimum", "maximum", "step", "unit", "wire_type",
+                                     "default", "modes", "labels"))
+
+_ALL = MODES
+_ATRIAL = ("AOO", "AAI", "AOOR", "AAIR")
+_VENTRICULAR = ("VOO", "VVI", "VOOR", "VVIR")
+_RATE_ADAPTIVE = ("VOOR", "AOOR", "VVIR", "AAIR")
+_INHIBITED = ("VVI", "AAI", "VVIR", "AAIR")
+_ACTIVITY_LEVELS = ("V-LO", "LO", "MED-LO", "MED", "HI-MED", "HI", "V-HI")
+
+# The single source for sliders, validation and packet layout. Within a
+# mode, parameters are sent in this order.
+PARAM_SCHEMA = (
+    Parameter("Lower Rate Limit (ppm)", 30, 175, 5, "ppm", 'B', 60, _ALL, None),
+    Parameter("Upper Rate Limit (ppm)", 50, 175, 5, "ppm", 'B', 120, _ALL, None),
+    Parameter("Atrial Amplitude (V)", 0.1, 5.0, 0.1, "V", 'f', 3.5, _ATRIAL, None),
+    Parameter("Ventricular Amplitude (V)", 0.1, 5.0, 0.1, "V", 'f', 3.5, _VENTRICULAR, None),
+    Parameter("Atrial Pulse Width (ms)", 1, 30, 1, "ms", 'f', 1, _ATRIAL, None),
+    Parameter("Ventricular Pulse Width (ms)", 1, 30, 1, "ms", 'f', 1, _VENTRICULAR, None),
+    Parameter("Atrial Sensitivity (mV)", 0, 5, 0.1, "mV", 'f', 0.75, ("AAI", "AAIR"), None),
+    Parameter("Ventricular Sensitivity (mV)", 0, 5, 0.1, "mV", 'f', 2.5, ("VVI", "VVIR"), None),
+    Parameter("ARP (ms)", 150, 500, 10, "ms", 'H', 250, ("AAI", "AAIR"), None),
+    Parameter("PVARP (ms)", 150, 500, 10, "ms", 'H', 250, ("AAI", "AAIR"), None),
+    Parameter("VRP (ms)", 150, 500, 10, "ms", 'H', 320, ("VVI", "VVIR"), None),
+    Parameter("Maximum Sensor Rate (ppm)", 50, 175, 5, "ppm", 'f', 120, _RATE_ADAPTIVE, None),
+    Parameter("Reaction Time (s)", 10, 50, 10, "s", 'H', 30, _RATE_ADAPTIVE, None),
+    Parameter("Response Factor", 1, 16, 1, "", 'B', 1, _RATE_ADAPTIVE, None),
+    Parameter("Recovery Time (min)", 2, 16, 1, "min", 'B', 5, _RATE_ADAPTIVE, None),
+    Parameter("Rate Smoothing (%)", 3, 25, 3, "%", 'B', 6, _INHIBITED, None),
+    Parameter("Activity Threshold", 0, 6, 1, "", 'B', 3, _RATE_ADAPTIVE, _ACTIVITY_LEVELS),
+    Parameter("Hysteresis", 0, 1, 1, "", 'B', 0, _INHIBITED, ("OFF", "ON")),
+)
+
+# SET_PARAMS wire layout (little-endian, no padding), as PacketCodec builds it
+# from the schema above. The firmware must match it field for field.
+#   byte 0 SYNC, 1 FN_CODE, 2 sequence number, 3 mode code (VOO=1, AOO=2,
+#   VVI=3, AAI=4, VOOR=5, AOOR=6, VVIR=7, AAIR=8), then the mode's
+#   parameters, then a CRC-8 over bytes 1 onwards.
+#   VOO  (15 bytes)  LRL B, URL B, V Amp f, V PW f
+#   AOO  (15 bytes)  LRL B, URL B, A Amp f, A PW f
+#   VVI  (23 bytes)  LRL B, URL B, V Amp f, V PW f, V Sens f, VRP H,
+#                    Rate Smoothing B, Hysteresis B
+#   AAI  (25 bytes)  LRL B, URL B, A Amp f, A PW f, A Sens f, ARP H, PVARP H,
+#                    Rate Smoothing B, Hysteresis B
+#   VOOR (24 bytes)  LRL B, URL B, V Amp f, V PW f, MSR f, Reaction Time H,
+#                    Response Factor B, Recovery Time B, Activity Threshold B
+#   AOOR (24 bytes)  as VOOR with A Amp and A PW
+#   VVIR (32 bytes)  LRL B, URL B, V Amp f, V PW f, V Sens f, VRP H, MSR f,
+#                    Reaction Time H, Response Factor B, Recovery Time B,
+#                    Rate Smoothing B, Activity Threshold B, Hysteresis B
+#   AAIR (34 bytes)  LRL B, URL B, A Amp f, A PW f, A Sens f, ARP H, PVARP H,
+#                    MSR f, Reaction Time H, Response Factor B,
+#                    Recovery Time B, Rate Smoothing B, Activity Threshold B,
+#                    Hysteresis B
+# Before mode codes, the packet had no sequence number or CRC, sent the ASCII
+# initial of the mode ('V' or 'A') and always carried one ventricular field
+# set: LRL B, URL B, V Amp f, V PW f, V Sens f, MSR f, VRP H, Reaction Time H,
+# Response Factor B, Rate Smoothing B. MSR and Reaction Time keep those types.
+
+# Lookup tables compiled from the schema
+PARAMETERS = {param.name: param for param in PARAM_SCHEMA}
+PARAM_FOR_MODES = {mode: [param.name for param in PARAM_SCHEMA if mode in param.modes] for mode in MODES}
+PARAM_WIRE_TYPES = {param.name: param.wire_type for param in PARAM_SCHEMA}
+PARAM_DEFAULTS = {param.name: param.default for param in PARAM_SCHEMA}
+
+# Rules between parameters, as (first, relation, second, message). A rule is
+# only checked in modes that have both parameters. "interval" means the first
+# (a refractory period in ms) must be shorter than the pacing interval at the
+# second (a rate in ppm).
+CONSTRAINTS = (
+    ("Lower Rate Limit (ppm)", "<", "Upper Rate Limit (ppm)",
+     "Lower Rate Limit must be below Upper Rate Limit."),
+    ("Maximum Sensor Rate (ppm)", ">=", "Upper Rate Limit (ppm)",
+     "Maximum Sensor Rate must be at least Upper Rate Limit."),
+    ("ARP (ms)", "interval", "Upper Rate Limit (ppm)",
+     "ARP must be shorter than the pacing interval at Upper Rate Limit."),
+    ("PVARP (ms)", "interval", "Upper Rate Limit (ppm)",
+     "PVARP must be shorter than the pacing interval at Upper Rate Limit."),
+    ("VRP (ms)", "interval", "Upper Rate Limit (ppm)",
+     "VRP must be shorter than the pacing interval at Upper Rate Limit."),
+)
+
+_RELATIONS = {
+    "<": lambda a, b: a < b,
+    ">=": lambda a, b: a >= b,
+    "interval": lambda period, rate: rate <= 0 or period < 60000 / rate,
+}
+
+# Per mode, the rules each parameter takes part in, so a change only
+# re-checks the handful of rules that involve it
+CONSTRAINTS_BY_MODE = {
+    mode: {
+        name: tuple(rule for rule in CONSTRAINTS
+                    if name in (rule[0], rule[2]) and rule[0] in PARAM_FOR_MODES[mode]
+                    and rule[2] in PARAM_FOR_MODES[mode])
+        for name in PARAM_FOR_MODES[mode]
+    }
+    for mode in MODES
+}
+
+
+def check_range(name, value):
+    """
+    Checks one value against its parameter's range.
+    :return: An error message, or None if the value is allowed.
+    """
+    param = PARAMETERS[name]
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return f"{name} must be a number."
+    if not param.minimum <= value <= param.maximum:
+        unit = f" {param.unit}" if param.unit else ""
+        return f"{name} must be between {param.minimum} and {param.maximum}{unit}."
+    return None
+
+
+def _rule_holds(rule, params):
+    first, relation, second, _ = rule
+    try:
+        a = float(params.get(first, PARAM_DEFAULTS[first]))
+        b = float(params.get(second, PARAM_DEFAULTS[second]))
+    except (TypeError, ValueError):
+        return True  # Already reported by check_range()
+    return _RELATIONS[relation](a, b)
+
+
+def check_change(mode, params, name):
+    """
+    Checks the rules affected by a change to one parameter.
+    Only the rules involving that parameter are evaluated.
+    :param params: The mode's parameters after the change (missing ones
+        take their defaults).
+    :return: A list of error messages, empty if the change is allowed.
+    """
+    error = check_range(name, params.get(name, PARAM_DEFAULTS[name]))
+    errors = [error] if error else []
+    for rule in CONSTRAINTS_BY_MODE.get(mode, {}).get(name, ()):
+        if not _rule_holds(rule, params):
+            errors.append(rule[3])
+    return errors
+
+
+def validate(mode, params):
+    """
+    Checks a whole parameter set for a mode.
+    :return: A list of error messages, empty if the set is valid.
+    """
+    if mode not in PARAM_FOR_MODES:
+        return [f"Unknown pacing mode '{mode}'."]
+    errors = []
+    for name in PARAM_FOR_MODES[mode]:
+        for error in check_change(mode, params, name):
+            if error not in errors:
+                errors.append(error)
+    return errors
+
+
+class ParameterValidator:
+    """
+    Tracks one mode's parameter values and the checks they currently fail.
+
+    set() re-checks only the changed parameter's range and the rules it
+    takes part in, so the cost of a slider move doesn't grow with the
+    number of parameters or rules.
+    """
+
+    def __init__(self, mode, params=None):
+        self.reset(mode, params)
+
+    def reset(self, mode, params=None):
+        # Start over for a mode, checking every parameter once
+        self.mode = mode
+        self.values = dict(PARAM_DEFAULTS)
+        self.values.update(params or {})
+        self.failures = {}  # parameter name or rule -> message
+        for name in PARAM_FOR_MODES.get(mode, ()):
+            self._check(name)
+
+    def set(self, name, value):
+        """
+        Records a new value for a parameter.
+        :return: Every message that applies after the change.
+        """
+        self.values[name] = value
+        self._check(name)
+        return self.messages
+
+    @property
+    def messages(self):
+        return list(dict.fromkeys(self.failures.values()))
+
+    @property
+    def valid(self):
+        return not self.failures
+
+    def _check(self, name):
+        rules = CONSTRAINTS_BY_MODE.get(self.mode, {}).get(name)
+        if rules is None:
+            return  # Not a parameter of this mode
+        error = check_range(name, self.values[name])
+        if error:
+            self.failures[name] = error
+        else:
+            self.failures.pop(name, None)
+        for rule in rules:
+            if _rule_holds(rule, self.values):
+                self.failures.pop(rule, None)
+            else:
+                self.failures[rule] = rule[3]
+
+
+def value_label(name, value):
+    """Returns the text shown next to a parameter's slider."""
+    param = PARAMETERS[name]
+    if param.labels:
+        return f"{name}: {param.labels[int(value)]}"
+    return name
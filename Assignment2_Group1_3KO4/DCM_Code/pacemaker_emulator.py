@@ -0,0 +1,343 @@
+import argparse
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+from modes import PARAM_DEFAULTS
+from serialcomm import (ACK_OK, ACK_STRUCT, FN_CODE_ACK, FN_CODE_ECHO, FN_CODE_SET_PARAMS,
+                        MODE_CODES, SYNC, TELEMETRY_FIELDS, TELEMETRY_STRUCT, PacketCodec, crc8)
+from synthesizer import EGMSynthesizer
+
+TELEMETRY_RATE = 250  # Telemetry frames per second (one EGM sample per channel each)
+MAX_BATCH = 1024  # Frames written in one go when the emulator falls behind
+READ_SIZE = 4096
+WRITE_SIZE = 4096  # Most bytes handed to the pty in one write
+LINE_SLICE = 0.005  # Seconds of line time written at once when throttled
+WRITE_TIMEOUT = 0.05  # Seconds to wait for room in the pty before bytes are lost
+MAX_EGM_RATE = 1000  # Highest rate EGMs are synthesized at; faster telemetry repeats samples
+EGM_ZERO = 2048  # ADC count for 0 mV (12-bit converter)
+EGM_COUNTS_PER_MV = 400
+TELEMETRY_FRAME_SIZE = TELEMETRY_STRUCT.size + 3  # SYNC, FN_CODE, payload, CRC
+
+_TELEMETRY_TYPES = dict(zip(TELEMETRY_FIELDS, TELEMETRY_STRUCT.format.lstrip('<')))
+
+# Telemetry field holding each parameter, in payload order after "mode"
+_TELEMETRY_PARAMS = (
+    ("lower_rate", "Lower Rate Limit (ppm)"),
+    ("upper_rate", "Upper Rate Limit (ppm)"),
+    ("atr_amp", "Atrial Amplitude (V)"),
+    ("vent_amp", "Ventricular Amplitude (V)"),
+    ("atr_width", "Atrial Pulse Width (ms)"),
+    ("vent_width", "Ventricular Pulse Width (ms)"),
+    ("vrp", "VRP (ms)"),
+    ("arp", "ARP (ms)"),
+    ("hysteresis", "Hysteresis"),
+    ("rate_smoothing", "Rate Smoothing (%)"),
+    ("activity_threshold", "Activity Threshold"),
+    ("reaction_time", "Reaction Time (s)"),
+    ("response_factor", "Response Factor"),
+    ("recovery_time", "Recovery Time (min)"),
+)
+
+
+class PacemakerEmulator(threading.Thread):
+    """
+    Virtual pacemaker on a pseudo-terminal.
+
+    Open `emulator.port` with pyserial like a real board. The emulator
+    answers echo requests, applies SET_PARAMS packets (decoded with
+    PacketCodec) and ACKs them with the CRC of what it stored, and streams
+    telemetry frames carrying the applied parameters and synthesized EGM
+    samples at telemetry_rate. Outgoing bytes can be throttled to a baud
+    rate, delayed with jitter, dropped or corrupted to exercise the host's
+    resynchronisation and retry paths.
+
+    Linux/macOS only (needs os.openpty).
+    """
+
+    def __init__(self, mode="AOO", params=None, telemetry_rate=TELEMETRY_RATE, baud_rate=None,
+                 jitter=0.0, drop_rate=0.0, corrupt_rate=0.0, streaming=True, seed=None):
+        """
+        :param baud_rate: Limit output to what this baud rate carries (10
+            bits per byte); None writes as fast as the pty accepts.
+        :param jitter: Standard deviation (seconds) of the delay added to each write.
+        :param drop_rate: Probability that any outgoing byte is lost.
+        :param corrupt_rate: Probability that any outgoing byte has a bit flipped.
+        :param streaming: Send telemetry continuously, not only on echo requests.
+        """
+        super().__init__(name="PacemakerEmulator", daemon=True)
+        self.codec = PacketCodec()
+        self.mode = mode
+        self.params = dict(PARAM_DEFAULTS)
+        self.params.update(params or {})
+        self.telemetry_rate = telemetry_rate
+        self.baud_rate = baud_rate
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.streaming = streaming
+        self.random = random.Random(seed)
+        self.seed = seed
+
+        # Counters, only written by the emulator thread
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.acks_sent = 0
+        self.packets_applied = 0
+        self.packets_rejected = 0
+        self.bytes_dropped = 0
+        self.bytes_corrupted = 0
+        self.bytes_overrun = 0  # Lost because the host wasn't reading
+        self.frames_skipped = 0  # Never generated because the line was saturated
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)  # A full pty must not stall the emulator
+        self.port = os.ttyname(self.slave)
+        self._input = bytearray()
+        self._line_free = 0.0  # When the throttled line has sent everything written so far
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()  # Guards mode, params and the synthesizer
+        self._build_telemetry()
+
+    def _build_telemetry(self):
+        # Header fields echoed in every frame, and the EGM source for the current settings
+        header = [MODE_CODES[self.mode]]
+        for field, name in _TELEMETRY_PARAMS:
+            value = self.params.get(name, PARAM_DEFAULTS[name])
+            header.append(float(value) if _TELEMETRY_TYPES[field] == 'f' else int(round(value)))
+        self._header = tuple(header)
+        self._egm_rate = min(self.telemetry_rate, MAX_EGM_RATE)
+        self._synthesizer = EGMSynthesizer(self.mode, self.params, self._egm_rate, self.seed)
+        self._frame_count = 0  # Frames generated with this synthesizer
+        self._egm_count = 0  # Samples taken from it
+        self._last_sample = (0.0, 0.0)
+
+    def set_parameters(self, mode, params):
+        # Apply a parameter set as if the host had programmed it
+        with self._lock:
+            self.mode = mode
+            self.params = dict(PARAM_DEFAULTS)
+            self.params.update(params)
+            self._build_telemetry()
+
+    def telemetry(self, count):
+        """Returns count telemetry frames, back to back, ready to write."""
+        with self._lock:
+            atrial, ventricular = self._egm_samples(count)
+            header = self._header
+        atrial = np.clip(EGM_ZERO + atrial * EGM_COUNTS_PER_MV, 0, 0xFFFF).astype(int).tolist()
+        ventricular = np.clip(EGM_ZERO + ventricular * EGM_COUNTS_PER_MV, 0, 0xFFFF).astype(int).tolist()
+        out = bytearray(count * TELEMETRY_FRAME_SIZE)
+        with memoryview(out) as view:
+            for index in range(count):
+                offset = index * TELEMETRY_FRAME_SIZE
+                out[offset] = SYNC
+                out[offset + 1] = FN_CODE_ECHO
+                TELEMETRY_STRUCT.pack_into(out, offset + 2, *header, ventricular[index], atrial[index])
+                end = offset + TELEMETRY_FRAME_SIZE - 1
+                out[end] = crc8(view[offset + 1:end])
+        return out
+
+    def _egm_samples(self, count):
+        # One sample per frame; above MAX_EGM_RATE each synthesized sample is held for several frames
+        index = ((self._frame_count + np.arange(count)) * self._egm_rate / self.telemetry_rate).astype(int)
+        new_atrial, new_ventricular = self._synthesizer.read(int(index[-1]) + 1 - self._egm_count)
+        atrial = np.concatenate(([self._last_sample[0]], new_atrial))
+        ventricular = np.concatenate(([self._last_sample[1]], new_ventricular))
+        index -= self._egm_count - 1  # Position 0 is the last sample of the previous call
+        self._frame_count += count
+        self._egm_count += len(new_atrial)
+        self._last_sample = (atrial[-1], ventricular[-1])
+        return atrial[index], ventricular[index]
+
+    def ack(self, seq, status, applied_crc):
+        frame = bytearray((SYNC, FN_CODE_ACK)) + ACK_STRUCT.pack(seq, status, applied_crc)
+        frame.append(crc8(frame[1:]))
+        return frame
+
+    def handle_input(self, data):
+        """
+        Parses bytes received from the host.
+        :return: The bytes to send back (ACKs and echoed frames).
+        """
+        buf = self._input
+        buf += data
+        replies = bytearray()
+        pos = 0
+        while True:
+            sync = buf.find(SYNC, pos)
+            if sync < 0 or sync + 1 >= len(buf):
+                pos = len(buf) if sync < 0 else sync
+                break
+            pos = sync
+            fn_code = buf[sync + 1]
+            if fn_code == FN_CODE_ECHO:
+                if sync + 2 >= len(buf):
+                    break
+                if buf[sync + 2] == crc8((FN_CODE_ECHO,)):
+                    replies += self.telemetry(1)
+                    self.frames_sent += 1
+                    pos = sync + 3
+                else:
+                    pos = sync + 1
+            elif fn_code == FN_CODE_SET_PARAMS:
+                if sync + 3 >= len(buf):
+                    break
+                mode = self.codec.modes_by_code.get(buf[sync + 3])
+                if mode is None:
+                    pos = sync + 1
+                    continue
+                size = self.codec.packet_size(mode)
+                if sync + size > len(buf):
+                    break
+                packet = bytes(buf[sync:sync + size])
+                try:
+                    seq, mode, params = self.codec.decode(packet)
+                except ValueError:
+                    # Can't trust a corrupted packet's sequence number, so let the host time out
+                    self.packets_rejected += 1
+                    pos = sync + 1
+                    continue
+                self.set_parameters(mode, params)
+                self.packets_applied += 1
+                replies += self.ack(seq, ACK_OK, crc8(packet[3:-1]))
+                self.acks_sent += 1
+                pos = sync + size
+            else:
+                pos = sync + 1
+        del buf[:pos]
+        return replies
+
+    def _impair(self, data):
+        # Apply the configured byte drops and bit flips
+        if self.drop_rate:
+            kept = bytearray()
+            for byte in data:
+                if self.random.random() < self.drop_rate:
+                    self.bytes_dropped += 1
+                else:
+                    kept.append(byte)
+            data = kept
+        if self.corrupt_rate:
+            for index in range(len(data)):
+                if self.random.random() < self.corrupt_rate:
+                    data[index] ^= 1 << self.random.randrange(8)
+                    self.bytes_corrupted += 1
+        return data
+
+    def _send(self, data):
+        if not data:
+            return
+        data = self._impair(bytearray(data))
+        if self.jitter:
+            time.sleep(abs(self.random.gauss(0, self.jitter)))
+        # With a baud rate, bytes go out a slice at a time at line speed
+        slice_size = max(int(self.baud_rate / 10 * LINE_SLICE), 1) if self.baud_rate else WRITE_SIZE
+        with memoryview(data) as view:
+            sent = 0
+            while sent < len(data):
+                if self.baud_rate:
+                    delay = self._line_free - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                _, writable, _ = select.select([], [self.master], [], WRITE_TIMEOUT)
+                if not writable:
+                    # Like a UART with nobody listening, the rest is simply gone
+                    self.bytes_overrun += len(data) - sent
+                    break
+                try:
+                    written = os.write(self.master, view[sent:sent + slice_size])
+                except BlockingIOError:
+                    continue
+                sent += written
+                if self.baud_rate:
+                    self._line_free = max(self._line_free, time.monotonic()) + written * 10 / self.baud_rate
+        self.bytes_sent += sent
+
+    def run(self):
+        next_frame = time.monotonic()
+        interval = 1.0 / self.telemetry_rate
+        max_batch = MAX_BATCH
+        if self.baud_rate:
+            # Queue no more than a few slices of line time, so ACKs aren't stuck behind telemetry
+            max_batch = max(int(self.baud_rate / 10 * LINE_SLICE * 4 / TELEMETRY_FRAME_SIZE), 1)
+        while not self._stop_event.is_set():
+            timeout = max(next_frame - time.monotonic(), 0) if self.streaming else 0.05
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.master, READ_SIZE)
+                except BlockingIOError:
+                    data = b""
+                except OSError:
+                    data = b""  # No host has the port open
+                self._send(self.handle_input(data))
+
+            if self.streaming:
+                now = time.monotonic()
+                due = int((now - next_frame) / interval) + 1 if now >= next_frame else 0
+                if due > max_batch:
+                    # The line can't keep up, so the oldest samples are never sent
+                    self.frames_skipped += due - max_batch
+                    next_frame += (due - max_batch) * interval
+                    due = max_batch
+                if due:
+                    self.frames_sent += due
+                    self._send(self.telemetry(due))
+                    next_frame += due * interval
+
+    def stats(self):
+        return {
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "acks_sent": self.acks_sent,
+            "packets_applied": self.packets_applied,
+            "packets_rejected": self.packets_rejected,
+            "bytes_dropped": self.bytes_dropped,
+            "bytes_corrupted": self.bytes_corrupted,
+            "bytes_overrun": self.bytes_overrun,
+            "frames_skipped": self.frames_skipped,
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a virtual pacemaker on a pseudo-terminal.")
+    parser.add_argument("--mode", default="AOO", help="Initial pacing mode")
+    parser.add_argument("--rate", type=float, default=TELEMETRY_RATE, help="Telemetry frames per second")
+    parser.add_argument("--baud", type=int, help="Throttle output to this baud rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Write jitter in seconds")
+    parser.add_argument("--drop", type=float, default=0.0, help="Probability of dropping each byte")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Probability of corrupting each byte")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    emulator = PacemakerEmulator(args.mode, telemetry_rate=args.rate, baud_rate=args.baud, jitter=args.jitter,
+                                 drop_rate=args.drop, corrupt_rate=args.corrupt, seed=args.seed)
+    print(f"Emulated pacemaker on {emulator.port}")
+    with emulator:
+        try:
+            while True:
+                time.sleep(1)
+                print(emulator.stats())
+        except KeyboardInterrupt:
+            pass
@@ -1,12 +1,19 @@
+import time
 import tkinter as tk
 import tkinter.font as tkFont
 from tkinter import ttk
 import tkinter.messagebox as messagebox
 
-from heartview import HeartView
-from modes import PARAM_FOR_MODES
+from modes import PARAM_FOR_MODES, PARAM_SCHEMA, PARAMETERS, ParameterValidator, validate, value_label
 
 from serialcomm import PORTS_ARRAY
+from serial_reader import TelemetryFeed
+from connection_pool import ConnectionPool, list_serial_ports
+from settings_writer import SettingsWriter
+
+POLL_INTERVAL_MS = 50  # How often the Tk loop drains received frames
+CONNECT_TIMEOUT = 2.0  # Seconds to wait for the first frame after connecting
+AUTOSAVE_DELAY_MS = 300  # Quiet time after the last slider change before it is written
 
 class PacemakerInterface:
     def __init__(self, parent_window, username, user_manager):
@@ -14,7 +21,14 @@ class PacemakerInterface:
         self.user_manager = user_manager
         self.parent_window = parent_window
         self.param_for_modes = PARAM_FOR_MODES  # Load mode-to-sliders mapping
-        self.ports_array = PORTS_ARRAY
+        self.pool = ConnectionPool()  # Keeps connections open across saves
+        self.ports_array = list_serial_ports() or sorted(PORTS_ARRAY)
+        self.serial_reader = None  # Reader for the port currently connected
+        self.telemetry = TelemetryFeed()  # Shares received frames with HeartView
+        self.latest_frame = None  # Most recent telemetry frame received
+        self.recorder = None  # Session file telemetry is being recorded to
+        self.writer = SettingsWriter(self.write_settings)  # Auto-saves off the UI thread
+        self.autosave_job = None  # Pending debounced auto-save
         # Create pacemaker window
         self.root = tk.Toplevel(parent_window)
         self.root.geometry("900x850")  # Adjusted width for wider layout
@@ -27,6 +41,7 @@ class PacemakerInterface:
         slider_frame = tk.Frame(self.root)
         slider_frame.pack(expand=True)
         self.sliders = {}  # Store all sliders
+        self.validator = ParameterValidator("AOO")  # Cross-parameter checks for the shown mode
         self.create_sliders(slider_frame)
 
 
@@ -39,183 +54,232 @@ class PacemakerInterface:
 
         connection_optons = list(self.ports_array)
         self.ports_dropdown = ttk.Combobox(self.root, values=connection_optons, state="readonly")
-        self.ports_dropdown.set("COM3") #Default mode
+        self.ports_dropdown.set(connection_optons[0]) #Default port
         self.ports_dropdown.place(x=680, y=10)
 
+        # Look for ports with a pacemaker on them in the background
+        self.root.after(POLL_INTERVAL_MS, self.check_discovery, self.pool.discover_async())
+
         # Load saved settings
         self.load_saved_settings()
 
         # Buttons
         tk.Button(self.root, text="Info", command=self.show_info, font=title_font, width=6).place(x=10, y=10)
         tk.Button(self.root, text="Save Settings", command=self.save_settings).place(x=10, y=650, width=150, height=40)
+        tk.Button(self.root, text="Send to Pacemaker", command=self.save_settings_sendData).place(x=170, y=650, width=150, height=40)
         tk.Button(self.root, text="Apply to HeartView", command=self.show_heartview).place(x=10, y=700, width=150, height=40)
+        self.record_button = tk.Button(self.root, text="Start Recording", command=self.toggle_recording)
+        self.record_button.place(x=170, y=700, width=150, height=40)
+        tk.Button(self.root, text="Diagnostics", command=self.show_diagnostics).place(x=740, y=650, width=150, height=40)
         tk.Button(self.root, text="Sign Out", command=self.sign_out).place(x=740, y=700, width=150, height=40)
         tk.Button(self.root, text="Connect", command=self.monitor_connection).place(x=600, y=10, width=70, height=30)
-
-
-        # Load saved settings
-        self.load_saved_settings()
+        self.live_apply = tk.BooleanVar(value=False)  # Send changes to the pacemaker as they are made
+        tk.Checkbutton(self.root, text="Live Apply", variable=self.live_apply).place(x=330, y=658)
 
         # Initial slider visibility update
         self.update_slider_visibility()
 
+        # What is on screen now is what was loaded, so there is nothing to auto-save yet
+        mode = self.mode_dropdown.get()
+        self.autosaved = (mode, self.current_parameters(mode))
+
     def save_settings_sendData(self):
         # Get the selected mode
         mode = self.mode_dropdown.get()
 
-        # Get the list of sliders for the selected mode
-        visible_parameters = self.param_for_modes.get(mode, [])
-
-        # Collect the current slider values
-        parameters = {}
-        for key in visible_parameters:
-            # Check if the key exists in the widget dictionary
-            if key in self.slider_widgets:
-                slider = self.slider_widgets[key]["slider"]
-                parameters[key] = slider.get()  # Get the value from the slider
+        # Collect the current slider values, refusing sets the device would reject
+        parameters = self.collect_parameters(mode)
+        if parameters is None:
+            return
 
-        # Save user settings
-        if self.username in self.user_manager.users:
-            self.user_manager.users[self.username]["mode"] = mode
-            self.user_manager.users[self.username]["parameters"] = parameters
-
-        # Save the data to persistent storage
-        self.user_manager.save_users()
-
-        # Format the data for UART transmission
-        formatted_data = "; ".join(f"{key}: {value}" for key, value in parameters.items())
+        # Save user settings to persistent storage
+        self.user_manager.save_settings(self.username, mode, parameters)
 
         # Print the data packet to the terminal
-        print(f"Packet to send: {formatted_data}")
+        print(f"Parameters to send: {parameters}")
 
         try:
-            # Initialize SerialCommunication (replace "COM3" with your actual port)
-            uart = SerialCommunication(port="COM3")
-            uart.send_data(formatted_data)  # Send data via UART
+            # The background reader owns the port, so send through it
+            if self.serial_reader is None or not self.serial_reader.connected.is_set():
+                raise ConnectionError("Pacemaker is not connected.")
+            request = self.serial_reader.link.send(mode, parameters)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to send data via UART: {e}")
             print(f"Error sending data via UART: {e}")
-        finally:
-            if 'uart' in locals():
-                uart.close_connection()  # Close the serial connection
-
-        # Display success message
-        messagebox.showinfo("Success", "Your settings have been saved and sent via UART!")
+            return
+
+        # Wait for the device's acknowledgement without blocking the UI
+        self.root.after(POLL_INTERVAL_MS, self.check_write, request)
+
+    def check_write(self, request):
+        if not request.done:
+            self.root.after(POLL_INTERVAL_MS, self.check_write, request)
+        elif request.applied:
+            print(f"Parameters applied in {request.round_trip * 1000:.1f} ms")
+            messagebox.showinfo("Success", "Your settings have been saved and applied by the pacemaker!")
+        else:
+            messagebox.showerror("Error", f"Pacemaker did not apply the settings: {request.error}")
  
     def show_heartview(self):
+        # matplotlib and numpy only load the first time HeartView opens
+        from heartview import HeartView
+
         self.save_settings()
         # Pass the required arguments to HeartView
-        HeartView(self.root, self.username, self.user_manager)
+        HeartView(self.root, self.username, self.user_manager, self.telemetry)
+
+    def show_diagnostics(self):
+        # Latency histograms of the serial link, drawing, storage and hashing
+        from diagnostics_window import DiagnosticsWindow
+        DiagnosticsWindow(self.root)
+
+    def toggle_recording(self):
+        # Record every telemetry frame received to a session file
+        if self.recorder is None:
+            from recorder import SessionRecorder, new_session_path
+            self.recorder = SessionRecorder(new_session_path(self.username))
+            self.telemetry.subscribe(self.recorder.extend, stamped=True)
+            self.record_button.config(text="Stop Recording")
+        else:
+            self.stop_recording()
+            self.record_button.config(text="Start Recording")
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.telemetry.unsubscribe(self.recorder.extend)
+            self.recorder.close()
+            print(f"Recorded {self.recorder.count} frames to {self.recorder.path}")
+            self.recorder = None
 
     def sign_out(self):
+        self.finish_autosave()
+        self.stop_recording()
+        self.stop_serial_reader()
+        self.pool.close_all()
         self.root.destroy()  # Close the pacemaker interface window
         self.parent_window.deiconify()  # Show the login screen again
 
     def on_close(self):
         # Close both the pacemaker window and the main window
+        self.finish_autosave()
+        self.stop_recording()
+        self.stop_serial_reader()
+        self.pool.close_all()
         self.root.destroy()
         self.parent_window.deiconify()  # Show the login screen again
 
     def create_sliders(self, frame):
-        # Define sliders and their ranges
-        slider_params = {
-            "Lower Rate Limit (ppm)": (30, 175, 5),
-            "Upper Rate Limit (ppm)": (50, 175, 5),
-            "Maximum Sensor Rate (ppm)": (50, 175, 5),
-            "Atrial Amplitude (V)": (0.1, 5.0, 0.1),
-            "Ventricular Amplitude (V)": (0.1, 5.0, 0.1),
-            "Atrial Pulse Width (ms)": (1, 30, 1),
-            "Ventricular Pulse Width (ms)": (1, 30, 1),
-            "Atrial Sensitivity (mV)": (0, 5, 0.1),
-            "Ventricular Sensitivity (mV)": (0, 5, 0.1),
-            "VRP (ms)": (150, 500, 10),
-            "ARP (ms)": (150, 500, 10),
-            "PVARP (ms)": (150, 500, 10),
-            "Rate Smoothing (%)": (3, 25, 3),
-            "Reaction Time (s)": (10, 50, 10),
-            "Response Factor": (1, 16, 1),
-            "Recovery Time (min)": (2, 16, 1),
-            "Activity Threshold": (0,6,1),
-            "Hysteresis": (0,1,1)
-        }
-
+        # One slider per parameter in the schema, hidden until its mode is shown
         self.slider_widgets = {}
+        self.shown_sliders = set()  # Sliders currently on the grid
+
+        for row, param in enumerate(PARAM_SCHEMA):
+            slider_label = tk.Label(frame, text=value_label(param.name, param.minimum))
+            if param.labels:
+                # Named settings show their name in the label instead of a number
+                slider = tk.Scale(frame, from_=param.minimum, to=param.maximum, resolution=param.step,
+                                  orient="horizontal", showvalue=False, length=200)
+            else:
+                slider = tk.Scale(frame, from_=param.minimum, to=param.maximum, resolution=param.step,
+                                  orient="horizontal")
+            slider.config(command=lambda value, name=param.name: self.on_slider_change(name, value))
 
-        # Create sliders and labels, but do not manage layout
-        for label, (from_val, to_val, resolution) in slider_params.items():
-            slider_label = tk.Label(frame, text=label)
-            slider = tk.Scale(frame, from_=from_val, to=to_val, resolution=resolution, orient="horizontal")
-
-            # Store both the label and slider without placing them
-            self.slider_widgets[label] = {"label": slider_label, "slider": slider}
+            # Store both the label and slider
+            self.slider_widgets[param.name] = {"label": slider_label, "slider": slider}
 
-            # Hide them initially
+            # Give them their own row once, then hide them until their mode is shown
+            slider_label.grid(row=row, column=0, padx=5, pady=5, sticky="w")
+            slider.grid(row=row, column=1, padx=5, pady=5, sticky="ew")
             slider_label.grid_remove()
             slider.grid_remove()
 
-        # Create Activity Threshold slider with custom labels
-        activity_threshold_label = tk.Label(frame, text="Activity Threshold: V-LO")
-        activity_threshold_slider = tk.Scale(frame, from_=0, to=6, orient="horizontal", showvalue=False, length=200)
-
-        # Define the mapping of values to labels
-        activity_threshold_labels = {
-            0: "Activity Threshold: V-LO", 1: "Activity Threshold: LO", 2: "Activity Threshold: MED-LO", 3: "Activity Threshold: MED", 4: "Activity Threshold: HI-MED", 5: "Activity Threshold: HI", 6: "Activity Threshold: V-HI"
-        }
-
-        # Function to update label text based on slider value
-        def update_activity_threshold_label(val):
-            label_text = activity_threshold_labels.get(int(val), "")
-            activity_threshold_label.config(text=label_text)
-
-        # Set the custom slider to call this function on value change
-        activity_threshold_slider.config(command=update_activity_threshold_label)
-
-        # Store the activity threshold label and slider
-        self.slider_widgets["Activity Threshold"] = {"label": activity_threshold_label, "slider": activity_threshold_slider}
-
-        # Hide the activity threshold label and slider initially
-        activity_threshold_label.grid_remove()
-        activity_threshold_slider.grid_remove()
-
-        # Create Hysteresis slider with ON/OFF labels
-        hysteresis_label = tk.Label(frame, text="Hysteresis: OFF")
-        hysteresis_slider = tk.Scale(frame, from_=0, to=1, orient="horizontal", showvalue=False, length=200)
-
-        # Function to update label text for ON/OFF based on slider value
-        def update_hysteresis_label(val):
-            label_text = "Hysteresis: ON" if int(val) == 1 else "Hysteresis: OFF"
-            hysteresis_label.config(text=label_text)
-
-        # Set the custom slider to call this function on value change
-        hysteresis_slider.config(command=update_hysteresis_label)
-
-        # Store the hysteresis label and slider
-        self.slider_widgets["Hysteresis"] = {"label": hysteresis_label, "slider": hysteresis_slider}
-
-        # Hide the hysteresis label and slider initially
-        hysteresis_label.grid_remove()
-        hysteresis_slider.grid_remove()
+        # Shows the cross-parameter checks the current values fail, below every slider row
+        self.validation_label = tk.Label(frame, fg="red", justify="left")
+        self.validation_label.grid(row=len(PARAM_SCHEMA), column=0, columnspan=2, padx=5, sticky="w")
+
+    def on_slider_change(self, name, value):
+        # Re-check only the rules this parameter takes part in
+        param = PARAMETERS[name]
+        if param.labels:
+            self.slider_widgets[name]["label"].config(text=value_label(name, float(value)))
+        self.show_validation(self.validator.set(name, float(value)))
+        self.schedule_autosave()
+
+    def schedule_autosave(self):
+        # Restart the countdown on every change so a drag ends in one write
+        if self.autosave_job is not None:
+            self.root.after_cancel(self.autosave_job)
+        self.autosave_job = self.root.after(AUTOSAVE_DELAY_MS, self.autosave)
+
+    def autosave(self):
+        # Hand the settings on screen to the writer thread (and the pacemaker if live-apply is on)
+        self.autosave_job = None
+        mode = self.mode_dropdown.get()
+        parameters = self.current_parameters(mode)
+        if (mode, parameters) == self.autosaved or not self.validator.valid:
+            return
+        self.autosaved = (mode, parameters)
+        apply = None
+        if self.live_apply.get() and self.serial_reader is not None and self.serial_reader.connected.is_set():
+            apply = self.serial_reader.link.send
+        self.writer.submit(mode, parameters, apply)
+
+    def write_settings(self, mode, parameters):
+        # Runs on the writer thread
+        self.user_manager.save_settings(self.username, mode, parameters)
+
+    def finish_autosave(self):
+        # Write out a change still waiting for its debounce, then stop the writer
+        if self.autosave_job is not None:
+            self.root.after_cancel(self.autosave_job)
+            self.autosave()
+        self.writer.close()
+
+    def show_validation(self, messages):
+        self.validation_label.config(text="\n".join(messages))
+
+    def current_parameters(self, mode):
+        # Slider values of a mode's parameters
+        return {key: self.slider_widgets[key]["slider"].get() for key in self.param_for_modes.get(mode, [])}
+
+    def collect_parameters(self, mode):
+        """
+        Returns the slider values of a mode's parameters.
+        Shows an error and returns None if they fail validation.
+        """
+        parameters = self.current_parameters(mode)
+        errors = validate(mode, parameters)
+        if errors:
+            messagebox.showerror("Invalid Settings", "\n".join(errors))
+            return None
+        return parameters
 
     def update_slider_visibility(self, event=None):
         # Get the selected mode and corresponding sliders
         selected_mode = self.mode_dropdown.get()
         visible_sliders = self.param_for_modes.get(selected_mode, [])
 
-        # Reset row tracker
-        current_row = 0
-
-        for label, widgets in self.slider_widgets.items():
-            slider_label, slider = widgets["label"], widgets["slider"]
-
-            if label in visible_sliders:
-                # Show and place the slider and its label in the next available row
-                slider_label.grid(row=current_row, column=0, padx=5, pady=5, sticky="w")
-                slider.grid(row=current_row, column=1, padx=5, pady=5, sticky="ew")
-                current_row += 1
-            else:
-                # Hide sliders not in the visible list
-                slider_label.grid_remove()
-                slider.grid_remove()
+        # Only touch the sliders that appear or disappear with this mode.
+        # Every slider keeps its own grid row, so shown ones stay in schema
+        # order without being moved and hidden rows take no space. Tk
+        # recomputes the layout once, when it next goes idle.
+        wanted = set(visible_sliders)
+        for label in self.shown_sliders - wanted:
+            widgets = self.slider_widgets[label]
+            widgets["label"].grid_remove()
+            widgets["slider"].grid_remove()
+        for label in wanted - self.shown_sliders:
+            widgets = self.slider_widgets[label]
+            # grid() without options restores the row grid_remove() remembered
+            widgets["label"].grid()
+            widgets["slider"].grid()
+        self.shown_sliders = wanted
+
+        # Check the newly shown mode's values as a whole
+        self.validator.reset(selected_mode, self.current_parameters(selected_mode))
+        self.show_validation(self.validator.messages)
+        if event is not None:
+            self.schedule_autosave()  # The user picked a new mode
 
     def load_saved_settings(self):
         # Retrieve the user data from the user manager
@@ -233,35 +297,71 @@ class PacemakerInterface:
         # Set the mode dropdown value
         self.mode_dropdown.set(user_data.get("mode", "AOO"))
         
+    def check_discovery(self, discovery):
+        # Offer the ports that answered the handshake first
+        if not discovery.done():
+            self.root.after(POLL_INTERVAL_MS, self.check_discovery, discovery)
+            return
+        if discovery.exception() is not None:
+            return
+        found = discovery.result()
+        others = [port for port in self.ports_array if port not in found]
+        self.ports_dropdown.config(values=found + others)
+        if found and self.serial_reader is None:
+            self.ports_dropdown.set(found[0])
+
     def monitor_connection(self):
-        try:
-            self.serPacemaker.receive_packet()  # Attempt to communicate
-            messagebox.showinfo("status","Pacemaker Connection: ✓")
-        except Exception:
-            messagebox.showinfo("status","Pacemaker Connection: X")
+        # Use the pool's warm reader for the selected port
+        port = self.ports_dropdown.get()
+        previous = self.serial_reader
+        self.stop_serial_reader()
+        if previous is not None and previous.port != port:
+            # Only the connected port is kept warm; close the one switched away from
+            self.pool.release(previous.port)
+        self.serial_reader = self.pool.get(port)
+        self.telemetry.attach(self.serial_reader)
+        self.connection_reported = False
+        self.connection_deadline = time.monotonic() + CONNECT_TIMEOUT
+        self.root.after(POLL_INTERVAL_MS, self.poll_telemetry, self.serial_reader)
+
+    def poll_telemetry(self, reader):
+        # Drain frames decoded by the reader thread without blocking the UI
+        if reader is not self.serial_reader:
+            return  # The reader was disconnected or replaced since this was scheduled
+
+        frames = self.telemetry.poll()
+        if frames:
+            self.latest_frame = frames[-1]
+            if not self.connection_reported:
+                self.connection_reported = True
+                messagebox.showinfo("status", "Pacemaker Connection: ✓")
+
+        if not self.connection_reported and time.monotonic() > self.connection_deadline:
+            # Nothing answered, so stop the pool retrying this port
+            messagebox.showinfo("status", "Pacemaker Connection: X")
+            self.stop_serial_reader()
+            self.pool.release(reader.port)
+            return
+
+        self.root.after(POLL_INTERVAL_MS, self.poll_telemetry, reader)
+
+    def stop_serial_reader(self):
+        # Stop listening; the pool keeps the port open for the next connect
+        if self.serial_reader is not None:
+            self.telemetry.detach()
+            self.serial_reader = None
 
     def save_settings(self):
         # Get the selected mode
         mode = self.mode_dropdown.get()
 
-        # Get the list of sliders for the selected mode
-        visible_parameters = self.param_for_modes.get(mode, [])
-
-        # Collect the current slider values
-        parameters = {}
-        for key in visible_parameters:
-            # Check if the key exists in the widget dictionary
-            if key in self.slider_widgets:
-                slider = self.slider_widgets[key]["slider"]
-                parameters[key] = slider.get()  # Get the value from the slider
-
-        # Save user settings
-        if self.username in self.user_manager.users:
-            self.user_manager.users[self.username]["mode"] = mode
-            self.user_manager.users[self.username]["parameters"] = parameters
+        # Collect the current slider values, refusing sets the device would reject
+        parameters = self.collect_parameters(mode)
+        if parameters is None:
+            return
 
-        # Save the data to persistent storage
-        self.user_manager.save_users()
+        # Save user settings to persistent storage
+        self.user_manager.save_settings(self.username, mode, parameters)
 
         # Display success message
         messagebox.showinfo("Success", "Your settings have been saved!")
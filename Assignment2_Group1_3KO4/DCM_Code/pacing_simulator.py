@@ -0,0 +1,424 @@
+import argparse
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from modes import PARAM_DEFAULTS, PARAM_FOR_MODES, validate
+from synthesizer import HEART_REFRACTORY, hann_wave, pace_spike, qrs_wave
+
+SENSOR_STEP = 1.0  # Seconds between updates of the sensor-indicated rate
+HYSTERESIS_PPM = 10  # With hysteresis on, the escape rate after a sensed beat is this much below LRL
+RESPONSE_SCALE = 4.0  # Activity above threshold times Response Factor that reaches MSR
+TEMPLATE_SECONDS = 0.5  # Longest waveform an event adds to the EGM
+
+# Accelerometer activity (0 = rest, 1 = peak exertion) each Activity Threshold setting ignores
+ACTIVITY_THRESHOLDS = (0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4)
+
+# Event kinds
+PACE = 0  # Pacing pulse that captured
+SENSE = 1  # Intrinsic beat sensed by the device, restarting its timer
+REFRACTORY_SENSE = 2  # Intrinsic beat sensed during a refractory period and ignored
+INTRINSIC = 3  # Intrinsic beat the device didn't see (other chamber, undersensed or no sensing)
+NO_CAPTURE = 4  # Pacing pulse that didn't capture
+KIND_NAMES = ("pace", "sense", "refractory sense", "intrinsic", "no capture")
+
+EVENT_DTYPE = np.dtype([("time", '<f8'), ("chamber", 'U1'), ("kind", 'u1')])
+
+# The patient's own rhythm.
+#   sinus_rate: resting sinus rate in bpm (0 for sinus arrest)
+#   sinus_reserve: bpm the sinus rate rises at peak activity
+#   variability: beat-to-beat spread of the sinus interval (fraction)
+#   av_delay: seconds from an atrial depolarization to the conducted ventricular one
+#   av_block: True if atrial beats never conduct
+#   pac_rate, pvc_rate: premature atrial/ventricular beats per minute
+#   capture_threshold: lowest pulse amplitude (V) that captures
+#   p_amplitude, r_amplitude: intrinsic P and R wave amplitudes (mV) seen by the leads
+#   activity: activity(times) -> array of activity levels, or None for rest
+HeartModel = namedtuple(
+    "HeartModel",
+    ("sinus_rate", "sinus_reserve", "variability", "av_delay", "av_block", "pac_rate", "pvc_rate",
+     "capture_threshold", "p_amplitude", "r_amplitude", "activity"),
+    defaults=(45, 0, 0.03, 0.15, False, 0.0, 0.0, 1.0, 1.0, 3.0, None),
+)
+
+
+def cyclic_activity(period=120.0, peak=0.8):
+    """Returns an activity profile alternating between rest and exercise every period seconds."""
+    return lambda t: peak * (0.5 - 0.5 * np.cos(2 * np.pi * np.asarray(t) / period))
+
+
+HEART_PRESETS = {
+    "normal": HeartModel(sinus_rate=72, sinus_reserve=60),
+    "bradycardia": HeartModel(),
+    "sinus arrest": HeartModel(sinus_rate=0),
+    "heart block": HeartModel(sinus_rate=75, sinus_reserve=50, av_block=True),
+    "ectopy": HeartModel(sinus_rate=55, pac_rate=4, pvc_rate=4),
+}
+
+
+class SimulationResult:
+    """Events of a simulated run, with summaries and the EGM they produce."""
+
+    def __init__(self, mode, params, heart, duration, events):
+        self.mode = mode
+        self.params = params
+        self.heart = heart
+        self.duration = duration
+        self.events = events  # EVENT_DTYPE array in time order
+
+    def select(self, chamber=None, kind=None):
+        """Returns the events of one chamber and/or kind."""
+        mask = np.ones(len(self.events), dtype=bool)
+        if chamber is not None:
+            mask &= self.events["chamber"] == chamber
+        if kind is not None:
+            mask &= np.isin(self.events["kind"], kind)
+        return self.events[mask]
+
+    def count(self, chamber=None, kind=None):
+        return len(self.select(chamber, kind))
+
+    def paced_fraction(self, chamber):
+        """Fraction of the chamber's beats that were paced."""
+        beats = self.count(chamber, (PACE, SENSE, REFRACTORY_SENSE, INTRINSIC))
+        return self.count(chamber, PACE) / beats if beats else 0.0
+
+    def rates(self, chamber):
+        """Returns (times, bpm) of every interval between the chamber's beats."""
+        times = self.select(chamber, (PACE, SENSE, REFRACTORY_SENSE, INTRINSIC))["time"]
+        if len(times) < 2:
+            return np.zeros(0), np.zeros(0)
+        return times[1:], 60.0 / np.diff(times)
+
+    def summary(self):
+        """Returns a dictionary of event counts and rates per chamber."""
+        summary = {"mode": self.mode, "duration_s": self.duration}
+        for chamber in "AV":
+            _, bpm = self.rates(chamber)
+            summary[chamber] = {
+                **{name: self.count(chamber, kind) for kind, name in enumerate(KIND_NAMES)},
+                "paced_percent": round(100 * self.paced_fraction(chamber), 1),
+                "min_rate": round(float(bpm.min()), 1) if len(bpm) else None,
+                "mean_rate": round(float(bpm.mean()), 1) if len(bpm) else None,
+                "max_rate": round(float(bpm.max()), 1) if len(bpm) else None,
+            }
+        return summary
+
+    def egm(self, start=0.0, stop=None, sample_rate=1000):
+        """
+        Renders the atrial and ventricular electrograms for part of the run.
+        Only events near the window are touched, so any stretch of a long
+        run costs the same.
+        :return: An (atrial, ventricular) tuple of float arrays.
+        """
+        stop = self.duration if stop is None else min(stop, self.duration)
+        count = max(int((stop - start) * sample_rate), 0)
+        templates = _event_templates(self.params, self.mode[0], self.heart, sample_rate)
+        length = max(len(template) for pair in templates.values() for template in pair)
+        atrial = np.zeros(count + length)
+        ventricular = np.zeros(count + length)
+
+        times = self.events["time"]
+        window = self.events[np.searchsorted(times, start - TEMPLATE_SECONDS):np.searchsorted(times, stop)]
+        for (chamber, paced), (atrial_template, ventricular_template) in templates.items():
+            if paced:
+                events = window[(window["chamber"] == chamber) & np.isin(window["kind"], (PACE, NO_CAPTURE))]
+            else:
+                events = window[(window["chamber"] == chamber) & (window["kind"] != PACE) & (window["kind"] != NO_CAPTURE)]
+            offsets = np.round((events["time"] - start) * sample_rate).astype(int)
+            for template, channel in ((atrial_template, atrial), (ventricular_template, ventricular)):
+                # Templates starting before the window are clipped at its left edge
+                index = offsets[:, None] + np.arange(len(template))
+                keep = index >= 0
+                np.add.at(channel, index[keep], np.broadcast_to(template, index.shape)[keep])
+        return atrial[:count], ventricular[:count]
+
+
+def _event_templates(params, paced_chamber, heart, sample_rate):
+    # Waveforms each kind of event adds to (atrial, ventricular), keyed by (chamber, paced)
+    fs = sample_rate
+    length = int(TEMPLATE_SECONDS * fs)
+
+    def fit(wave):
+        out = np.zeros(length)
+        out[:min(len(wave), length)] = wave[:length]
+        return out
+
+    p_wave = heart.p_amplitude * hann_wave(0.08, fs)
+    qrs = heart.r_amplitude * qrs_wave(0.1, fs)
+    t_wave = 0.2 * heart.r_amplitude * hann_wave(0.16, fs)
+    ventricular = np.zeros(int(0.25 * fs) + len(t_wave))
+    ventricular[:len(qrs)] = qrs
+    ventricular[int(0.25 * fs):] += t_wave
+
+    chamber_name = "Atrial" if paced_chamber == "A" else "Ventricular"
+    amplitude = float(params[f"{chamber_name} Amplitude (V)"])
+    spike = pace_spike(float(params[f"{chamber_name} Pulse Width (ms)"]), amplitude, fs)
+
+    templates = {
+        ("A", False): (fit(p_wave), fit(0.1 * p_wave)),
+        ("V", False): (fit(0.2 * qrs), fit(ventricular)),
+    }
+    # A paced beat starts with the pacing artifact; paced QRS complexes are wider
+    if paced_chamber == "A":
+        templates[("A", True)] = (fit(np.concatenate((spike, p_wave))), fit(0.1 * p_wave))
+    else:
+        templates[("V", True)] = (fit(0.2 * qrs), fit(np.concatenate((spike, 1.3 * ventricular))))
+    return templates
+
+
+class PacingSimulator:
+    """
+    Discrete-event model of a single-chamber pacemaker and the heart it paces.
+
+    The device keeps an escape timer for its chamber. It fires a pulse when
+    the timer runs out and, in inhibited modes, restarts the timer on every
+    beat it senses outside its refractory periods (ARP/VRP, and PVARP after
+    a ventricular beat in atrial modes). The timer runs in cycles of the
+    current pacing rate: LRL, or in rate-adaptive modes the sensor-indicated
+    rate, which follows activity within Reaction and Recovery Time and stops
+    at MSR. Hysteresis lengthens the escape interval after a sensed beat and
+    Rate Smoothing limits how much an interval may differ from the last,
+    without ever pacing faster than URL (MSR in rate-adaptive modes).
+    Single-chamber modes don't track atrial rate, so URL is otherwise only
+    used by the parameter validation.
+
+    Runs with no intrinsic activity go through a vectorized fast-forward
+    path, since every pace time then follows from the rate alone; anything
+    else goes through the event loop.
+    """
+
+    def __init__(self, mode, params=None, heart=None, seed=None):
+        if mode not in PARAM_FOR_MODES:
+            raise ValueError(f"Unknown pacing mode '{mode}'.")
+        self.mode = mode
+        self.params = dict(PARAM_DEFAULTS)
+        self.params.update(params or {})
+        self.heart = HeartModel() if heart is None else heart
+        self.rng = np.random.default_rng(seed)
+
+        self.chamber = mode[0]
+        self.sensing = mode[1] != "O"
+        self.rate_adaptive = mode.endswith("R")
+        self.lower_rate = float(self.params["Lower Rate Limit (ppm)"])
+        upper = "Maximum Sensor Rate (ppm)" if self.rate_adaptive else "Upper Rate Limit (ppm)"
+        self.upper_rate = max(float(self.params[upper]), self.lower_rate)
+        names = PARAM_FOR_MODES[mode]
+        self.smoothing = float(self.params["Rate Smoothing (%)"]) / 100 if "Rate Smoothing (%)" in names else 0.0
+        hysteresis = "Hysteresis" in names and int(self.params["Hysteresis"])
+        # Cycles of the pacing rate the escape timer runs after a sensed beat
+        self.sensed_cycles = self.lower_rate / max(self.lower_rate - HYSTERESIS_PPM, 1) if hysteresis else 1.0
+        if self.chamber == "A":
+            self.refractory = float(self.params["ARP (ms)"]) / 1000
+            self.pvarp = float(self.params["PVARP (ms)"]) / 1000
+            self.amplitude = float(self.params["Atrial Amplitude (V)"])
+            self.sensitivity = float(self.params["Atrial Sensitivity (mV)"])
+            self.intrinsic_amplitude = self.heart.p_amplitude
+        else:
+            self.refractory = float(self.params["VRP (ms)"]) / 1000
+            self.pvarp = 0.0
+            self.amplitude = float(self.params["Ventricular Amplitude (V)"])
+            self.sensitivity = float(self.params["Ventricular Sensitivity (mV)"])
+            self.intrinsic_amplitude = self.heart.r_amplitude
+
+    def activity(self, times):
+        if self.heart.activity is None:
+            return np.zeros(len(times))
+        return np.clip(np.broadcast_to(self.heart.activity(times), (len(times),)), 0.0, 1.0)
+
+    def sensor_rates(self, duration):
+        """
+        Returns the pacing rate (ppm) for each SENSOR_STEP of the run.
+        Without rate adaptation this is LRL throughout.
+        """
+        steps = int(math.ceil(duration / SENSOR_STEP)) + 1
+        if not self.rate_adaptive:
+            return np.full(steps, self.lower_rate)
+        max_rate = max(float(self.params["Maximum Sensor Rate (ppm)"]), self.lower_rate)
+        span = max_rate - self.lower_rate
+        threshold = ACTIVITY_THRESHOLDS[int(self.params["Activity Threshold"])]
+        factor = float(self.params["Response Factor"])
+        excess = np.clip((self.activity(np.arange(steps) * SENSOR_STEP) - threshold) * factor / RESPONSE_SCALE, 0, 1)
+        targets = self.lower_rate + span * excess
+
+        # Rise over Reaction Time and fall over Recovery Time for a full LRL-MSR swing
+        rise = span / float(self.params["Reaction Time (s)"]) * SENSOR_STEP
+        fall = span / (float(self.params["Recovery Time (min)"]) * 60) * SENSOR_STEP
+        rates = np.empty(steps)
+        rate = self.lower_rate
+        for i, target in enumerate(targets.tolist()):
+            rates[i] = rate
+            rate += min(max(target - rate, -fall), rise)
+        return rates
+
+    def run(self, duration, fast=True):
+        """
+        Simulates duration seconds from the device's first cycle.
+        :param fast: Use the vectorized path when the run qualifies.
+        :return: A SimulationResult.
+        """
+        rates = self.sensor_rates(duration)
+        grid = np.arange(len(rates) + 1) * SENSOR_STEP
+        phase = np.concatenate(([0.0], np.cumsum(rates * SENSOR_STEP / 60.0)))
+        events = None
+        if fast and self._can_fast_forward():
+            events = self._fast_forward(duration, grid, phase)
+        if events is None:
+            events = self._event_loop(duration, grid, phase)
+        return SimulationResult(self.mode, self.params, self.heart, duration, events)
+
+    def _can_fast_forward(self):
+        # With no intrinsic beats nothing is sensed, so only the rate decides pace times
+        heart = self.heart
+        return heart.sinus_rate <= 0 and heart.pac_rate <= 0 and heart.pvc_rate <= 0
+
+    def _fast_forward(self, duration, grid, phase):
+        # Pace k comes when the rate integrated from the start reaches k cycles
+        total = np.interp(duration, grid, phase)
+        paces = np.interp(np.arange(1, int(total) + 1, dtype=float), phase, grid)
+        paces = paces[paces < duration]
+        intervals = np.diff(paces)
+        if len(intervals) > 1 and self.smoothing and (
+                np.abs(np.diff(intervals)) > self.smoothing * intervals[:-1] + 1e-9).any():
+            return None  # Rate Smoothing would step in, which needs the event loop
+        if len(intervals) and intervals.min() < HEART_REFRACTORY:
+            return None  # Some pulses would land in the refractory myocardium
+
+        captured = self.amplitude >= self.heart.capture_threshold
+        parts = [(paces, self.chamber, PACE if captured else NO_CAPTURE)]
+        if captured and self.chamber == "A" and not self.heart.av_block:
+            conducted = paces + self.heart.av_delay
+            parts.append((conducted[conducted < duration], "V", INTRINSIC))
+
+        events = np.zeros(sum(len(times) for times, _, _ in parts), dtype=EVENT_DTYPE)
+        offset = 0
+        for times, chamber, kind in parts:
+            block = events[offset:offset + len(times)]
+            block["time"], block["chamber"], block["kind"] = times, chamber, kind
+            offset += len(times)
+        return events[np.argsort(events["time"], kind="stable")]
+
+    def _event_loop(self, duration, grid, phase):
+        heart = self.heart
+        rng = self.rng
+        chamber = self.chamber
+        inf = math.inf
+        events = []
+        last_depolarization = {"A": -inf, "V": -inf}
+
+        def sinus_interval(t):
+            rate = heart.sinus_rate + heart.sinus_reserve * float(self.activity(np.array([t]))[0])
+            return 60.0 / rate * max(1 + heart.variability * rng.standard_normal(), 0.2)
+
+        def poisson_next(t, per_minute):
+            return t + rng.exponential(60.0 / per_minute) if per_minute > 0 else inf
+
+        def escape_after(t, cycles, previous_interval):
+            # When the timer started at t runs out, honouring Rate Smoothing
+            expires = float(np.interp(np.interp(t, grid, phase) + cycles, phase, grid))
+            if self.smoothing and previous_interval:
+                interval = min(max(expires - t, previous_interval * (1 - self.smoothing)),
+                               previous_interval * (1 + self.smoothing))
+                # Smoothing after a fast sensed beat must not pace above the upper rate
+                expires = t + max(interval, 60.0 / self.upper_rate)
+            return expires
+
+        timer_start = 0.0  # Last device pace or sense
+        previous_interval = None
+        next_escape = escape_after(0.0, 1.0, None)
+        next_sinus = sinus_interval(0.0) * rng.random() if heart.sinus_rate > 0 else inf
+        next_conducted = inf
+        next_pac = poisson_next(0.0, heart.pac_rate)
+        next_pvc = poisson_next(0.0, heart.pvc_rate)
+
+        def restart(t, cycles):
+            nonlocal timer_start, previous_interval, next_escape
+            previous_interval = t - timer_start if events else None
+            timer_start = t
+            next_escape = escape_after(t, cycles, previous_interval)
+
+        def depolarize(where, t):
+            nonlocal next_sinus, next_conducted
+            last_depolarization[where] = t
+            if where == "A":
+                # Any atrial beat resets the sinus node and heads for the ventricle
+                if heart.sinus_rate > 0:
+                    next_sinus = t + sinus_interval(t)
+                if not heart.av_block:
+                    next_conducted = t + heart.av_delay
+
+        def intrinsic(where, t):
+            if t - last_depolarization[where] < HEART_REFRACTORY:
+                return  # The myocardium is still refractory
+            previous_ventricular = last_depolarization["V"]
+            depolarize(where, t)
+            if where != chamber or not self.sensing or self.intrinsic_amplitude < self.sensitivity:
+                kind = INTRINSIC
+            elif t - timer_start < self.refractory or (where == "A" and t - previous_ventricular < self.pvarp):
+                kind = REFRACTORY_SENSE
+            else:
+                kind = SENSE
+                restart(t, self.sensed_cycles)
+            events.append((t, where, kind))
+
+        while True:
+            t = min(next_escape, next_sinus, next_conducted, next_pac, next_pvc)
+            if t >= duration:
+                break
+            if t == next_escape:
+                captured = (self.amplitude >= heart.capture_threshold
+                            and t - last_depolarization[chamber] >= HEART_REFRACTORY)
+                events.append((t, chamber, PACE if captured else NO_CAPTURE))
+                if captured:
+                    depolarize(chamber, t)
+                restart(t, 1.0)
+            elif t == next_conducted:
+                next_conducted = inf
+                intrinsic("V", t)
+            elif t == next_sinus:
+                next_sinus = t + sinus_interval(t)  # Overridden if the beat depolarizes the atrium
+                intrinsic("A", t)
+            elif t == next_pac:
+                next_pac = poisson_next(t, heart.pac_rate)
+                intrinsic("A", t)
+            else:
+                next_pvc = poisson_next(t, heart.pvc_rate)
+                intrinsic("V", t)
+
+        return np.array(events, dtype=EVENT_DTYPE)
+
+
+def simulate(mode, params=None, duration=60.0, heart=None, seed=None):
+    """Runs a PacingSimulator once and returns its SimulationResult."""
+    return PacingSimulator(mode, params, heart, seed).run(duration)
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Simulate a parameter set before programming it.")
+    parser.add_argument("mode", nargs="?", help="Pacing mode (default: the user's saved mode)")
+    parser.add_argument("--user", help="Use this user's saved parameters")
+    parser.add_argument("--hours", type=float, default=1.0, help="Length of the run")
+    parser.add_argument("--heart", choices=sorted(HEART_PRESETS), default="bradycardia", help="Patient rhythm")
+    parser.add_argument("--exercise", action="store_true", help="Alternate rest and exercise every two minutes")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    params = {}
+    mode = args.mode
+    if args.user:
+        from serialcomm import read_user_parameters
+        from user_store import DB_FILE
+        params = read_user_parameters(DB_FILE, args.user) or {}
+        mode = mode or params.pop("mode", None)
+    mode = mode or "AOO"
+    heart = HEART_PRESETS[args.heart]
+    if args.exercise:
+        heart = heart._replace(activity=cyclic_activity())
+
+    for error in validate(mode, params):
+        print(f"Warning: {error}")
+    result = simulate(mode, params, args.hours * 3600, heart, args.seed)
+    print(json.dumps(result.summary(), indent=2))
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import deque
+
+import diagnostics
+from modes import validate
+from serialcomm import ACK_OK, AckFrame, FrameDecoder, PacketCodec, crc8
+
+ACK_TIMEOUT = 0.1  # Seconds to wait for an ACK before retransmitting
+MAX_RETRIES = 3  # Retransmissions before a write is given up
+MAX_IN_FLIGHT = 4  # Unacknowledged writes allowed on the link at once
+
+
+class WriteRequest:
+    """One parameter write and, once finished, its outcome."""
+
+    def __init__(self, seq, mode, packet, expected_crc, callback=None):
+        self.seq = seq
+        self.mode = mode
+        self.packet = packet
+        self.expected_crc = expected_crc
+        self.callback = callback
+        self.attempts = 0
+        self.deadline = None
+        self.sent_at = None
+        self.round_trip = None  # Seconds from the last send to the ACK
+        self.applied = False  # True once the device confirmed the exact values
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the write finishes or the timeout expires.
+        :return: True if the device applied the parameters.
+        """
+        self._done.wait(timeout)
+        return self.applied
+
+
+class ParameterLink:
+    """
+    Acknowledged, pipelined SET_PARAMS writes.
+
+    Every packet carries a sequence number and CRC. The device answers with
+    an ACK frame holding the CRC of what it applied, which must match what
+    was sent. Up to `window` writes are in flight at once; the rest queue.
+    Unacknowledged writes are resent after `timeout` seconds, up to
+    `retries` times. handle_frame() and check_timeouts() are driven by
+    whoever reads the port (see SerialReader).
+    """
+
+    def __init__(self, write, codec=None, timeout=ACK_TIMEOUT, retries=MAX_RETRIES, window=MAX_IN_FLIGHT):
+        self.write = write
+        self.codec = PacketCodec() if codec is None else codec
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self.next_seq = 0
+        self.in_flight = {}  # seq -> WriteRequest
+        self.queued = deque()
+        self._lock = threading.Lock()
+
+    def send(self, mode, params, callback=None):
+        """
+        Queues a parameter write and transmits it as soon as the window allows.
+        :param mode: Pacing mode name.
+        :param params: Parameter dictionary for the mode.
+        :param callback: Optional callback(request), called from the reading
+            thread once the write succeeds or fails.
+        :return: The WriteRequest tracking the write.
+        :raises ValueError: If the parameters fail validation or cannot be encoded.
+        """
+        errors = validate(mode, params)
+        if errors:
+            raise ValueError(" ".join(errors))
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq = (seq + 1) & 0xFF
+            packet = bytes(self.codec.encode(mode, params, seq=seq))
+            # The device reports the CRC of the mode code and parameters it stored
+            request = WriteRequest(seq, mode, packet, crc8(packet[3:-1]), callback)
+            self.queued.append(request)
+            ready = self._fill_window()
+        self._transmit(ready)
+        return request
+
+    def handle_frame(self, frame):
+        """Matches an ACK frame to its write; other frames are ignored."""
+        if not isinstance(frame, AckFrame):
+            return
+        finished = []
+        resend = []
+        with self._lock:
+            request = self.in_flight.get(frame.seq)
+            if request is None:
+                return  # Late ACK for a write that already finished
+            if frame.status == ACK_OK and frame.applied_crc == request.expected_crc:
+                request.applied = True
+                request.error = None
+                request.round_trip = time.perf_counter() - request.sent_at
+                diagnostics.record("serial.round_trip", request.round_trip)
+                finished.append(self._finish(request))
+            elif frame.status != ACK_OK:
+                request.error = f"Device rejected the parameters (status {frame.status})."
+                finished.append(self._finish(request))
+            elif request.attempts > self.retries:
+                request.error = "Device applied different values than were sent."
+                finished.append(self._finish(request))
+            else:
+                resend.append(request)
+            resend.extend(self._fill_window())
+        self._transmit(resend)
+        self._notify(finished)
+
+    def check_timeouts(self, now=None):
+        """Resends writes whose ACK is overdue and fails those out of retries."""
+        if now is None:
+            now = time.perf_counter()
+        finished = []
+        resend = []
+        with self._lock:
+            for request in list(self.in_flight.values()):
+                if request.deadline is None or request.deadline > now:
+                    continue
+                if request.attempts > self.retries:
+                    request.error = f"No acknowledgement after {request.attempts} attempts."
+                    finished.append(self._finish(request))
+                else:
+                    resend.append(request)
+            resend.extend(self._fill_window())
+        self._transmit(resend)
+        self._notify(finished)
+
+    def fail_all(self, error):
+        """Fails every pending write, e.g. when the port closes."""
+        with self._lock:
+            pending = list(self.in_flight.values()) + list(self.queued)
+            self.in_flight.clear()
+            self.queued.clear()
+            for request in pending:
+                request.error = error
+        for request in pending:
+            request._done.set()
+        self._notify(pending)
+
+    @property
+    def pending(self):
+        return len(self.in_flight) + len(self.queued)
+
+    def _fill_window(self):
+        # Move queued writes into the window (caller holds the lock)
+        ready = []
+        while self.queued and len(self.in_flight) < self.window:
+            request = self.queued.popleft()
+            self.in_flight[request.seq] = request
+            ready.append(request)
+        return ready
+
+    def _finish(self, request):
+        # Caller holds the lock
+        del self.in_flight[request.seq]
+        request._done.set()
+        return request
+
+    def _transmit(self, requests):
+        if not requests:
+            return
+        with self._lock:
+            for request in requests:
+                request.attempts += 1
+                request.sent_at = time.perf_counter()
+                request.deadline = request.sent_at + self.timeout
+        for request in requests:
+            try:
+                self.write(request.packet)
+            except Exception as e:
+                # Leave it in flight; the timeout path retries or fails it
+                request.error = str(e)
+
+    def _notify(self, requests):
+        for request in requests:
+            if request.callback is not None:
+                request.callback(request)
+
+
+def write_parameters(ser, mode, params, timeout=ACK_TIMEOUT, retries=MAX_RETRIES):
+    """
+    Sends one parameter set on an open port and waits for the device to confirm it.
+    :param ser: Serial object (its read timeout bounds each poll).
+    :return: The finished WriteRequest.
+    """
+    link = ParameterLink(ser.write, timeout=timeout, retries=retries)
+    decoder = FrameDecoder()
+    request = link.send(mode, params)
+    while not request.done:
+        for frame in decoder.feed(ser.read(ser.in_waiting or 1)):
+            link.handle_frame(frame)
+        link.check_timeouts()
+    return request
@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import diagnostics
+
+BCRYPT_ROUNDS = 12  # Work factor; changing it rehashes passwords at their next login
+SESSION_TTL = 300  # Seconds a verified login is remembered
+HASH_WORKERS = 2  # Threads doing bcrypt work off the UI thread
+
+
+class PasswordHasher:
+    """
+    bcrypt hashing with a configurable work factor.
+
+    The slow work can be run on a small thread pool through submit(), so
+    Tk callbacks never block on it. Successful logins are remembered for
+    SESSION_TTL seconds as an HMAC under a per-process random key, so a
+    repeated login on a shared workstation skips bcrypt entirely.
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, session_ttl=SESSION_TTL, workers=HASH_WORKERS):
+        self.rounds = rounds
+        self.session_ttl = session_ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PasswordHasher")
+        self._key = os.urandom(32)
+        self._sessions = {}  # name -> (digest, expiry)
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        with diagnostics.timer("hash.hash"):
+            salt = bcrypt.gensalt(rounds=self.rounds)
+            return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, hashed_password, password):
+        with diagnostics.timer("hash.check"):
+            return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    def needs_rehash(self, hashed_password):
+        # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+        try:
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the hashing pool and return its Future."""
+        return self.executor.submit(fn, *args)
+
+    def remember(self, name, hashed_password, password):
+        # Cache a verified login until the session expires
+        digest = self._digest(name, hashed_password, password)
+        with self._lock:
+            self._sessions[name] = (digest, time.monotonic() + self.session_ttl)
+
+    def is_remembered(self, name, hashed_password, password):
+        """True if this exact login was verified less than session_ttl ago."""
+        with self._lock:
+            entry = self._sessions.get(name)
+            if entry is None:
+                return False
+            digest, expiry = entry
+            if time.monotonic() > expiry:
+                del self._sessions[name]
+                return False
+        return hmac.compare_digest(digest, self._digest(name, hashed_password, password))
+
+    def forget(self, name):
+        with self._lock:
+            self._sessions.pop(name, None)
+
+    def _digest(self, name, hashed_password, password):
+        # Tied to the stored hash, so a password change ends the session
+        message = "\0".join((name, hashed_password, password)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
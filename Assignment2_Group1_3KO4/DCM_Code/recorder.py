@@ -0,0 +1,125 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from serialcomm import TELEMETRY_FIELDS, TELEMETRY_STRUCT
+
+SESSION_DIR = "sessions"
+SESSION_SUFFIX = ".egm"
+MAGIC = b"DCMREC01"
+FORMAT_VERSION = 1
+HEADER_SIZE = 64  # Bytes reserved at the start of the file
+HEADER_STRUCT = struct.Struct('<8sHHd')  # magic, version, record size, start time
+BLOCK_RECORDS = 4096  # Records buffered in memory before they hit the disk
+
+# One record is a timestamp followed by the telemetry payload exactly as it
+# came off the wire, so the file maps straight onto a structured dtype.
+RECORD_STRUCT = struct.Struct('<d' + TELEMETRY_STRUCT.format.lstrip('<'))
+_DTYPE_CODES = {'B': 'u1', 'H': '<u2', 'f': '<f4'}
+RECORD_DTYPE = np.dtype(
+    [("timestamp", '<f8')]
+    + [(name, _DTYPE_CODES[code]) for name, code in zip(TELEMETRY_FIELDS, TELEMETRY_STRUCT.format.lstrip('<'))]
+)
+
+
+class SessionRecorder:
+    """
+    Appends telemetry frames to a fixed-record binary session file.
+
+    Records are packed into a preallocated block and written out whenever
+    the block fills, so memory use stays constant however long the session
+    runs. Use open_session() to map a finished (or growing) file back.
+    """
+
+    def __init__(self, path, block_records=BLOCK_RECORDS):
+        self.path = path
+        self.block = bytearray(block_records * RECORD_STRUCT.size)
+        self.block_records = block_records
+        self.pending = 0  # Records in the block not yet written
+        self.count = 0  # Records appended in total
+        self.file = open(path, "wb")
+        header = HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, RECORD_STRUCT.size, time.time())
+        self.file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, frame, timestamp=None):
+        """
+        Adds one telemetry frame.
+        :param frame: TelemetryFrame (or any sequence of the payload fields).
+        :param timestamp: Seconds since the epoch (default: now).
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        RECORD_STRUCT.pack_into(self.block, self.pending * RECORD_STRUCT.size, timestamp, *frame)
+        self.pending += 1
+        self.count += 1
+        if self.pending == self.block_records:
+            self.flush()
+
+    def extend(self, frames, timestamps=None):
+        """
+        Adds a batch of frames.
+        :param timestamps: Seconds since the epoch for each frame (default:
+            now for all of them).
+        """
+        if timestamps is None:
+            timestamps = [time.time()] * len(frames)
+        for frame, timestamp in zip(frames, timestamps):
+            self.append(frame, timestamp)
+
+    def flush(self):
+        if self.pending:
+            with memoryview(self.block) as view:
+                self.file.write(view[:self.pending * RECORD_STRUCT.size])
+            self.pending = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def new_session_path(username, directory=SESSION_DIR):
+    """Returns a fresh session file path for a user, creating the directory."""
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(directory, f"{username}_{stamp}{SESSION_SUFFIX}")
+
+
+def read_header(path):
+    """
+    Reads a session file header.
+    :return: A (version, record size, start time) tuple.
+    :raises ValueError: If the file is not a session recording.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_STRUCT.size:
+        raise ValueError(f"'{path}' is too short to be a session file.")
+    magic, version, record_size, start_time = HEADER_STRUCT.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError(f"'{path}' is not a session file.")
+    if version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"'{path}' uses an unsupported format (version {version}).")
+    return version, record_size, start_time
+
+
+def open_session(path):
+    """
+    Maps a session file read-only without loading it.
+    :return: A structured np.memmap with one row per record (columns as in
+        RECORD_DTYPE), or an empty array if nothing was recorded.
+    """
+    read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
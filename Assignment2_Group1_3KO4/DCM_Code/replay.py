@@ -0,0 +1,102 @@
+import numpy as np
+
+from decimation import MinMaxPyramid
+from recorder import open_session
+
+MIN_SPEED = 1
+MAX_SPEED = 50
+DEFAULT_SAMPLE_RATE = 250  # Used when a session is too short to measure its rate
+GAP_SECONDS = 0.5  # Longer pauses between frames are dropouts, not part of the rate
+
+
+def estimate_sample_rate(timestamps, default=DEFAULT_SAMPLE_RATE):
+    """
+    Works out the frame rate a session was recorded at from its timestamps.
+    Pauses longer than GAP_SECONDS (e.g. a dropped connection) are left out.
+    :param timestamps: Per-frame times in seconds, oldest first.
+    :return: Frames per second, or default if it can't be measured.
+    """
+    if len(timestamps) < 2:
+        return default
+    steps = np.diff(np.asarray(timestamps, dtype=float))
+    steps = steps[(steps >= 0) & (steps <= GAP_SECONDS)]
+    span = float(steps.sum())
+    if span <= 0:
+        return default
+    return len(steps) / span
+
+
+class SessionPlayer:
+    """
+    Playback state for a recorded telemetry session.
+
+    The session file stays memory-mapped; each channel gets a min/max
+    pyramid so any window can be drawn at screen resolution. Unless given,
+    the sample rate is measured from the recorded timestamps.
+    """
+
+    def __init__(self, path, sample_rate=None):
+        self.path = path
+        self.session = open_session(path)
+        self.sample_rate = sample_rate or estimate_sample_rate(self.session["timestamp"])
+        self.atrial = MinMaxPyramid(self.session["atr_electrogram"])
+        self.ventricular = MinMaxPyramid(self.session["vent_electrogram"])
+        self.position = 0.0  # Sample at the left edge of the view
+        self.speed = MIN_SPEED
+        self.playing = True
+
+    def __len__(self):
+        return len(self.session)
+
+    @property
+    def duration(self):
+        return len(self.session) / self.sample_rate
+
+    @property
+    def time(self):
+        """Seconds into the session at the left edge of the view."""
+        return self.position / self.sample_rate
+
+    def limits(self):
+        """Return (low, high) over both channels for the whole session."""
+        lows, highs = [], []
+        for pyramid in (self.atrial, self.ventricular):
+            if pyramid.levels:
+                _, mins, maxs = pyramid.levels[-1]
+                lows.append(mins.min())
+                highs.append(maxs.max())
+            elif len(pyramid):
+                lows.append(float(min(pyramid.signal)))
+                highs.append(float(max(pyramid.signal)))
+        if not lows:
+            return 0.0, 1.0
+        return min(lows), max(highs)
+
+    def set_speed(self, speed):
+        self.speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+
+    def seek(self, seconds):
+        self.position = min(max(seconds * self.sample_rate, 0.0), float(len(self.session)))
+
+    def advance(self, elapsed):
+        """Move forward by elapsed wall-clock seconds at the current speed."""
+        if not self.playing:
+            return
+        self.position += elapsed * self.speed * self.sample_rate
+        if self.position >= len(self.session):
+            self.position = float(len(self.session))
+            self.playing = False
+
+    def window(self, width, max_points):
+        """
+        Returns the data to draw for the view.
+        :param width: Width of the view in seconds.
+        :param max_points: Horizontal resolution of the plot in pixels.
+        :return: (times, atrial, times, ventricular) with times in seconds
+            relative to the left edge of the view.
+        """
+        start = int(self.position)
+        stop = start + int(width * self.sample_rate)
+        atr_x, atr_y = self.atrial.query(start, stop, max_points)
+        vent_x, vent_y = self.ventricular.query(start, stop, max_points)
+        return (atr_x - start) / self.sample_rate, atr_y, (vent_x - start) / self.sample_rate, vent_y
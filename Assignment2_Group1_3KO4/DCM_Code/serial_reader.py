@@ -0,0 +1,223 @@
+import threading
+import time
+
+import serial
+
+import diagnostics
+from param_link import ParameterLink
+from serialcomm import BAUD_RATE, FrameDecoder, TelemetryFrame, create_echo_request
+
+READ_TIMEOUT = 0.05  # Seconds a read may block before the stop flag is checked
+RING_CAPACITY = 4096  # Frames kept for the GUI before new ones are dropped
+RECONNECT_DELAY = 1.0  # Seconds between attempts to reopen a failed port
+
+
+class RingBuffer:
+    """
+    Bounded single-producer/single-consumer queue.
+
+    The reader thread is the only one that calls put() and the Tk main loop
+    is the only one that calls drain(), so no lock is needed: each side only
+    ever writes its own counter.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.stamps = [0.0] * capacity  # Time each item was put, alongside it
+        self.head = 0  # Total items written (producer only)
+        self.tail = 0  # Total items read (consumer only)
+        self.overruns = 0  # Items dropped because the consumer fell behind
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def put(self, item, stamp=0.0):
+        # Add an item (and the time it arrived), dropping it if the buffer is full
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.overruns += 1
+            return False
+        slot = head % self.capacity
+        self.items[slot] = item
+        self.stamps[slot] = stamp
+        self.head = head + 1
+        return True
+
+    def drain(self, max_items=None):
+        # Remove and return everything written so far (oldest first)
+        return self.drain_stamped(max_items)[0]
+
+    def drain_stamped(self, max_items=None):
+        """
+        Removes everything written so far, oldest first.
+        :return: An (items, stamps) tuple of lists.
+        """
+        tail = self.tail
+        count = self.head - tail
+        if max_items is not None:
+            count = min(count, max_items)
+        items = self.items
+        stamps = self.stamps
+        capacity = self.capacity
+        drained = []
+        drained_stamps = []
+        for index in range(tail, tail + count):
+            slot = index % capacity
+            drained.append(items[slot])
+            drained_stamps.append(stamps[slot])
+            items[slot] = None
+        self.tail = tail + count
+        return drained, drained_stamps
+
+
+class SerialReader(threading.Thread):
+    """
+    Background thread that owns a serial port, decodes incoming frames and
+    pushes telemetry into a RingBuffer for the GUI to drain with after().
+    Other frames (ACKs) go to the reader's ParameterLink, which is also
+    serviced for timeouts on every pass of the loop.
+    """
+
+    def __init__(self, port, baud_rate=BAUD_RATE, capacity=RING_CAPACITY, reconnect=False):
+        super().__init__(name=f"SerialReader-{port}", daemon=True)
+        self.port = port
+        self.baud_rate = baud_rate
+        self.frames = RingBuffer(capacity)
+        self.decoder = FrameDecoder()
+        self.link = ParameterLink(self.write)
+        self.error = None  # Exception that closed the port, if any
+        self.reconnect = reconnect  # Reopen the port after it fails
+        self.reconnect_delay = RECONNECT_DELAY
+        self.connected = threading.Event()
+        self._stop_event = threading.Event()
+        self._write_lock = threading.Lock()
+        self._serial = None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with diagnostics.timer("serial.open"):
+                    self._serial = serial.Serial(self.port, self.baud_rate, timeout=READ_TIMEOUT)
+                self._serial.reset_output_buffer()
+                self._serial.reset_input_buffer()
+                self._serial.write(create_echo_request())  # Ask for telemetry
+                self.error = None
+                self.connected.set()
+                self._read_loop(self._serial)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.connected.clear()
+                self.link.fail_all("Serial port closed.")
+                if self._serial is not None:
+                    self._serial.close()
+                    self._serial = None
+
+            # Keep retrying the port until stopped, if asked to
+            if not self.reconnect:
+                break
+            self._stop_event.wait(self.reconnect_delay)
+
+    def _read_loop(self, ser):
+        put = self.frames.put
+        feed = self.decoder.feed
+        link = self.link
+        clock = time.perf_counter
+        # The blocking read is mostly idle time waiting for the device, so it
+        # is kept apart from the work done on each chunk once it has arrived
+        wait_time = diagnostics.histogram("serial.wait").record
+        decode_time = diagnostics.histogram("frame.decode").record
+        wall_clock = time.time
+        while not self._stop_event.is_set():
+            start = clock()
+            chunk = ser.read(ser.in_waiting or 1)
+            if chunk:  # A timed out read says nothing about the link's speed
+                read = clock()
+                received = wall_clock()  # Recorded with each frame, as it came off the port
+                for frame in feed(chunk):
+                    if type(frame) is TelemetryFrame:
+                        put(frame, received)
+                    else:
+                        link.handle_frame(frame)
+                decode_time(clock() - read)
+                wait_time(read - start)
+            if link.in_flight:
+                link.check_timeouts()
+
+    def write(self, data):
+        """
+        Sends bytes on the port owned by this reader.
+        :param data: Bytes-like object to send.
+        """
+        if not self.connected.is_set():
+            raise serial.SerialException(f"Port {self.port} is not open.")
+        with self._write_lock:
+            ser = self._serial
+            if ser is None:
+                raise serial.SerialException(f"Port {self.port} is not open.")
+            with diagnostics.timer("serial.write"):
+                ser.write(data)
+
+    def stop(self, timeout=1.0):
+        # Ask the thread to exit and wait for it to release the port
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+
+class TelemetryFeed:
+    """
+    Fans frames drained from a SerialReader out to GUI subscribers.
+
+    Only the Tk main loop touches this object: it calls poll() from after()
+    and every subscriber callback runs there too.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.subscribers = []
+        self.stamped_subscribers = []
+
+    @property
+    def connected(self):
+        return self.reader is not None and self.reader.connected.is_set()
+
+    def attach(self, reader):
+        # Frames queued while nobody was listening are stale, so start from now
+        reader.frames.drain()
+        self.reader = reader
+
+    def detach(self):
+        # Empty the ring so the idle reader keeps room for fresh frames
+        if self.reader is not None:
+            self.reader.frames.drain()
+        self.reader = None
+
+    def subscribe(self, callback, stamped=False):
+        """
+        Registers a callback for every non-empty batch of frames.
+        :param stamped: Call callback(frames, stamps) instead of
+            callback(frames), stamps being the time.time() each frame was
+            read off the port.
+        """
+        subscribers = self.stamped_subscribers if stamped else self.subscribers
+        if callback not in subscribers:
+            subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        for subscribers in (self.subscribers, self.stamped_subscribers):
+            if callback in subscribers:
+                subscribers.remove(callback)
+
+    def poll(self):
+        # Drain the reader's ring buffer and hand the frames to subscribers
+        if self.reader is None:
+            return []
+        frames, stamps = self.reader.frames.drain_stamped()
+        if frames:
+            for callback in list(self.subscribers):
+                callback(frames)
+            for callback in list(self.stamped_subscribers):
+                callback(frames, stamps)
+        return frames
@@ -1,7 +1,8 @@
-import json
 import struct
-import serial
-import time
+import weakref
+from collections import namedtuple
+
+from modes import MODES, PARAM_DEFAULTS, PARAM_FOR_MODES, PARAM_WIRE_TYPES
 
 # Constants
 SERIAL_PORT = 'COM3'  # Replace 'COMx' with your actual COM port
@@ -9,27 +10,186 @@ BAUD_RATE = 115200
 TIMEOUT = 1  # Timeout for serial communication in seconds
 SYNC = 0x16
 FN_CODE_SET_PARAMS = 0x55
+FN_CODE_ECHO = 0x22
+FN_CODE_ACK = 0x33
+
+# Status byte of an ACK frame
+ACK_OK = 0x00
+ACK_REJECTED = 0x01
+
+PORTS_ARRAY = {"COM3", "COM6"}  # Offered when port enumeration finds nothing
+
+# Mode byte sent in SET_PARAMS packets
+MODE_CODES = {mode: code for code, mode in enumerate(MODES, start=1)}
+
+# Telemetry payload sent back by the pacemaker (little-endian, no padding)
+TELEMETRY_FIELDS = (
+    "mode",
+    "lower_rate",
+    "upper_rate",
+    "atr_amp",
+    "vent_amp",
+    "atr_width",
+    "vent_width",
+    "vrp",
+    "arp",
+    "hysteresis",
+    "rate_smoothing",
+    "activity_threshold",
+    "reaction_time",
+    "response_factor",
+    "recovery_time",
+    "vent_electrogram",
+    "atr_electrogram",
+)
+TELEMETRY_STRUCT = struct.Struct('<BBBffffHHBBBBBBHH')
+TelemetryFrame = namedtuple("TelemetryFrame", TELEMETRY_FIELDS)
+
+# Acknowledgement of a SET_PARAMS packet. applied_crc is the CRC-8 of the
+# mode code and parameter bytes the device actually stored.
+ACK_STRUCT = struct.Struct('<BBB')
+AckFrame = namedtuple("AckFrame", ("seq", "status", "applied_crc"))
+
+# Payload layout and frame type for every function code the decoder accepts
+FRAME_LAYOUTS = {
+    FN_CODE_ECHO: (TELEMETRY_STRUCT, TelemetryFrame),
+    FN_CODE_ACK: (ACK_STRUCT, AckFrame),
+}
+
 
-PORTS_ARRAY = {"COM3", "COM6"}
+def _make_crc8_table(poly=0x07):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC8_TABLE = _make_crc8_table()
 
 def read_user_parameters(filename, username):
     """
-    Reads parameters for a specific user from a JSON file.
-    :param filename: The path to the JSON file.
+    Reads parameters for a specific user from the user database.
+    :param filename: The path to the user database.
     :param username: The username to look up.
-    :return: A dictionary of user parameters or None if the user is not found.
+    :return: A dictionary of user parameters (plus "mode") or None if the user is not found.
     """
+    from user_store import UserStore
+    store = UserStore(filename)
     try:
-        with open(filename, "r") as file:
-            users = json.load(file)
-        user_data = users.get(username)
-        if not user_data:
-            print(f"User '{username}' not found in the file.")
-            return None
-        return user_data.get("parameters")
-    except FileNotFoundError:
-        print(f"File '{filename}' not found.")
+        user_data = store.get(username)
+    finally:
+        store.close()
+    if not user_data:
+        print(f"User '{username}' not found in the file.")
         return None
+    parameters = dict(user_data["parameters"])
+    parameters.setdefault("mode", user_data["mode"])
+    return parameters
+
+
+class PacketCodec:
+    """
+    Encodes and decodes SET_PARAMS packets.
+
+    Each pacing mode gets one precompiled struct laid out as SYNC, FN_CODE,
+    sequence number, mode code and then that mode's parameters from
+    PARAM_FOR_MODES, using the wire types from the parameter schema in
+    modes.py. A CRC-8 over
+    everything after SYNC closes the packet. Packets are packed into a
+    reusable buffer, so encoding allocates nothing per field.
+    """
+
+    def __init__(self, param_for_modes=PARAM_FOR_MODES, wire_types=PARAM_WIRE_TYPES, defaults=PARAM_DEFAULTS):
+        self.defaults = defaults
+        self.layouts = {}
+        for mode, names in param_for_modes.items():
+            types = [wire_types[name] for name in names]
+            layout = struct.Struct('<BBBB' + ''.join(types))
+            converters = tuple(float if wire_type == 'f' else _to_int for wire_type in types)
+            self.layouts[mode] = (layout, tuple(names), converters)
+        self.modes_by_code = {MODE_CODES[mode]: mode for mode in self.layouts}
+        self.buffer = bytearray(max(layout.size for layout, _, _ in self.layouts.values()) + 1)
+
+    def packet_size(self, mode):
+        # Total bytes on the wire for a mode, CRC included
+        return self.layouts[mode][0].size + 1
+
+    def values_for(self, mode, params):
+        """
+        Returns the wire values of a mode's parameters, filling in defaults.
+        Everything is converted before packing so a bad value fails early.
+        :raises ValueError: If the mode is unknown or a value is not numeric.
+        """
+        if mode not in self.layouts:
+            raise ValueError(f"Unknown pacing mode '{mode}'.")
+        _, names, converters = self.layouts[mode]
+        defaults = self.defaults
+        try:
+            return [convert(params.get(name, defaults[name])) for name, convert in zip(names, converters)]
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid parameter for mode {mode}: {e}") from None
+
+    def _pack(self, buffer, offset, mode, values, seq, sync, fn_code):
+        layout = self.layouts[mode][0]
+        try:
+            layout.pack_into(buffer, offset, sync, fn_code, seq & 0xFF, MODE_CODES[mode], *values)
+        except struct.error as e:
+            raise ValueError(f"Parameter out of range for mode {mode}: {e}") from None
+        end = offset + layout.size
+        with memoryview(buffer) as view:
+            buffer[end] = crc8(view[offset + 1:end])
+        return end + 1
+
+    def encode(self, mode, params, seq=0, sync=SYNC, fn_code=FN_CODE_SET_PARAMS):
+        """
+        Packs one packet into the codec's reusable buffer.
+        :return: A memoryview of the packet, valid until the next encode.
+        """
+        values = self.values_for(mode, params)
+        end = self._pack(self.buffer, 0, mode, values, seq, sync, fn_code)
+        return memoryview(self.buffer)[:end]
+
+    def encode_batch(self, settings, first_seq=0, sync=SYNC, fn_code=FN_CODE_SET_PARAMS):
+        """
+        Packs several packets back to back so they can be sent in one write.
+        :param settings: Iterable of (mode, params) pairs.
+        :param first_seq: Sequence number of the first packet, the rest count up.
+        :return: A bytearray holding every packet.
+        """
+        converted = [(mode, self.values_for(mode, params)) for mode, params in settings]
+        out = bytearray(sum(self.packet_size(mode) for mode, _ in converted))
+        offset = 0
+        for index, (mode, values) in enumerate(converted):
+            offset = self._pack(out, offset, mode, values, first_seq + index, sync, fn_code)
+        return out
+
+    def decode(self, data):
+        """
+        Unpacks a packet produced by encode().
+        :return: A (seq, mode, params) tuple.
+        :raises ValueError: If the mode code is unknown, the packet is short
+            or its CRC does not match.
+        """
+        mode = self.modes_by_code.get(data[3]) if len(data) > 3 else None
+        if mode is None:
+            raise ValueError("Unknown or missing mode code.")
+        layout, names, _ = self.layouts[mode]
+        if len(data) < layout.size + 1:
+            raise ValueError(f"Packet too short for mode {mode}.")
+        if crc8(memoryview(data)[1:layout.size]) != data[layout.size]:
+            raise ValueError("Packet CRC mismatch.")
+        values = layout.unpack_from(data)
+        return values[2], mode, dict(zip(names, values[4:]))
+
+
+def _to_int(value):
+    return int(round(value))
+
+
+_CODEC = PacketCodec()
 
 
 def create_packet(sync, fn_code, params):
@@ -37,112 +197,198 @@ def create_packet(sync, fn_code, params):
     Creates a packet based on user parameters.
     :param sync: SYNC byte.
     :param fn_code: Function code byte.
-    :param params: User parameters dictionary.
+    :param params: User parameters dictionary, including the "mode" key.
     :return: A bytearray packet.
     """
-    packet = bytearray()
+    return bytearray(_CODEC.encode(params["mode"], params, sync=sync, fn_code=fn_code))
+
+
+def create_echo_request(sync=SYNC):
+    """
+    Creates the request that asks the pacemaker to echo a telemetry frame.
+    Used as the handshake when probing ports.
+    :return: A bytes packet (SYNC, FN_CODE_ECHO, CRC-8).
+    """
+    return bytes((sync, FN_CODE_ECHO, crc8((FN_CODE_ECHO,))))
 
-    # Append fields
-    packet.append(sync)                  # 1 byte for SYNC
-    packet.append(fn_code)               # 1 byte for FN_CODE
-    packet.append(ord(params["mode"][0]))  # 1 byte for mode (assuming 'mode' is a single character)
-    packet.append(params["Lower Rate Limit (ppm)"])   # 1 byte
-    packet.append(params["Upper Rate Limit (ppm)"])   # 1 byte
-    packet.extend(struct.pack('<f', params["Ventricular Amplitude (V)"]))  # 4 bytes float
-    packet.extend(struct.pack('<f', params["Ventricular Pulse Width (ms)"]))  # 4 bytes float
-    packet.extend(struct.pack('<f', params["Ventricular Sensitivity (mV)"]))  # 4 bytes float
-    packet.extend(struct.pack('<f', params["Maximum Sensor Rate (ppm)"]))  # 4 bytes float
-    packet.extend(struct.pack('<H', params["VRP (ms)"]))  # 2 bytes uint16
-    packet.extend(struct.pack('<H', params["Reaction Time (s)"]))  # 2 bytes uint16
-    packet.append(params.get("Response Factor", 1))  # 1 byte
-    packet.append(params.get("Rate Smoothing (%)", 6))  # 1 byte
 
-    return packet
+def crc8(data, crc=0):
+    """
+    Computes the CRC-8 (polynomial 0x07) of a bytes-like object.
+    :param data: Bytes, bytearray or memoryview to checksum.
+    :param crc: Initial CRC value, used to continue a running checksum.
+    :return: The CRC as an int in 0..255.
+    """
+    table = _CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
 
+class FrameDecoder:
+    """
+    Incremental decoder for frames coming back from the pacemaker.
 
-def receive_packet(ser):
+    Frames are laid out as SYNC, FN_CODE, payload, CRC-8 (over FN_CODE and
+    payload). Bytes can be fed in chunks of any size; frames split across
+    chunks are completed on a later feed, and garbage or corrupted frames are
+    skipped by searching for the next SYNC byte.
     """
-    Receives and parses a packet from the serial port.
+
+    def __init__(self, layouts=None):
+        self.layouts = FRAME_LAYOUTS if layouts is None else layouts
+        self.buffer = bytearray()
+        self.pos = 0  # Start of the bytes that have not been consumed yet
+        self.dropped_bytes = 0
+        self.crc_errors = 0
+
+    def feed(self, chunk):
+        """
+        Appends a chunk of received bytes and yields every complete frame.
+        :param chunk: Bytes read from the serial port (may be empty).
+        :return: A generator of decoded frame namedtuples.
+        """
+        buf = self.buffer
+        if self.pos:
+            del buf[:self.pos]
+            self.pos = 0
+        buf += chunk
+
+        while True:
+            end = len(buf)
+            sync = buf.find(SYNC, self.pos)
+            if sync < 0:
+                self.dropped_bytes += end - self.pos
+                self.pos = end
+                return
+            self.dropped_bytes += sync - self.pos
+            self.pos = sync
+            if sync + 1 >= end:
+                return  # Need the function code before going further
+
+            layout = self.layouts.get(buf[sync + 1])
+            if layout is None:
+                # Not a frame start, just a data byte that happened to be SYNC
+                self.dropped_bytes += 1
+                self.pos = sync + 1
+                continue
+
+            frame_struct, frame_type = layout
+            payload_start = sync + 2
+            crc_index = payload_start + frame_struct.size
+            if crc_index >= end:
+                return  # Partial frame, wait for the rest
+
+            view = memoryview(buf)
+            try:
+                valid = crc8(view[sync + 1:crc_index]) == buf[crc_index]
+                if valid:
+                    frame = frame_type._make(frame_struct.unpack_from(view, payload_start))
+            finally:
+                view.release()
+
+            if not valid:
+                self.crc_errors += 1
+                self.dropped_bytes += 1
+                self.pos = sync + 1
+                continue
+
+            self.pos = crc_index + 1
+            yield frame
+
+
+# Decoder kept for each port object when callers don't pass their own, so
+# bytes read past the end of one frame are still there for the next call
+_port_decoders = weakref.WeakKeyDictionary()
+
+
+def decoder_for(ser):
+    """Returns the FrameDecoder shared by every read of a port object."""
+    decoder = _port_decoders.get(ser)
+    if decoder is None:
+        decoder = _port_decoders[ser] = FrameDecoder()
+    return decoder
+
+
+def receive_packet(ser, decoder=None):
+    """
+    Reads from the serial port until one telemetry frame has been decoded.
+    Other frames (e.g. ACKs) arriving first are skipped.
     :param ser: Serial object.
+    :param decoder: FrameDecoder to keep state in across calls (default: the
+        one shared by every read of `ser`).
+    :return: The decoded frame, or None if the port timed out first.
     """
-    try:
-        # Define packet length
-        packet_length = 45  # Adjusted for expected packet structure
-        received_data = ser.read(packet_length)
-
-        if len(received_data) != packet_length:
-            raise ValueError(f"Incomplete packet received! Expected {packet_length} bytes, got {len(received_data)}.")
-
-        # Parse fields
-        mode = received_data[0]  # 1 byte
-        lower_rate = received_data[1]  # 1 byte
-        upper_rate = received_data[2]  # 1 byte
-        atr_amp = struct.unpack('<f', received_data[3:7])[0]  # 4 bytes float
-        vent_amp = struct.unpack('<f', received_data[7:11])[0]  # 4 bytes float
-        atr_width = struct.unpack('<f', received_data[11:15])[0]  # 4 bytes float
-        vent_width = struct.unpack('<f', received_data[15:19])[0]  # 4 bytes float
-        vrp = struct.unpack('<H', received_data[19:21])[0]  # 2 bytes uint16
-        arp = struct.unpack('<H', received_data[21:23])[0]  # 2 bytes uint16
-        hysteresis = received_data[23]  # 1 byte
-        rate_smoothing = received_data[24]  # 1 byte
-        activity_threshold = received_data[25]  # 1 byte
-        reaction_time = received_data[26]  # 1 byte
-        response_factor = received_data[27]  # 1 byte
-        recovery_time = received_data[28]  # 1 byte
-
-        # Electrograms
-        vent_electrogram = struct.unpack('<H', received_data[29:31])[0]  # 2 bytes uint16
-        atr_electrogram = struct.unpack('<H', received_data[31:33])[0]  # 2 bytes uint16
-
-        # Display received data
-        print("Received Data:")
-        print(f"Mode: {mode}")
-        print(f"Lower Rate Limit: {lower_rate}")
-        print(f"Upper Rate Limit: {upper_rate}")
-        print(f"Atrium Pulse Amplitude: {atr_amp}")
-        print(f"Ventricle Pulse Amplitude: {vent_amp}")
-        print(f"Atrium Pulse Width: {atr_width}")
-        print(f"Ventricle Pulse Width: {vent_width}")
-        print(f"VRP: {vrp}")
-        print(f"ARP: {arp}")
-        print(f"Hysteresis: {hysteresis}")
-        print(f"Rate Smoothing: {rate_smoothing}")
-        print(f"Activity Threshold: {activity_threshold}")
-        print(f"Reaction Time: {reaction_time}")
-        print(f"Response Factor: {response_factor}")
-        print(f"Recovery Time: {recovery_time}")
-        print(f"Ventricle Electrogram: {vent_electrogram}")
-        print(f"Atrium Electrogram: {atr_electrogram}")
-
-    except Exception as e:
-        print("Error receiving or parsing packet:", str(e))
+    if decoder is None:
+        decoder = decoder_for(ser)
+
+    # Frames already buffered from an earlier read come first
+    for frame in decoder.feed(b""):
+        if type(frame) is TelemetryFrame:
+            return frame
+
+    while True:
+        chunk = ser.read(ser.in_waiting or 1)
+        if not chunk:
+            return None
+        for frame in decoder.feed(chunk):
+            if type(frame) is TelemetryFrame:
+                return frame
+
+
+def iter_frames(ser, decoder=None):
+    """
+    Yields telemetry frames from the serial port as they arrive, skipping
+    any other frames.
+    :param ser: Serial object.
+    :param decoder: FrameDecoder to keep state in across calls (default: the
+        one shared by every read of `ser`).
+    """
+    if decoder is None:
+        decoder = decoder_for(ser)
+    while True:
+        for frame in decoder.feed(ser.read(ser.in_waiting or 1)):
+            if type(frame) is TelemetryFrame:
+                yield frame
 
 
 # Main Execution
 if __name__ == "__main__":
-    json_file = "users.json"  # Replace with actual JSON file
+    json_file = "users.db"  # Replace with actual user database
     username = "james"  # Replace with the username to process
 
     # Load user parameters
     user_params = read_user_parameters(json_file, username)
     if user_params:
+        import serial
+
+        ser = None
         try:
             # Initialize serial communication
             ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=TIMEOUT)
             ser.reset_output_buffer()
             ser.reset_input_buffer()
 
-            # Create and send packet
-            packet = create_packet(SYNC, FN_CODE_SET_PARAMS, user_params)
-            ser.write(packet)
-            print("Packet sent successfully.")
+            # Send the parameters and wait for the device to acknowledge them
+            from param_link import write_parameters
+            request = write_parameters(ser, user_params["mode"], user_params)
+            if request.applied:
+                print(f"Parameters applied in {request.round_trip * 1000:.1f} ms.")
+            else:
+                print(f"Parameters not applied: {request.error}")
 
-            # Receive and parse packet
-            time.sleep(1)  # Allow time for response
-            receive_packet(ser)
+            # Receive and parse packet (the read itself waits up to TIMEOUT)
+            frame = receive_packet(ser)
+            if frame is None:
+                print("No telemetry frame received.")
+            else:
+                print("Received Data:")
+                for field, value in frame._asdict().items():
+                    print(f"{field}: {value}")
 
         except Exception as e:
             print(f"Error during UART communication: {e}")
         finally:
-            ser.close()
+            if ser is not None:
+                ser.close()
             print("Serial communication closed.")
@@ -0,0 +1,85 @@
+import threading
+
+
+class SettingsWriter:
+    """
+    Persists (and optionally applies) parameter sets on a background thread.
+
+    Only the newest set waiting to be written is kept: anything submitted
+    while the thread is busy replaces the set queued before it, so a burst
+    of changes ends in one write to the database and one to the device
+    instead of one per change.
+    """
+
+    def __init__(self, save):
+        """
+        :param save: save(mode, params), called on the writer thread.
+        """
+        self.save = save
+        self.pending = None  # (mode, params, apply) waiting to be written
+        self.busy = False
+        self.writes = 0  # Sets actually written
+        self.failures = 0  # Sets whose save or apply raised
+        self.coalesced = 0  # Sets replaced before they were written
+        self.last_error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self.run, name="SettingsWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, mode, params, apply=None):
+        """
+        Queues a parameter set, replacing one that is still waiting.
+        :param apply: Optional apply(mode, params) called after the save,
+            e.g. to send the set to the pacemaker.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("SettingsWriter is closed.")
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = (mode, dict(params), apply)
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """
+        Waits until everything submitted so far has been written.
+        :return: False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.pending is None and not self.busy, timeout)
+
+    def close(self, timeout=None):
+        # Write what is still pending, then stop the thread
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending is not None or self._closed)
+                if self.pending is None:
+                    return  # Closed with nothing left to write
+                mode, params, apply = self.pending
+                self.pending = None
+                self.busy = True
+            written = False
+            try:
+                self.save(mode, params)
+                written = True
+                if apply is not None:
+                    apply(mode, params)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                print(f"Error writing settings for mode {mode}: {e}")
+            finally:
+                with self._cond:
+                    self.busy = False
+                    if written:
+                        self.writes += 1
+                    if self.last_error is not None:
+                        self.failures += 1
+                    self._cond.notify_all()
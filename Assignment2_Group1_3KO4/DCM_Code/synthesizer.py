@@ -0,0 +1,263 @@
+import math
+
+import numpy as np
+
+from modes import PARAM_DEFAULTS, PARAM_FOR_MODES
+
+DEFAULT_SAMPLE_RATE = 1000  # Samples per second
+DEFAULT_CHUNK_SIZE = 1000  # Samples per chunk yielded by stream()
+
+AV_DELAY = 0.15  # Seconds from an atrial event to the conducted QRS
+INTRINSIC_ATRIAL_RATE = 72  # Sinus rate (ppm) seen in ventricular-paced modes
+ACTIVITY_PERIOD = 120.0  # Seconds per rest/exercise cycle in rate-adaptive modes
+NOISE_LEVEL = 0.05  # Standard deviation of the additive noise (mV)
+WANDER_LEVEL = 0.1  # Amplitude of the respiratory baseline wander (mV)
+WANDER_FREQUENCY = 0.25  # Hz
+HEART_REFRACTORY = 0.25  # Seconds after a depolarization the myocardium can't be captured again
+SINUS_SWING = 15  # ppm the sinus rate drifts above and below LRL in inhibited modes
+SINUS_PERIOD = 60.0  # Seconds per slow/fast sinus cycle in inhibited modes
+
+def hann_wave(duration, sample_rate):
+    # Smooth unit bump lasting the given number of seconds
+    return np.hanning(max(int(duration * sample_rate), 3))
+
+
+def qrs_wave(duration, sample_rate):
+    # Biphasic unit QRS complex (scaled derivative of a Gaussian)
+    x = np.linspace(-3, 3, max(int(duration * sample_rate), 5))
+    wave = -x * np.exp(-x * x / 2)
+    return wave / np.abs(wave).max()
+
+
+def pace_spike(width_ms, amplitude, sample_rate):
+    # Pacing artifact: a narrow pulse with a short opposite-polarity recharge
+    width = max(int(width_ms * sample_rate / 1000), 1)
+    return np.concatenate((np.full(width, amplitude), np.full(width, -0.25 * amplitude)))
+
+
+def _place(template, offset, length):
+    # Put a template at an offset inside a zero array of the given length
+    out = np.zeros(length)
+    end = min(offset + len(template), length)
+    out[offset:end] = template[:end - offset]
+    return out
+
+
+class EGMSynthesizer:
+    """
+    Streaming synthesizer for atrial and ventricular electrograms.
+
+    In asynchronous modes (AOO, VOO, ...) beats are found from the pacing
+    rate by integrating a phase. In inhibited modes (AAI, VVI, ...) a sinus
+    rhythm drifting above and below LRL competes with the escape timer: an
+    intrinsic beat in the paced chamber outside the refractory period is
+    sensed and restarts the timer, so the trace alternates between sensed
+    runs and paced ones. That timeline is walked beat by beat; Rate
+    Smoothing and Hysteresis are left to PacingSimulator.
+
+    Beats are turned into impulse trains and convolved with per-event
+    waveform templates, so a chunk costs a handful of NumPy calls plus a
+    few steps per beat. Timers and convolution tails are carried between
+    chunks, so stream() can run forever with constant memory.
+    """
+
+    def __init__(self, mode, params=None, sample_rate=DEFAULT_SAMPLE_RATE, seed=None):
+        if mode not in PARAM_FOR_MODES:
+            raise ValueError(f"Unknown pacing mode '{mode}'.")
+        self.mode = mode
+        self.params = dict(PARAM_DEFAULTS)
+        self.params.update(params or {})
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.paced_chamber = mode[0]  # "A" or "V"
+        self.rate_adaptive = mode.endswith("R")
+        self.sensing = mode[1] != "O"  # Second letter: chamber sensed ("O" for none)
+        self.lower_rate = float(self.params["Lower Rate Limit (ppm)"])
+        self.sensor_rate = max(float(self.params["Maximum Sensor Rate (ppm)"]), self.lower_rate)
+
+        self.sample_count = 0  # Samples produced so far
+        self.pace_phase = 0.0  # Fraction of the current paced cycle elapsed
+        self.intrinsic_phase = 0.5  # Fraction of the current sinus cycle elapsed
+        self._build_templates()
+
+        if self.sensing:
+            chamber = "ARP (ms)" if self.paced_chamber == "A" else "VRP (ms)"
+            self.device_refractory = int(float(self.params[chamber]) * sample_rate / 1000)
+            self.heart_refractory = int(HEART_REFRACTORY * sample_rate)
+            # Sample numbers of the next events, and of the last timer restart and depolarization
+            self.timer_start = 0
+            self.next_pace = self._escape_interval(0)
+            self.next_sinus = int(self.intrinsic_phase * self._sinus_interval(0))
+            self.next_conducted = math.inf
+            self.last_depolarization = -math.inf
+
+    def _build_templates(self):
+        fs = self.sample_rate
+        chamber = "Atrial" if self.paced_chamber == "A" else "Ventricular"
+        self.pace_amplitude = float(self.params[f"{chamber} Amplitude (V)"])
+        spike = pace_spike(float(self.params[f"{chamber} Pulse Width (ms)"]), self.pace_amplitude, fs)
+
+        p_wave = 1.0 * hann_wave(0.08, fs)
+        qrs = 3.0 * qrs_wave(0.1, fs)
+        t_wave = 0.6 * hann_wave(0.16, fs)
+        t_offset = int(0.25 * fs)
+        ventricular = _place(qrs, 0, t_offset + len(t_wave))
+        ventricular[t_offset:] += t_wave
+
+        if self.paced_chamber == "A":
+            atrial_event = np.concatenate((spike, p_wave))
+            ventricular_event = ventricular
+        else:
+            atrial_event = p_wave
+            ventricular_event = np.concatenate((spike, 1.3 * ventricular))
+
+        # Each event shows on both channels, the far-field copy much smaller.
+        # "sensed" is an intrinsic beat in the paced chamber, without the spike.
+        length = max(len(atrial_event), len(ventricular_event))
+        self.templates = {
+            "A": (_place(atrial_event, 0, length), _place(0.1 * p_wave, 0, length)),
+            "V": (_place(0.2 * qrs, 0, length), _place(ventricular_event, 0, length)),
+        }
+        # "spike" is a pace that fell in the myocardium's refractory period and didn't capture
+        self.templates["spike"] = ((_place(spike, 0, length), np.zeros(length)) if self.paced_chamber == "A"
+                                   else (np.zeros(length), _place(spike, 0, length)))
+        if self.paced_chamber == "A":
+            self.templates["sensed"] = (_place(p_wave, 0, length), _place(0.1 * p_wave, 0, length))
+        else:
+            self.templates["sensed"] = (_place(0.2 * qrs, 0, length), _place(ventricular, 0, length))
+        self.av_delay = int(AV_DELAY * fs)
+        self.tail_length = self.av_delay + length - 1
+        self.atrial_tail = np.zeros(self.tail_length)
+        self.ventricular_tail = np.zeros(self.tail_length)
+
+    def pacing_rates(self, t):
+        """Return the pacing rate (ppm) at each time in t (seconds)."""
+        if not self.rate_adaptive:
+            return np.full(len(t), self.lower_rate)
+        activity = 0.5 - 0.5 * np.cos(2 * np.pi * t / ACTIVITY_PERIOD)
+        return self.lower_rate + (self.sensor_rate - self.lower_rate) * activity
+
+    def _escape_interval(self, index):
+        # Samples from a timer restart at sample `index` to the next pace
+        rate = float(self.pacing_rates(np.array([index / self.sample_rate]))[0])
+        return int(round(60.0 * self.sample_rate / rate))
+
+    def _sinus_interval(self, index):
+        # Samples to the next sinus beat, the rate drifting around LRL
+        rate = self.lower_rate + SINUS_SWING * math.sin(2 * math.pi * index / self.sample_rate / SINUS_PERIOD)
+        return int(round(60.0 * self.sample_rate / rate))
+
+    def _device_events(self, end):
+        """
+        Walks an inhibited mode's beats in time order up to sample `end`.
+        :return: (paced, missed, sensed, sinus) lists of sample numbers:
+            paces that captured, paces that didn't, intrinsic beats in the
+            paced chamber and, in ventricular modes, the atrial sinus beats.
+        """
+        paced, missed, sensed, sinus = [], [], [], []
+        while True:
+            index = min(self.next_pace, self.next_sinus, self.next_conducted)
+            if index >= end:
+                return paced, missed, sensed, sinus
+            if index == self.next_pace:
+                if index - self.last_depolarization < self.heart_refractory:
+                    missed.append(index)  # Paced right after a beat the device ignored
+                else:
+                    paced.append(index)
+                    self.last_depolarization = index
+                self._restart(index)
+                if self.paced_chamber == "A":
+                    self.next_sinus = index + self._sinus_interval(index)  # A pace resets the sinus node
+            elif index == self.next_conducted:
+                self.next_conducted = math.inf
+                self._intrinsic(index, sensed)
+            else:
+                self.next_sinus = index + self._sinus_interval(index)
+                if self.paced_chamber == "A":
+                    self._intrinsic(index, sensed)
+                else:
+                    sinus.append(index)
+                    self.next_conducted = index + self.av_delay
+
+    def _intrinsic(self, index, beats):
+        # An intrinsic beat in the paced chamber, sensed unless the device is refractory
+        if index - self.last_depolarization < self.heart_refractory:
+            return  # The myocardium is still refractory
+        self.last_depolarization = index
+        beats.append(index)
+        if index - self.timer_start >= self.device_refractory:
+            self._restart(index)
+
+    def _restart(self, index):
+        self.timer_start = index
+        self.next_pace = index + self._escape_interval(index)
+
+    def _beats(self, rates, phase):
+        # Sample offsets where the integrated phase crosses a whole cycle
+        cycles = phase + np.cumsum(rates) / (60.0 * self.sample_rate)
+        whole = np.floor(cycles)
+        offsets = np.flatnonzero(np.diff(whole, prepend=0.0) > 0)
+        return offsets, cycles[-1] - whole[-1]
+
+    def read(self, count):
+        """
+        Produces the next count samples of both channels.
+        :param count: Number of samples to generate.
+        :return: A (atrial, ventricular) tuple of float arrays.
+        """
+        if count <= 0:
+            return np.zeros(0), np.zeros(0)
+        fs = self.sample_rate
+        t = (self.sample_count + np.arange(count)) / fs
+
+        if self.sensing:
+            start = self.sample_count
+            paced, missed, sensed, sinus = (np.array(beats, dtype=int) - start
+                                            for beats in self._device_events(start + count))
+            if self.paced_chamber == "A":
+                # Paced and sensed atrial beats alike conduct to the ventricle
+                events = (("A", paced), ("spike", missed), ("sensed", sensed),
+                          ("V", np.concatenate((paced, sensed)) + self.av_delay))
+            else:
+                events = (("V", paced), ("spike", missed), ("sensed", sensed), ("A", sinus))
+        elif self.paced_chamber == "A":
+            paced, self.pace_phase = self._beats(self.pacing_rates(t), self.pace_phase)
+            # Paced atrium conducts to the ventricle after the AV delay
+            events = (("A", paced), ("V", paced + self.av_delay))
+        else:
+            # Ventricular pacing with an independent sinus rhythm above it
+            paced, self.pace_phase = self._beats(self.pacing_rates(t), self.pace_phase)
+            sinus = np.full(count, float(INTRINSIC_ATRIAL_RATE))
+            intrinsic, self.intrinsic_phase = self._beats(sinus, self.intrinsic_phase)
+            events = (("V", paced), ("A", intrinsic))
+
+        span = count + self.av_delay
+        atrial = np.zeros(count + self.tail_length)
+        ventricular = np.zeros(count + self.tail_length)
+        for chamber, offsets in events:
+            impulses = np.zeros(span)
+            impulses[offsets] = 1.0
+            atrial_template, ventricular_template = self.templates[chamber]
+            atrial[:span + len(atrial_template) - 1] += np.convolve(impulses, atrial_template)
+            ventricular[:span + len(ventricular_template) - 1] += np.convolve(impulses, ventricular_template)
+
+        # Overlap-add the parts of earlier beats that spilled into this chunk
+        atrial[:self.tail_length] += self.atrial_tail
+        ventricular[:self.tail_length] += self.ventricular_tail
+        self.atrial_tail = atrial[count:].copy()
+        self.ventricular_tail = ventricular[count:].copy()
+
+        wander = WANDER_LEVEL * np.sin(2 * np.pi * WANDER_FREQUENCY * t)
+        noise = self.rng.normal(0, NOISE_LEVEL, (2, count))
+        self.sample_count += count
+        return atrial[:count] + wander + noise[0], ventricular[:count] + wander + noise[1]
+
+    def generate(self, duration):
+        """Return (atrial, ventricular) arrays covering the next duration seconds."""
+        return self.read(int(duration * self.sample_rate))
+
+    def stream(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield (atrial, ventricular) chunks forever."""
+        while True:
+            yield self.read(chunk_size)
@@ -1,57 +1,61 @@
-import json
-import bcrypt
-USERS_FILE = 'users.json'
-MAX_USERS = 10
+from password_hasher import PasswordHasher
+from user_store import UserStore
+MAX_USERS = None  # No limit on accounts; set a number to cap registrations
 
 class UserManager:
     def __init__(self, root):
         self.root = root
-        self.users = self.load_users()
+        self.users = UserStore()  # Reads like the old users dictionary
+        self.hasher = PasswordHasher()
 
-    def load_users(self):
-        # Load users from file or return an empty dictionary
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-
-    def save_users(self):
-        # Save users to file
-        with open(USERS_FILE, 'w') as f:
-            json.dump(self.users, f, indent=4)
+    def save_settings(self, name, mode, parameters):
+        # Store the user's mode and its parameters (only their rows are written)
+        return self.users.save_settings(name, mode, parameters)
 
     def hash_password(self, password):
         # Hash password
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        return self.hasher.hash(password)
 
     def check_password(self, hashed_password, password):
         # Verify password
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return self.hasher.check(hashed_password, password)
 
     def register(self, name, password):
         # Register a new user
         if name in self.users:
             return False, "User already exists!"
-        if len(self.users) >= MAX_USERS:
+        if MAX_USERS is not None and len(self.users) >= MAX_USERS:
             return False, "Maximum user limit reached!"
         if name and password:
-            self.users[name] = {
-                'password': self.hash_password(password),
-                'mode': 'AOO',
-                'parameters': {}
-            }
-            self.save_users()
+            if not self.users.add_user(name, self.hash_password(password)):
+                return False, "User already exists!"
             return True, "User registered successfully!"
         return False, "Please enter both name and password."
 
     def login(self, name, password):
         # Login a user
-        if name in self.users and self.check_password(self.users[name]['password'], password):
-            return True, "Login successful!"
-        if name not in self.users:
+        user = self.users.get(name)
+        if user is None:
             return False, "User does not exist."
-        return False, "Incorrect password."
+        hashed_password = user['password']
+        if self.hasher.is_remembered(name, hashed_password, password):
+            return True, "Login successful!"
+        if not self.check_password(hashed_password, password):
+            return False, "Incorrect password."
+
+        # Bring the stored hash up to the current work factor
+        if self.hasher.needs_rehash(hashed_password):
+            hashed_password = self.hash_password(password)
+            self.users.set_password(name, hashed_password)
+        self.hasher.remember(name, hashed_password, password)
+        return True, "Login successful!"
+
+    def register_async(self, name, password):
+        # Run register() on the hashing pool; returns a Future of its result
+        return self.hasher.submit(self.register, name, password)
+
+    def login_async(self, name, password):
+        # Run login() on the hashing pool; returns a Future of its result
+        return self.hasher.submit(self.login, name, password)
 
 
@@ -0,0 +1,371 @@
+import difflib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import diagnostics
+
+DB_FILE = 'users.db'
+LEGACY_USERS_FILE = 'users.json'
+DEFAULT_MODE = 'AOO'
+SCHEMA_VERSION = 1
+PAGE_SIZE = 50  # Default number of users per page or search result
+FUZZY_CANDIDATES = 200  # Trigram matches re-ranked by fuzzy_search()
+KEYFRAME_INTERVAL = 32  # History versions between full snapshots
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'AOO'
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    name TEXT NOT NULL REFERENCES users(name) ON DELETE CASCADE,
+    mode TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, mode)
+);
+CREATE INDEX IF NOT EXISTS users_name_nocase ON users (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS name_trigrams (
+    trigram TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES users(name) ON DELETE CASCADE,
+    PRIMARY KEY (trigram, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS parameter_history (
+    name TEXT NOT NULL REFERENCES users(name) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    saved_at REAL NOT NULL,
+    mode TEXT NOT NULL,
+    keyframe INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parameter_history_time ON parameter_history (name, saved_at);
+"""
+
+
+def name_trigrams(name):
+    """Return the set of lowercase trigrams of a name, padded at both ends."""
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UserStore:
+    """
+    SQLite-backed store of users and their per-mode parameter sets.
+
+    Every write is its own transaction touching only the rows it changes,
+    and the database runs in WAL mode, so a crash mid-save can't damage
+    other records. Lookups go through the primary-key indexes, prefix
+    search through a case-insensitive name index and fuzzy search through
+    a trigram index. Parameter blobs are only read for the user asked for.
+
+    Every saved parameter set is also kept in parameter_history as a
+    numbered version. Most versions only store what changed since the one
+    before; every KEYFRAME_INTERVAL-th is a full snapshot, so rebuilding
+    any version reads at most that many rows.
+
+    It can be read like the old users dictionary: `name in store`,
+    `store.get(name, {})` and `store[name]` return
+    {"password", "mode", "parameters"} for the user's current mode.
+    """
+
+    def __init__(self, path=DB_FILE, legacy_file=LEGACY_USERS_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._latest = {}  # name -> (version, mode, params) of the newest history version
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+        # First run after the switch from users.json: bring the old users over
+        if legacy_file and os.path.exists(legacy_file) and len(self) == 0:
+            with open(legacy_file, 'r') as f:
+                self.import_users(json.load(f))
+
+        # Databases created before the trigram index existed need it filled in once
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            with self._lock, self.conn:
+                missing = self.conn.execute(
+                    "SELECT name FROM users WHERE name NOT IN (SELECT DISTINCT name FROM name_trigrams)").fetchall()
+                for (name,) in missing:
+                    self._index_name(name)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __contains__(self, name):
+        with self._lock:
+            row = self.conn.execute("SELECT 1 FROM users WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def __iter__(self):
+        with self._lock:
+            names = [row[0] for row in self.conn.execute("SELECT name FROM users ORDER BY name")]
+        return iter(names)
+
+    def __getitem__(self, name):
+        user = self.get(name)
+        if user is None:
+            raise KeyError(name)
+        return user
+
+    def get(self, name, default=None):
+        """Return the user's record for their current mode, or default."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT u.password, u.mode, p.data FROM users u "
+                "LEFT JOIN parameters p ON p.name = u.name AND p.mode = u.mode "
+                "WHERE u.name = ?", (name,)).fetchone()
+        if row is None:
+            return default
+        password, mode, data = row
+        return {'password': password, 'mode': mode, 'parameters': json.loads(data) if data else {}}
+
+    def get_parameters(self, name, mode):
+        """Return the parameters saved for one of the user's modes ({} if none)."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM parameters WHERE name = ? AND mode = ?", (name, mode)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def add_user(self, name, password_hash, mode=DEFAULT_MODE):
+        """
+        Inserts a new user.
+        :return: False if the name is already taken.
+        """
+        try:
+            with self._lock, self.conn:
+                self.conn.execute("INSERT INTO users (name, password, mode) VALUES (?, ?, ?)",
+                                  (name, password_hash, mode))
+                self._index_name(name)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def set_password(self, name, password_hash):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE users SET password = ? WHERE name = ?", (password_hash, name))
+
+    def save_settings(self, name, mode, parameters, saved_at=None):
+        """
+        Make mode the user's current mode and store its parameters.
+        A new history version is added unless nothing changed.
+        :param saved_at: Time of the change in seconds since the epoch (default: now).
+        """
+        with diagnostics.timer("store.save_settings"), self._lock, self.conn:
+            updated = self.conn.execute("UPDATE users SET mode = ? WHERE name = ?", (mode, name)).rowcount
+            if updated:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO parameters (name, mode, data) VALUES (?, ?, ?)",
+                    (name, mode, json.dumps(parameters)))
+                self._add_version(name, mode, parameters, time.time() if saved_at is None else saved_at)
+        return bool(updated)
+
+    def _add_version(self, name, mode, parameters, saved_at):
+        # Caller holds the lock inside a transaction
+        version, last_mode, last_params = self._latest_version(name)
+        if version and last_mode == mode and last_params == parameters:
+            return
+        version += 1
+        if version % KEYFRAME_INTERVAL == 1 or not last_params:
+            keyframe, data = True, dict(parameters)
+        else:
+            changed = {key: value for key, value in parameters.items() if last_params.get(key, object()) != value}
+            removed = [key for key in last_params if key not in parameters]
+            keyframe, data = False, {"set": changed, "unset": removed}
+        self.conn.execute(
+            "INSERT INTO parameter_history (name, version, saved_at, mode, keyframe, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, version, saved_at, mode, keyframe, json.dumps(data)))
+        self._latest[name] = (version, mode, dict(parameters))
+
+    def _latest_version(self, name):
+        # (version, mode, params) of the newest version, (0, None, {}) if there is none.
+        # The newest version number is always read from the database, since
+        # another store on the same file may have added one; the cached
+        # parameters are only reused while they are still the newest.
+        row = self.conn.execute(
+            "SELECT MAX(version) FROM parameter_history WHERE name = ?", (name,)).fetchone()
+        newest = row[0] or 0
+        cached = self._latest.get(name)
+        if cached is None or cached[0] != newest:
+            cached = self._latest[name] = self._rebuild(name, newest) if newest else (0, None, {})
+        return cached
+
+    def _rebuild(self, name, version):
+        # Replay deltas from the nearest keyframe at or before version
+        rows = self.conn.execute(
+            "SELECT version, mode, keyframe, data FROM parameter_history "
+            "WHERE name = ? AND version <= ? AND version >= ("
+            "  SELECT MAX(version) FROM parameter_history WHERE name = ? AND version <= ? AND keyframe = 1) "
+            "ORDER BY version", (name, version, name, version)).fetchall()
+        params, mode = {}, None
+        for _, mode, keyframe, data in rows:
+            data = json.loads(data)
+            if keyframe:
+                params = data
+            else:
+                params.update(data["set"])
+                for key in data["unset"]:
+                    params.pop(key, None)
+        return version, mode, params
+
+    def history(self, name, limit=PAGE_SIZE, before=None):
+        """
+        Lists a user's saved versions, newest first.
+        :param before: Only versions older than this one (for paging).
+        :return: A list of (version, saved_at, mode) tuples.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT version, saved_at, mode FROM parameter_history "
+                "WHERE name = ? AND (? IS NULL OR version < ?) ORDER BY version DESC LIMIT ?",
+                (name, before, before, limit))
+            return rows.fetchall()
+
+    def parameters_at(self, name, version=None, when=None):
+        """
+        Rebuilds a saved version of a user's parameters.
+        :param version: Version number to rebuild (default: the newest).
+        :param when: Instead of a version, the time (seconds since the
+            epoch) to look up; gives the version in effect at that moment.
+        :return: A (version, saved_at, mode, params) tuple, or None if there
+            is no such version.
+        """
+        with self._lock:
+            if when is not None:
+                row = self.conn.execute(
+                    "SELECT version FROM parameter_history WHERE name = ? AND saved_at <= ? "
+                    "ORDER BY saved_at DESC, version DESC LIMIT 1", (name, when)).fetchone()
+            elif version is not None:
+                row = self.conn.execute(
+                    "SELECT version FROM parameter_history WHERE name = ? AND version = ?", (name, version)).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT MAX(version) FROM parameter_history WHERE name = ?", (name,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            version, mode, params = self._rebuild(name, row[0])
+            saved_at = self.conn.execute(
+                "SELECT saved_at FROM parameter_history WHERE name = ? AND version = ?", (name, version)).fetchone()[0]
+        return version, saved_at, mode, params
+
+    def diff_versions(self, name, old, new):
+        """
+        Compares two saved versions of a user's parameters.
+        :return: {parameter: (old value, new value)} for everything that
+            differs, with None for a value missing on one side. A mode
+            change shows up under "mode".
+        :raises KeyError: If either version does not exist.
+        """
+        before = self.parameters_at(name, version=old)
+        after = self.parameters_at(name, version=new)
+        if before is None or after is None:
+            raise KeyError(old if before is None else new)
+        changes = {}
+        if before[2] != after[2]:
+            changes["mode"] = (before[2], after[2])
+        old_params, new_params = before[3], after[3]
+        for key in list(old_params) + [key for key in new_params if key not in old_params]:
+            if old_params.get(key) != new_params.get(key):
+                changes[key] = (old_params.get(key), new_params.get(key))
+        return changes
+
+    def rollback(self, name, version):
+        """
+        Makes an old version current again. The rollback is itself saved as
+        a new version, so the history is never rewritten.
+        :return: False if the version does not exist.
+        """
+        found = self.parameters_at(name, version=version)
+        if found is None:
+            return False
+        _, _, mode, params = found
+        return self.save_settings(name, mode, params)
+
+    def import_users(self, users):
+        """Upsert a whole {name: record} dictionary in one transaction."""
+        with diagnostics.timer("store.import_users"), self._lock, self.conn:
+            for name, record in users.items():
+                mode = record.get('mode', DEFAULT_MODE)
+                self.conn.execute(
+                    "INSERT INTO users (name, password, mode) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET password = excluded.password, mode = excluded.mode",
+                    (name, record['password'], mode))
+                self._index_name(name)
+                if record.get('parameters'):
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO parameters (name, mode, data) VALUES (?, ?, ?)",
+                        (name, mode, json.dumps(record['parameters'])))
+
+    def list_users(self, after=None, limit=PAGE_SIZE):
+        """
+        Returns one page of users in name order, without their parameters.
+        :param after: Last name of the previous page (None for the first page).
+        :return: A list of (name, mode) tuples.
+        """
+        with self._lock:
+            if after is None:
+                rows = self.conn.execute(
+                    "SELECT name, mode FROM users ORDER BY name LIMIT ?", (limit,))
+            else:
+                rows = self.conn.execute(
+                    "SELECT name, mode FROM users WHERE name > ? ORDER BY name LIMIT ?", (after, limit))
+            return rows.fetchall()
+
+    def search_prefix(self, prefix, limit=PAGE_SIZE, after=None):
+        """
+        Returns users whose name starts with prefix (ignoring case), in name order.
+        :param after: Last name of the previous page, for paging through results.
+        :return: A list of (name, mode) tuples.
+        """
+        with self._lock:
+            # A range scan on the NOCASE index instead of LIKE, which can't use it
+            rows = self.conn.execute(
+                "SELECT name, mode FROM users "
+                "WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE "
+                "AND (? IS NULL OR name > ? COLLATE NOCASE OR (name = ? COLLATE NOCASE AND name > ?)) "
+                "ORDER BY name COLLATE NOCASE, name LIMIT ?",
+                (prefix, prefix + '\uffff', after, after, after, after, limit))
+            return rows.fetchall()
+
+    def fuzzy_search(self, query, limit=10):
+        """
+        Returns the users whose names are closest to query, best first.
+        Candidates sharing the most trigrams with the query are fetched
+        through the index and re-ranked by similarity.
+        :return: A list of (name, score) tuples, score in 0..1.
+        """
+        trigrams = sorted(name_trigrams(query))
+        if not query or not trigrams:
+            return []
+        placeholders = ", ".join("?" * len(trigrams))
+        with self._lock:
+            candidates = [row[0] for row in self.conn.execute(
+                f"SELECT name FROM name_trigrams WHERE trigram IN ({placeholders}) "
+                "GROUP BY name ORDER BY COUNT(*) DESC LIMIT ?", (*trigrams, FUZZY_CANDIDATES))]
+        query = query.lower()
+        scored = [(name, difflib.SequenceMatcher(None, query, name.lower()).ratio()) for name in candidates]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def _index_name(self, name):
+        # Caller holds the lock inside a transaction
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO name_trigrams (trigram, name) VALUES (?, ?)",
+            [(trigram, name) for trigram in name_trigrams(name)])
+
+    def export_users(self):
+        """Return every user as the old {name: record} dictionary."""
+        return {name: self[name] for name in self}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
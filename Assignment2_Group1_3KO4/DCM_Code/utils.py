@@ -1,9 +1,8 @@
-import json
 import bcrypt
 import tkinter.messagebox as messagebox
 import tkinter as tk
 
-USERS_FILE = 'users.json'
+from user_store import UserStore
 
 class Utils:
 
@@ -13,15 +12,18 @@ class Utils:
 
 
     def load_users():
+        store = UserStore()
         try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
+            return store.export_users()
+        finally:
+            store.close()
 
     def save_users(users):
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f, indent=4)
+        store = UserStore()
+        try:
+            store.import_users(users)
+        finally:
+            store.close()
 
     def hash_password(password):
         salt = bcrypt.gensalt()